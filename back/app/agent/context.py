@@ -0,0 +1,145 @@
+import json
+
+from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from app.config import settings
+
+SUMMARY_PROMPT = """Resume la conversación entre un usuario y un asistente de viajes de Rutopia.
+Conserva: destinos, fechas, tamaño y tipo de grupo, preferencias y restricciones del
+usuario, y las experiencias (nombre e ID) que ya se mostraron o que le interesaron.
+Responde sólo con el resumen, en el idioma del usuario, en menos de 200 palabras."""
+
+_summary_model: ChatAnthropic | None = None
+
+
+def turn_starts(messages: list) -> list[int]:
+    """Índices donde empieza cada turno (cada mensaje del usuario)."""
+    return [i for i, message in enumerate(messages) if message.type == "human"]
+
+
+def window_start(messages: list, max_turns: int) -> int:
+    """Índice del primer mensaje que se manda verbatim (últimos max_turns turnos)."""
+    starts = turn_starts(messages)
+    if len(starts) <= max_turns:
+        return 0
+    return starts[-max_turns]
+
+
+def tool_result_ids(message: ToolMessage) -> list[str]:
+    """IDs de experiencias en el resultado de una herramienta."""
+    data = message.artifact
+    if data is None and isinstance(message.content, str):
+        try:
+            data = json.loads(message.content)
+        except json.JSONDecodeError:
+            return []
+
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        return []
+    return [
+        str(item["id"]) for item in data if isinstance(item, dict) and item.get("id")
+    ]
+
+
+def compact_tool_message(message: ToolMessage) -> ToolMessage:
+    """Reemplaza el resultado de una herramienta por una referencia corta (nombre + IDs)."""
+    ids = tool_result_ids(message)
+    reference = f"[Resultado anterior de {message.name or 'herramienta'} omitido"
+    reference += f"; IDs: {', '.join(ids)}]" if ids else "]"
+
+    return ToolMessage(
+        content=reference,
+        tool_call_id=message.tool_call_id,
+        name=message.name,
+        id=message.id,
+    )
+
+
+def build_context(
+    messages: list, summary_upto: int = 0, max_turns: int | None = None
+) -> tuple[list, dict]:
+    """
+    Arma el historial que se manda al modelo:
+    - los últimos max_turns turnos van completos
+    - los turnos anteriores cubiertos por el resumen se omiten
+    - del resto, los resultados de herramientas se compactan a referencias
+
+    Devuelve (mensajes, stats con tokens antes/después).
+    """
+    max_turns = max_turns or settings.context_window_turns
+    start = window_start(messages, max_turns)
+
+    # El resumen sólo puede cubrir turnos fuera de la ventana
+    summary_upto = min(summary_upto, start)
+
+    older = [
+        compact_tool_message(message) if message.type == "tool" else message
+        for message in messages[summary_upto:start]
+    ]
+    context = older + messages[start:]
+
+    tokens_before = count_tokens_approximately(messages)
+    tokens_after = count_tokens_approximately(context) if start else tokens_before
+    return context, {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+    }
+
+
+def get_summary_model() -> ChatAnthropic:
+    """Modelo (barato) para resumir la conversación (singleton)."""
+    global _summary_model
+    if _summary_model is None:
+        _summary_model = ChatAnthropic(
+            model=settings.context_summary_model,
+            api_key=settings.anthropic_api_key,
+            max_tokens=512,
+        )
+    return _summary_model
+
+
+def render_for_summary(messages: list) -> str:
+    """Convierte mensajes a texto plano para el resumen (sin resultados de herramientas)."""
+    lines = []
+    for message in messages:
+        if message.type == "tool":
+            ids = tool_result_ids(message)
+            if ids:
+                lines.append(f"[{message.name} devolvió: {', '.join(ids)}]")
+            continue
+
+        text = message.text if hasattr(message, "text") else str(message.content)
+        if text:
+            role = "Usuario" if message.type == "human" else "Asistente"
+            lines.append(f"{role}: {text}")
+    return "\n".join(lines)
+
+
+async def summarize_older_turns(state: dict) -> dict | None:
+    """
+    Pliega en el resumen los turnos que ya salieron de la ventana.
+    Devuelve los campos a guardar, o None si no hay nada nuevo que resumir.
+    Se llama al terminar el turno, fuera del camino crítico.
+    """
+    messages = state["messages"]
+    summary_upto = state.get("summary_upto", 0)
+    start = window_start(messages, settings.context_window_turns)
+
+    # Esperar a que haya al menos summary_min_turns turnos nuevos para plegar
+    pending_turns = len([i for i in turn_starts(messages) if summary_upto <= i < start])
+    if pending_turns < settings.context_summary_min_turns:
+        return None
+
+    previous = state.get("conversation_summary") or ""
+    transcript = render_for_summary(messages[summary_upto:start])
+    prompt = f"Resumen previo:\n{previous}\n\nConversación nueva:\n{transcript}"
+
+    response = await get_summary_model().ainvoke(
+        [SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=prompt)]
+    )
+    return {"conversation_summary": response.text, "summary_upto": start}
@@ -1,16 +1,23 @@
-import json
+import time
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import SystemMessage
+from langchain_core.messages.utils import message_chunk_to_message
+from langchain_core.runnables import RunnableConfig
 
 from app.config import settings
 from app.agent.state import AgentState
 from app.agent.tools import search_rutopia_experiences, get_experience_details
 from app.agent.prompts import SYSTEM_PROMPT
+from app.agent.context import build_context
+from app.agent.projection import project_search_summary
+from app.services.admission import AdmissionRejected, llm_limiter
+from app.services.metrics import MODEL_TOKENS, MODEL_TTFT_SECONDS, span
 
 
-# Tools disponibles
+# Tools disponibles. El orden y los schemas no cambian entre llamadas: forman
+# parte del prefijo que cachea Anthropic (tools -> system -> mensajes)
 tools = [search_rutopia_experiences, get_experience_details]
 
 # Modelo con tools
@@ -20,27 +27,92 @@ model = ChatAnthropic(
 
 
 def build_system_message(state: AgentState) -> SystemMessage:
-    """Construye el system message con contexto de búsquedas anteriores."""
-    content = SYSTEM_PROMPT
+    """
+    Construye el system message en bloques: SYSTEM_PROMPT fijo (marcado con
+    cache_control para reutilizarlo entre llamadas) y después el contexto
+    dinámico de la sesión (últimas experiencias y resumen).
+    """
+    static_block = {"type": "text", "text": SYSTEM_PROMPT}
+    if settings.prompt_cache_enabled:
+        static_block["cache_control"] = {"type": "ephemeral"}
+
+    content = [static_block]
+    dynamic = build_session_context(state)
+    if dynamic:
+        content.append({"type": "text", "text": dynamic})
+
+    return SystemMessage(content=content)
+
+
+def build_session_context(state: AgentState) -> str:
+    """Contexto que cambia por sesión/turno (va después del prefijo cacheable)."""
+    content = ""
 
     # Agregar contexto de última búsqueda si existe
     if state.get("last_search_results"):
-        content += "\n\n## Últimas experiencias mostradas al usuario:\n"
+        content += "## Últimas experiencias mostradas al usuario:\n"
         for i, exp in enumerate(state["last_search_results"][:5], 1):
             content += f"{i}. {exp.get('name', 'Sin nombre')} (ID: {exp.get('id')}) - {exp.get('location', '')}\n"
         content += "\nSi el usuario dice 'el primero', 'el segundo', etc., refiere a estas experiencias."
 
-    return SystemMessage(content=content)
+    # Resumen de los turnos que ya no se mandan completos
+    if state.get("conversation_summary"):
+        if content:
+            content += "\n\n"
+        content += "## Resumen de la conversación anterior:\n"
+        content += state["conversation_summary"]
 
+    return content
 
-async def agent_node(state: AgentState):
+
+async def agent_node(state: AgentState, config: RunnableConfig):
     """Nodo principal: el agente decide qué hacer."""
     system_message = build_system_message(state)
-    messages = [system_message] + state["messages"]
 
-    response = await model.ainvoke(messages)
+    # Historial acotado: últimos turnos completos, lo anterior compactado
+    history, stats = build_context(state["messages"], state.get("summary_upto", 0))
+    messages = [system_message] + history
+
+    # Cupo global para llamar al modelo (reparto justo entre sesiones)
+    async with llm_limiter.slot():
+        with span("agent_node") as record:
+            response = await stream_model(messages, config, record)
+
+    return {"messages": [response], "context_tokens_saved": stats["tokens_saved"]}
+
+
+async def stream_model(messages: list, config: RunnableConfig, record: dict):
+    """Llama al modelo en streaming midiendo tiempo al primer token y tokens usados."""
+    started = time.perf_counter()
+    response = None
 
-    return {"messages": [response]}
+    # Pasar config explícitamente: en Python 3.10 los callbacks de streaming
+    # no se propagan solos a llamadas async dentro del nodo
+    async for chunk in model.astream(messages, config):
+        if "ttft_ms" not in record and (chunk.content or chunk.tool_call_chunks):
+            ttft = time.perf_counter() - started
+            MODEL_TTFT_SECONDS.observe(ttft)
+            record["ttft_ms"] = round(ttft * 1000, 2)
+        response = chunk if response is None else response + chunk
+
+    if response is None:
+        # Stream vacío (conexión cortada o respuesta sin eventos): no hay mensaje que devolver
+        raise RuntimeError("El modelo terminó el stream sin devolver ningún chunk")
+
+    usage = response.usage_metadata or {}
+    for direction, key in (("in", "input_tokens"), ("out", "output_tokens")):
+        if usage.get(key):
+            MODEL_TOKENS.inc(usage[key], direction=direction)
+            record[f"tokens_{direction}"] = usage[key]
+
+    # Tokens leídos/escritos en la cache de prompts (si el proveedor los reporta)
+    details = usage.get("input_token_details") or {}
+    for direction in ("cache_read", "cache_creation"):
+        if details.get(direction):
+            MODEL_TOKENS.inc(details[direction], direction=direction)
+            record[f"tokens_{direction}"] = details[direction]
+
+    return message_chunk_to_message(response)
 
 
 def should_continue(state: AgentState) -> str:
@@ -55,27 +127,41 @@ def should_continue(state: AgentState) -> str:
     return END
 
 
+def tool_busy_message(error: AdmissionRejected) -> str:
+    """
+    Resultado de una herramienta rechazada por admisión (OpenAI/Supabase
+    saturados): le llega al modelo como error de la herramienta y el turno
+    sigue. ToolNode sólo atrapa el tipo de la anotación; el resto se propaga.
+    """
+    return (
+        "Servicio saturado: no se pudo completar la búsqueda en este momento. "
+        "Pide al usuario que lo intente de nuevo en unos segundos."
+    )
+
+
+def latest_tool_messages(messages: list) -> list:
+    """ToolMessages del último paso de tools (los que están al final del historial)."""
+    start = len(messages)
+    while start > 0 and messages[start - 1].type == "tool":
+        start -= 1
+    return messages[start:]
+
+
 def process_tool_results(state: AgentState) -> dict:
-    """Procesa resultados de tools y actualiza el estado."""
+    """
+    Actualiza last_search_results con la última búsqueda del paso.
+    Usa el artifact de la herramienta (sin re-parsear el content) y guarda sólo
+    una proyección mínima; la versión permite detectar búsquedas nuevas sin
+    comparar listas.
+    """
     updates = {}
 
-    # Buscar el último ToolMessage
-    for message in reversed(state["messages"]):
-        if message.type == "tool":
-            try:
-                content = message.content
-                if isinstance(content, str):
-                    results = json.loads(content)
-                else:
-                    results = content
-
-                # Si es una lista de experiencias, guardarla
-                if isinstance(results, list) and len(results) > 0:
-                    if isinstance(results[0], dict) and "lat" in results[0]:
-                        updates["last_search_results"] = results
-                        break
-            except (json.JSONDecodeError, TypeError):
-                pass
+    for message in latest_tool_messages(state["messages"]):
+        if message.name != "search_rutopia_experiences":
+            continue
+        if isinstance(message.artifact, list) and message.artifact:
+            updates["last_search_results"] = project_search_summary(message.artifact)
+            updates["last_search_version"] = state.get("last_search_version", 0) + 1
 
     return updates
 
@@ -86,7 +172,7 @@ def create_agent_graph():
 
     # Nodos
     workflow.add_node("agent", agent_node)
-    workflow.add_node("tools", ToolNode(tools))
+    workflow.add_node("tools", ToolNode(tools, handle_tool_errors=tool_busy_message))
     workflow.add_node("process_results", process_tool_results)
 
     # Edges
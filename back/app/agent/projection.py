@@ -0,0 +1,106 @@
+import json
+
+from app.config import settings
+
+# Campos de una experiencia que ve el modelo en los resultados de búsqueda
+SEARCH_FIELDS = (
+    "id",
+    "name",
+    "location",
+    "duration",
+    "type",
+    "intensity",
+    "family_friendly",
+    "includes_food",
+    "includes_transport",
+    "highlights",
+)
+
+# Campos de last_search_results: lo que necesita el system message para
+# resolver "el primero", "el segundo"... (el payload completo queda en el artifact)
+SUMMARY_FIELDS = ("id", "name", "location")
+
+MAX_LIST_ITEMS = 10  # Elementos por lista dentro de full_json
+
+# Límites mínimos al achicar los detalles para que quepan en tool_details_max_chars
+MIN_TEXT_CHARS = 80
+MIN_LIST_ITEMS = 3
+# Campos de los detalles que nunca se quitan (el modelo los necesita para citarla)
+REQUIRED_DETAIL_FIELDS = ("id", "name")
+
+
+def truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[: max_chars - 1].rstrip() + "…"
+
+
+def to_json(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def compact_value(value, max_chars: int, max_items: int = MAX_LIST_ITEMS):
+    """Quita valores vacíos, recorta textos largos y limita listas (recursivo)."""
+    if isinstance(value, str):
+        return truncate(value, max_chars)
+    if isinstance(value, dict):
+        compacted = {k: compact_value(v, max_chars, max_items) for k, v in value.items()}
+        return {k: v for k, v in compacted.items() if v not in (None, "", [], {})}
+    if isinstance(value, list):
+        items = [compact_value(v, max_chars, max_items) for v in value[:max_items]]
+        return [v for v in items if v not in (None, "", [], {})]
+    return value
+
+
+def project_search_results(experiences: list[dict]) -> tuple[str, list[dict]]:
+    """
+    Proyección compacta de los resultados de búsqueda para el contexto del modelo.
+    Devuelve también las experiencias que entraron en la proyección: el artifact
+    y last_search_results deben tener las mismas, en el mismo orden, para que
+    "la tercera" sea la misma para el modelo y para el resolver de referencias.
+    """
+    max_chars = settings.tool_text_field_max_chars
+    projected = [
+        compact_value({field: exp.get(field) for field in SEARCH_FIELDS}, max_chars)
+        for exp in experiences
+    ]
+
+    # Respetar el presupuesto quitando resultados del final (los menos relevantes)
+    content = to_json(projected)
+    while len(content) > settings.tool_search_max_chars and len(projected) > 1:
+        projected.pop()
+        content = to_json(projected)
+    return content, experiences[: len(projected)]
+
+
+def project_search_summary(experiences: list[dict]) -> list[dict]:
+    """Proyección mínima de los resultados para guardar en el estado de la sesión."""
+    return [{field: exp.get(field) for field in SUMMARY_FIELDS} for exp in experiences]
+
+
+def project_details(details: dict) -> str:
+    """
+    Proyección compacta de los detalles de una experiencia para el contexto del modelo.
+    Para respetar el presupuesto achica textos y listas y, si aún no alcanza,
+    quita los campos más largos: el resultado siempre es JSON válido.
+    """
+    max_chars = settings.tool_text_field_max_chars
+    max_items = MAX_LIST_ITEMS
+    projected = compact_value(details, max_chars, max_items)
+    content = to_json(projected)
+
+    while len(content) > settings.tool_details_max_chars and (
+        max_chars > MIN_TEXT_CHARS or max_items > MIN_LIST_ITEMS
+    ):
+        max_chars = max(max_chars // 2, MIN_TEXT_CHARS)
+        max_items = max(max_items // 2, MIN_LIST_ITEMS)
+        projected = compact_value(details, max_chars, max_items)
+        content = to_json(projected)
+
+    while len(content) > settings.tool_details_max_chars:
+        optional = [k for k in projected if k not in REQUIRED_DETAIL_FIELDS]
+        if not optional:
+            break
+        projected.pop(max(optional, key=lambda k: len(to_json(projected[k]))))
+        content = to_json(projected)
+    return content
@@ -0,0 +1,201 @@
+import asyncio
+import re
+import uuid
+
+from langchain_core.messages import AIMessage
+
+from app.agent.tools import get_experience_details
+from app.services.metrics import Counter, registry, span
+from app.services.speculation import content_tokens
+from app.services.vector_index import normalize_value
+
+REFERENCE_RESOLUTIONS = registry.register(
+    Counter(
+        "rutopia_reference_resolutions_total",
+        "Turnos con resultados previos según cómo se resolvió la referencia (ordinal/name/none)",
+    )
+)
+
+# Ordinales en español e inglés (texto ya sin acentos); -1 = el último
+ORDINALS = {
+    "primer": 1, "primero": 1, "primera": 1, "first": 1, "1st": 1,
+    "segundo": 2, "segunda": 2, "second": 2, "2nd": 2,
+    "tercer": 3, "tercero": 3, "tercera": 3, "third": 3, "3rd": 3,
+    "cuarto": 4, "cuarta": 4, "fourth": 4, "4th": 4,
+    "quinto": 5, "quinta": 5, "fifth": 5, "5th": 5,
+    "sexto": 6, "sexta": 6, "sixth": 6, "6th": 6,
+    "septimo": 7, "septima": 7, "seventh": 7, "7th": 7,
+    "octavo": 8, "octava": 8, "eighth": 8, "8th": 8,
+    "ultimo": -1, "ultima": -1, "last": -1,
+}
+_ordinal_words = "|".join(sorted(ORDINALS, key=len, reverse=True))
+# Formas que siempre van antes de un sustantivo ("el primer día")
+APOCOPES = {"primer", "tercer"}
+# Con artículo ("el primero", "the second") para no confundir "primero quiero...";
+# sin "lo": "lo primero que..." nunca es un resultado
+ORDINAL_PATTERN = re.compile(rf"\b(?:el|la|los|las|del|al|the)\s+({_ordinal_words})\b")
+NUMBER_PATTERN = re.compile(r"(?:\bopcion|\bnumero|\boption|\bnumber|#)\s*(\d)\b")
+
+# Sustantivos que confirman que el ordinal o el número habla de un resultado
+RESULT_NOUNS = {
+    "opcion", "opciones", "experiencia", "actividad", "tour", "resultado", "recomendacion",
+    "one", "ones", "option", "experience", "activity", "result", "recommendation",
+}
+# Sustantivos que no son resultados: "el primer día", "la primera vez", "opción 2 de hotel"
+OTHER_NOUNS = {
+    "dia", "dias", "vez", "veces", "semana", "mes", "ano", "noche", "manana", "tarde",
+    "hora", "parada", "paso", "hotel", "hoteles", "vuelo", "viaje", "visita", "parte",
+    "comida", "persona", "personas", "adulto", "adultos", "nino", "ninos",
+    "day", "days", "time", "times", "week", "month", "year", "night", "morning",
+    "evening", "hour", "stop", "step", "hotels", "flight", "trip", "visit", "part",
+    "meal", "person", "people", "adults", "kids", "thing",
+}
+# Lo único que puede seguir a un ordinal sin sustantivo de resultado: conectores y
+# verbos sobre el resultado ("el primero y el tercero", "the second sounds good")
+ORDINAL_FOLLOWERS = {
+    "y", "o", "u", "e", "me", "te", "se", "es", "esta", "suena", "parece", "tiene",
+    "incluye", "cuesta", "porfa", "tambien", "entonces", "pues",
+    "and", "or", "is", "sounds", "looks", "please", "too", "then",
+}
+
+# Si el usuario pide buscar ("algo parecido al primero") decide el modelo
+SEARCH_INTENT = re.compile(
+    r"\b(?:busca\w*|encuentra\w*|otr[oa]s|parecid[oa]s?|similar\w*|search\w*|find|look for|other|others)\b"
+)
+
+MAX_REFERENCES = 3  # "compara el primero y el tercero"
+MIN_NAME_TOKENS = 2  # Palabras propias del nombre que tiene que mencionar el usuario
+
+
+def following_words(text: str, position: int) -> list[str]:
+    """Hasta dos palabras que siguen a position (sin puntuación en medio)."""
+    match = re.match(r"\s+(\w+)(?:\s+(\w+))?", text[position:])
+    return [word for word in match.groups() if word] if match else []
+
+
+def is_ordinal_reference(ordinal: str, following: list[str]) -> bool:
+    """
+    Sólo cuenta si al ordinal le sigue un sustantivo de resultado, el fin de la
+    frase o un conector: "el primero", "la primera opción", "the second one",
+    "el primero y el tercero". Cualquier otra cosa no: "el primer día", "el
+    primero de mayo", "el segundo fin de semana", "the first day".
+    """
+    if not following or following[0] in RESULT_NOUNS:
+        return True
+    if ordinal in APOCOPES:
+        return False
+    return following[0] in ORDINAL_FOLLOWERS or following[:2] == ["por", "favor"]
+
+
+def is_number_reference(following: list[str]) -> bool:
+    """Número de opción: "la opción 2" sí, "opción 2 de hotel" no."""
+    if not following:
+        return True
+    if following[0] in OTHER_NOUNS:
+        return False
+    return not (
+        following[0] in ("de", "del", "of", "for")
+        and len(following) > 1
+        and following[1] in OTHER_NOUNS
+    )
+
+
+def resolve_ordinals(text: str, results: list[dict]) -> list[dict]:
+    positions = [
+        ORDINALS[match.group(1)]
+        for match in ORDINAL_PATTERN.finditer(text)
+        if is_ordinal_reference(match.group(1), following_words(text, match.end()))
+    ]
+    positions += [
+        int(match.group(1))
+        for match in NUMBER_PATTERN.finditer(text)
+        if is_number_reference(following_words(text, match.end()))
+    ]
+
+    resolved = []
+    for position in positions:
+        index = len(results) - 1 if position == -1 else position - 1
+        if 0 <= index < len(results) and results[index] not in resolved:
+            resolved.append(results[index])
+    return resolved
+
+
+def resolve_by_name(text: str, results: list[dict]) -> list[dict]:
+    """
+    Experiencia nombrada por el usuario: el nombre completo aparece en el mensaje
+    o se mencionan al menos MIN_NAME_TOKENS palabras que sólo tiene ese nombre.
+    Si varias empatan, no se resuelve (lo decide el modelo).
+    """
+    words = content_tokens(text)
+    names = [content_tokens(result.get("name") or "") for result in results]
+
+    scores = []
+    for index, (result, name) in enumerate(zip(results, names)):
+        full_name = normalize_value(result.get("name"))
+        if full_name and full_name in text:
+            scores.append((len(name) + 1000, index))
+            continue
+        others = set().union(*(n for i, n in enumerate(names) if i != index))
+        distinctive = (name - others) & words
+        if len(distinctive) >= MIN_NAME_TOKENS:
+            scores.append((len(distinctive), index))
+
+    if not scores:
+        return []
+    scores.sort(reverse=True)
+    if len(scores) > 1 and scores[0][0] == scores[1][0]:
+        return []
+    return [results[scores[0][1]]]
+
+
+def find_references(user_message: str, last_search_results: list[dict]) -> tuple[str, list[dict]]:
+    """
+    Experiencias de la última búsqueda a las que se refiere el mensaje
+    ("el primero", "the second one", "la opción 3" o por nombre).
+    Devuelve (tipo de referencia, experiencias); ("none", []) si no hay.
+    """
+    text = normalize_value(user_message)
+    if SEARCH_INTENT.search(text):
+        return "none", []
+
+    resolved = resolve_ordinals(text, last_search_results)
+    if resolved:
+        return "ordinal", resolved[:MAX_REFERENCES]
+
+    resolved = resolve_by_name(text, last_search_results)
+    if resolved:
+        return "name", resolved
+    return "none", []
+
+
+async def resolve_references(user_message: str, last_search_results: list[dict]) -> list:
+    """
+    Si el mensaje se refiere a experiencias ya mostradas, trae sus detalles antes
+    del grafo y los devuelve como un par tool_call/ToolMessage de
+    get_experience_details. El modelo responde con los detalles ya en el turno:
+    una llamada al modelo en lugar de dos (modelo -> herramienta -> modelo).
+    """
+    if not last_search_results:
+        return []
+
+    kind, experiences = find_references(user_message, last_search_results)
+    REFERENCE_RESOLUTIONS.inc(result=kind)
+    if not experiences:
+        return []
+
+    tool_calls = [
+        {
+            "name": get_experience_details.name,
+            "args": {"experience_id": str(experience["id"])},
+            "id": f"toolu_resolved_{uuid.uuid4().hex[:20]}",
+            "type": "tool_call",
+        }
+        for experience in experiences
+    ]
+
+    with span("resolve_references", kind=kind, count=len(tool_calls)):
+        tool_messages = await asyncio.gather(
+            *(get_experience_details.ainvoke(call) for call in tool_calls)
+        )
+
+    return [AIMessage(content="", tool_calls=tool_calls), *tool_messages]
@@ -1,3 +1,4 @@
+import operator
 from typing import Annotated
 from typing_extensions import TypedDict
 from langgraph.graph.message import add_messages
@@ -7,4 +8,8 @@ class AgentState(TypedDict):
     """Estado del agente conversacional."""
 
     messages: Annotated[list, add_messages]  # Historial de mensajes
-    last_search_results: list[dict]  # Últimas experiencias mostradas
+    last_search_results: list[dict]  # Últimas experiencias mostradas (id, name, location)
+    last_search_version: int  # Sube con cada búsqueda nueva (evita comparar listas)
+    conversation_summary: str  # Resumen de los turnos fuera de la ventana de contexto
+    summary_upto: int  # Cantidad de mensajes cubiertos por el resumen
+    context_tokens_saved: Annotated[int, operator.add]  # Tokens ahorrados en el turno
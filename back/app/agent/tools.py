@@ -1,10 +1,14 @@
 from langchain_core.tools import tool
-from app.services.search import search_experiences, get_experience_by_id
+from app.services.search import asearch_experiences_page, aget_experience_by_id
 from app.models.schemas import SearchFilters
+from app.agent.projection import project_search_results, project_details
+from app.services.metrics import span
 
 
-@tool
-def search_rutopia_experiences(
+# content_and_artifact: el modelo recibe una proyección compacta (content) y el
+# payload completo viaja aparte en ToolMessage.artifact (para el mapa/frontend)
+@tool(response_format="content_and_artifact")
+async def search_rutopia_experiences(
     semantic_query: str,
     destination: str | None = None,
     city: str | None = None,
@@ -14,7 +18,11 @@ def search_rutopia_experiences(
     environment_type: str | None = None,
     includes_food: bool | None = None,
     experience_type: str | None = None,
-) -> list[dict]:
+    near_lat: float | None = None,
+    near_lon: float | None = None,
+    radius_km: float | None = None,
+    page: int = 1,
+) -> tuple[str, list[dict]]:
     """
     Busca experiencias turísticas en el catálogo de Rutopia.
 
@@ -29,13 +37,15 @@ def search_rutopia_experiences(
         environment_type: Tipo de entorno - 'cenote', 'jungle', 'beach', 'city', 'desert', 'lake'
         includes_food: True si debe incluir comida
         experience_type: Tipo principal - 'culture', 'nature', 'adventure', 'wellness', 'gastronomy'
+        near_lat: Latitud del punto de referencia para buscar cerca (usar con near_lon y radius_km)
+        near_lon: Longitud del punto de referencia (ejemplo: Tulum 20.21, -87.46)
+        radius_km: Distancia máxima en km al punto de referencia (ejemplo: 15)
+        page: Página de resultados. Para "más opciones" repite la búsqueda con los
+              mismos parámetros y page=2, 3...: no repite experiencias ya mostradas
 
     Returns:
         Lista de experiencias con id, nombre, ubicación, coordenadas y detalles
     """
-    print(
-        f"Buscando experiencias con query: {semantic_query} {destination} {city} {family_friendly} {physical_intensity} {max_duration_hours} {environment_type} {includes_food} {experience_type}"
-    )
     filters = SearchFilters(
         semantic_query=semantic_query,
         destination=destination,
@@ -46,30 +56,44 @@ def search_rutopia_experiences(
         environment_type=environment_type,
         includes_food=includes_food,
         experience_type=experience_type,
+        near_lat=near_lat,
+        near_lon=near_lon,
+        radius_km=radius_km,
     )
 
-    results = search_experiences(filters, limit=8)
+    # Los argumentos van en la traza del turno (evento done con metrics_debug_trace)
+    with span(
+        "tool.search_rutopia_experiences", page=page, **filters.model_dump(exclude_none=True)
+    ) as record:
+        results = await asearch_experiences_page(filters, page=page, page_size=8)
 
-    # Convertir a dict para LangChain
-    return [exp.model_dump() for exp in results]
+        # Convertir a dict para LangChain
+        experiences = [exp.model_dump() for exp in results]
+        # El artifact lleva sólo las que ve el modelo (las mismas que last_search_results)
+        content, shown = project_search_results(experiences)
+        record["results"] = len(shown)
+        return content, shown
 
 
-@tool
-def get_experience_details(experience_id: str) -> dict:
+@tool(response_format="content_and_artifact")
+async def get_experience_details(experience_id: str) -> tuple[str, dict]:
     """
     Obtiene información detallada de una experiencia específica.
-    Usa esto cuando el usuario pregunte por más detalles, precios,
-    qué incluye, o información específica de una experiencia ya mostrada.
+    Usa esto cuando el usuario pregunte por más detalles, precios, si incluye
+    comida o transporte, o información específica de una experiencia ya mostrada.
 
     Args:
         experience_id: UUID de la experiencia (obtenido de búsquedas anteriores)
 
     Returns:
-        Detalles completos incluyendo precios, descripción, qué incluye, contacto
+        Detalles con tarifas, descripción, proveedor, ubicación, duración y si
+        incluye comida o transporte (sin disponibilidad ni datos de contacto)
     """
-    result = get_experience_by_id(experience_id)
+    with span("tool.get_experience_details"):
+        result = await aget_experience_by_id(experience_id)
 
     if result is None:
-        return {"error": "Experiencia no encontrada"}
+        error = {"error": "Experiencia no encontrada"}
+        return project_details(error), error
 
-    return result
+    return project_details(result), result
@@ -0,0 +1,173 @@
+import asyncio
+import time
+from collections import deque
+
+from fastapi import WebSocket
+
+from app.api.protocol import JSON_CODEC, Codec
+from app.config import settings
+from app.services.metrics import WS_SEND_SECONDS
+
+# Eventos donde sólo importa el último: si el cliente va lento se reemplazan
+LATEST_WINS = {"experiences", "queued"}
+
+
+class OutboundChannel:
+    """
+    Cola de salida por conexión WebSocket.
+
+    - Los tokens se juntan en un buffer y salen como un solo frame cada
+      stream_flush_interval segundos o al llegar a stream_flush_chars.
+    - El resto de eventos se encolan en orden (los tokens pendientes salen antes).
+    - Si el cliente es lento los tokens se siguen juntando sin frenar al grafo;
+      los eventos "último gana" se reemplazan y sólo cuando la cola de eventos
+      está llena send() espera (backpressure).
+    - Cada frame se serializa con el codec negociado (JSON o MessagePack).
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        flush_interval: float | None = None,
+        flush_chars: int | None = None,
+        max_pending: int | None = None,
+        codec: Codec = JSON_CODEC,
+    ):
+        self.websocket = websocket
+        self.codec = codec
+        self.flush_interval = flush_interval or settings.stream_flush_interval
+        self.flush_chars = flush_chars or settings.stream_flush_chars
+        self.max_pending = max_pending or settings.stream_max_pending
+
+        self._tokens: list[str] = []
+        self._token_chars = 0
+        self._first_token_at = 0.0
+        self._queue: deque[dict] = deque()
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer: asyncio.Task | None = None
+        self._error: BaseException | None = None
+        self.frames_sent = 0
+
+    def _check(self):
+        """Propaga errores del writer (cliente desconectado) y lo arranca si hace falta."""
+        if self._error is not None:
+            raise self._error
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._run())
+
+    def send_token(self, text: str):
+        """Agrega un token al buffer (nunca bloquea)."""
+        self._check()
+        first = not self._tokens
+        if first:
+            self._first_token_at = time.monotonic()
+        self._tokens.append(text)
+        self._token_chars += len(text)
+        self._idle.clear()
+        # El primer token arma la ventana del writer; un buffer lleno sale ya
+        if first or self._token_chars >= self.flush_chars:
+            self._wakeup.set()
+
+    def _take_tokens(self) -> dict | None:
+        if not self._tokens:
+            return None
+        event = {"type": "token", "content": "".join(self._tokens)}
+        self._tokens.clear()
+        self._token_chars = 0
+        return event
+
+    async def send(self, event: dict):
+        """Encola un evento respetando el orden con los tokens ya emitidos."""
+        self._check()
+
+        tokens = self._take_tokens()
+        if tokens:
+            self._queue.append(tokens)
+
+        if event.get("type") in LATEST_WINS:
+            for i, pending in enumerate(self._queue):
+                if pending.get("type") == event["type"]:
+                    del self._queue[i]
+                    break
+
+        self._queue.append(event)
+        self._idle.clear()
+        self._wakeup.set()
+
+        # Backpressure: esperar a que el cliente drene la cola
+        if len(self._queue) >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+            self._check()
+
+    async def flush(self):
+        """Espera a que todo lo encolado se haya enviado."""
+        self._check()
+        tokens = self._take_tokens()
+        if tokens:
+            self._queue.append(tokens)
+            self._wakeup.set()
+        await self._idle.wait()
+        self._check()
+
+    async def close(self, code: int = 1000):
+        """Envía lo pendiente, detiene el writer y cierra el socket."""
+        try:
+            if self._error is None:
+                await asyncio.wait_for(self.flush(), timeout=5)
+        except Exception:
+            pass
+        if self._writer:
+            self._writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _next_event(self) -> dict | None:
+        """Siguiente frame a enviar: cola primero, luego tokens según la ventana."""
+        while True:
+            if self._queue:
+                return self._queue.popleft()
+
+            if self._tokens:
+                age = time.monotonic() - self._first_token_at
+                full = self._token_chars >= self.flush_chars
+                if full or age >= self.flush_interval:
+                    return self._take_tokens()
+                timeout = self.flush_interval - age
+            else:
+                self._idle.set()
+                timeout = None
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self):
+        try:
+            while True:
+                event = await self._next_event()
+                payload = self.codec.encode(event)
+                started = time.perf_counter()
+                if self.codec.binary:
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                WS_SEND_SECONDS.observe(time.perf_counter() - started)
+                self.frames_sent += 1
+                if len(self._queue) < self.max_pending:
+                    self._space.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Cliente desconectado: despertar a quien esté esperando
+            self._error = e
+            self._space.set()
+            self._idle.set()
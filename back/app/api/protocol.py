@@ -0,0 +1,80 @@
+import orjson
+import ormsgpack
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Subprotocolos que acepta /ws/chat (Sec-WebSocket-Protocol)
+JSON_SUBPROTOCOL = "rutopia.json"
+MSGPACK_SUBPROTOCOL = "rutopia.msgpack"
+
+
+class Codec:
+    """Formato de los frames de un WebSocket: JSON (texto) o MessagePack (binario)."""
+
+    name: str = "json"
+    binary: bool = False
+
+    def encode(self, event: dict) -> str | bytes:
+        # orjson es ~5x más rápido que json.dumps y ya produce JSON compacto
+        return orjson.dumps(event, default=str).decode()
+
+    def decode(self, data: str | bytes) -> dict:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    binary = True
+
+    def encode(self, event: dict) -> bytes:
+        return ormsgpack.packb(event, default=str)
+
+    def decode(self, data: str | bytes) -> dict:
+        # Un cliente msgpack puede seguir mandando texto JSON
+        if isinstance(data, str):
+            return orjson.loads(data)
+        return ormsgpack.unpackb(data)
+
+
+JSON_CODEC = Codec()
+MSGPACK_CODEC = MsgpackCodec()
+
+
+def negotiate(websocket: WebSocket) -> tuple[Codec, str | None]:
+    """
+    Elige el formato de la conexión. Devuelve (codec, subprotocolo a aceptar).
+
+    - Subprotocolo: Sec-WebSocket-Protocol: rutopia.msgpack (o rutopia.json)
+    - Query param: /ws/chat/{session_id}?format=msgpack (navegadores sin subprotocolo)
+    - Por defecto JSON en frames de texto, compatible con los clientes actuales.
+    """
+    subprotocols = websocket.scope.get("subprotocols") or []
+    if MSGPACK_SUBPROTOCOL in subprotocols:
+        return MSGPACK_CODEC, MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in subprotocols:
+        return JSON_CODEC, JSON_SUBPROTOCOL
+
+    if websocket.query_params.get("format") == "msgpack":
+        return MSGPACK_CODEC, None
+    return JSON_CODEC, None
+
+
+async def receive_event(websocket: WebSocket, codec: Codec) -> dict:
+    """
+    Recibe un mensaje del cliente (texto JSON o binario MessagePack).
+    Lanza ValueError si no se puede decodificar como un objeto.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+
+    data = message.get("text")
+    if data is None:
+        data = message.get("bytes")
+
+    try:
+        event = codec.decode(data)
+    except (ValueError, TypeError):  # JSONDecodeError y MsgpackDecodeError son ValueError
+        raise ValueError("Invalid message format")
+    if not isinstance(event, dict):
+        raise ValueError("Invalid message format")
+    return event
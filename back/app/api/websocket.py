@@ -1,83 +1,166 @@
-import copy
-from datetime import datetime, timedelta
+import asyncio
+import time
 from fastapi import WebSocket, WebSocketDisconnect
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 
 from app.agent.graph import agent
 from app.agent.state import AgentState
+from app.agent.context import summarize_older_turns
+from app.agent.references import resolve_references
+from app.api.outbound import OutboundChannel
+from app.config import settings
+from app.services.admission import AdmissionRejected, bind_session
+from app.services.metrics import (
+    TURN_FIRST_TOKEN_SECONDS,
+    TURN_MODEL_CALLS,
+    TURN_SECONDS,
+    start_trace,
+)
+from app.services.prefetch import detail_prefetcher
+from app.services.sessions import SessionStore, create_session_store
+from app.services.speculation import finish_speculation, start_speculation
 
 
 class ConnectionManager:
     """Maneja las conexiones WebSocket y el estado de las sesiones."""
 
-    def __init__(self):
+    def __init__(self, store: SessionStore):
         self.active_connections: dict[str, WebSocket] = {}
-        self.sessions: dict[str, AgentState] = {}
-        self.session_last_active: dict[str, datetime] = {}
-
-    async def connect(self, websocket: WebSocket, session_id: str):
-        await websocket.accept()
+        self.store = store
+        self.session_locks: dict[str, asyncio.Lock] = {}
+        self.background_tasks: set[asyncio.Task] = set()
+
+    async def connect(
+        self, websocket: WebSocket, session_id: str, subprotocol: str | None = None
+    ):
+        await websocket.accept(subprotocol=subprotocol)
         self.active_connections[session_id] = websocket
-
-        if session_id not in self.sessions:
-            self.sessions[session_id] = {"messages": [], "last_search_results": []}
-
-        self.session_last_active[session_id] = datetime.now()
+        await self.store.touch(session_id)
 
     def disconnect(self, session_id: str):
         self.active_connections.pop(session_id, None)
 
-    def get_state(self, session_id: str) -> AgentState:
-        default_state = {"messages": [], "last_search_results": []}
-        state = self.sessions.get(session_id, default_state)
-        # Return deep copy to avoid race conditions
-        return copy.deepcopy(state)
+    def session_lock(self, session_id: str) -> asyncio.Lock:
+        """Lock por sesión: dos mensajes de la misma sesión no corren a la vez."""
+        lock = self.session_locks.get(session_id)
+        if lock is None:
+            lock = self.session_locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def get_state(self, session_id: str) -> AgentState:
+        return await self.store.load(session_id)
+
+    async def update_state(self, session_id: str, new_messages: list, fields: dict):
+        """Guarda sólo los mensajes nuevos del turno más los demás campos del estado."""
+        await self.store.append(session_id, new_messages, fields)
 
-    def update_state(self, session_id: str, state: AgentState):
-        # Store deep copy to avoid external mutations
-        self.sessions[session_id] = copy.deepcopy(state)
-        self.session_last_active[session_id] = datetime.now()
+    def run_in_background(self, coro):
+        """Lanza una tarea fuera del camino crítico (guardando la referencia)."""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def count_sessions(self) -> int:
+        return await self.store.count()
 
     async def cleanup_old_sessions(self, max_age_hours: int = 24):
         """Remove sessions that haven't been active and are disconnected."""
-        cutoff = datetime.now() - timedelta(hours=max_age_hours)
-        to_remove = [
-            sid
-            for sid, last_active in self.session_last_active.items()
-            if last_active < cutoff and sid not in self.active_connections
-        ]
-        for sid in to_remove:
-            self.sessions.pop(sid, None)
-            self.session_last_active.pop(sid, None)
+        await self.store.cleanup(
+            max_age_hours * 3600, keep=set(self.active_connections)
+        )
+        for sid, lock in list(self.session_locks.items()):
+            if sid not in self.active_connections and not lock.locked():
+                del self.session_locks[sid]
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(create_session_store())
 
 
-async def handle_chat_message(websocket: WebSocket, session_id: str, user_message: str):
+async def handle_chat_message(
+    channel: OutboundChannel, session_id: str, user_message: str
+):
     """Procesa un mensaje del usuario y envía respuestas por WebSocket."""
+    # Snapshot -> turno -> commit del delta, sin otro turno de la misma sesión en medio
+    async with manager.session_lock(session_id):
+        await run_chat_turn(channel, session_id, user_message)
 
-    state = manager.get_state(session_id)
 
-    # Create clean input state without mutating the original
-    input_state = {
-        "messages": state["messages"] + [HumanMessage(content=user_message)],
-        "last_search_results": state.get("last_search_results", []),
-    }
+def start_turn(channel: OutboundChannel, session_id: str, user_message: str) -> asyncio.Task:
+    """Corre el turno como tarea cancelable, para seguir recibiendo mensajes mientras tanto."""
+    task = asyncio.create_task(handle_chat_message(channel, session_id, user_message))
+    task.add_done_callback(log_turn_error)
+    return task
+
+
+async def cancel_turn(task: asyncio.Task | None):
+    """Cancela el turno en curso (si hay) y espera a que guarde su estado parcial."""
+    if task is None or task.done():
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
 
+
+def log_turn_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"⚠️  Turno terminado con error: {task.exception()!r}")
+
+
+async def run_chat_turn(channel: OutboundChannel, session_id: str, user_message: str):
+    """Corre un turno del agente sobre un snapshot del estado de la sesión."""
+    trace = start_trace()
+    turn_started = time.perf_counter()
+    first_token_at = None
+
+    # Si el modelo/OpenAI/Supabase están saturados, avisar la posición en cola
+    async def notify_queued(stage: str, position: int):
+        await channel.send({"type": "queued", "stage": stage, "position": position})
+
+    bind_session(session_id, notify_queued)
+
+    speculation = None
+    state = None
+    input_state = None
     streamed_tokens = []
     final_state = None
+    # Para poder guardar un turno cancelado: salidas de nodos ya terminados y
+    # tokens de la llamada al modelo en curso
+    node_updates: list[dict] = []
+    current_tokens: list[str] = []
+    committed = False
+    model_calls = 0
+    resolved = []
 
     try:
+        # Embedding del mensaje en paralelo con la primera llamada al modelo
+        speculation = start_speculation(user_message)
+
+        state = await manager.get_state(session_id)
+
+        # Create clean input state without mutating the original
+        input_state = {
+            "messages": state["messages"] + [HumanMessage(content=user_message)],
+            "last_search_results": state.get("last_search_results", []),
+            "last_search_version": state.get("last_search_version", 0),
+            "conversation_summary": state.get("conversation_summary", ""),
+            "summary_upto": state.get("summary_upto", 0),
+            "context_tokens_saved": 0,
+        }
+
+        # "cuéntame más del primero": los detalles entran al turno antes del grafo
+        if settings.reference_resolver_enabled:
+            resolved = await resolve_references(
+                user_message, input_state["last_search_results"]
+            )
+            input_state["messages"] = input_state["messages"] + resolved
+
         async for event in agent.astream_events(input_state, version="v2"):
             event_type = event["event"]
 
-            # DEBUG: Ver todos los eventos
-            print(f"Event: {event_type} | Keys: {event.keys()}")
-
             # Chat model start (thinking started)
             if event_type == "on_chat_model_start":
-                await websocket.send_json({"type": "thinking_start"})
+                model_calls += 1
+                current_tokens = []
+                await channel.send({"type": "thinking_start"})
 
             # Token de texto (streaming)
             elif event_type == "on_chat_model_stream":
@@ -85,19 +168,21 @@ async def handle_chat_message(websocket: WebSocket, session_id: str, user_messag
                 if chunk and hasattr(chunk, "content") and chunk.content:
                     if isinstance(chunk.content, str):
                         streamed_tokens.append(chunk.content)
-                        await websocket.send_json(
-                            {"type": "token", "content": chunk.content}
-                        )
+                        current_tokens.append(chunk.content)
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            TURN_FIRST_TOKEN_SECONDS.observe(first_token_at - turn_started)
+                        # Se junta con otros tokens en un frame (no bloquea)
+                        channel.send_token(chunk.content)
 
             # Chat model end (thinking finished)
             elif event_type == "on_chat_model_end":
-                await websocket.send_json({"type": "thinking_end"})
+                await channel.send({"type": "thinking_end"})
 
             # Inicio de herramienta
             elif event_type == "on_tool_start":
                 tool_name = event.get("name", "")
-                print(f"🔧 Tool start: {tool_name}")
-                await websocket.send_json(
+                await channel.send(
                     {
                         "type": "tool_start",
                         "tool": tool_name,
@@ -108,13 +193,33 @@ async def handle_chat_message(websocket: WebSocket, session_id: str, user_messag
             # Fin de herramienta
             elif event_type == "on_tool_end":
                 tool_name = event.get("name", "")
-                print(f"🔧 Tool end: {tool_name}")
-                await websocket.send_json({"type": "tool_end", "tool": tool_name})
+                await channel.send({"type": "tool_end", "tool": tool_name})
+
+                # Mandar las experiencias al mapa apenas termina la búsqueda,
+                # sin esperar a que el modelo escriba la respuesta. El artifact
+                # es la misma lista que devolvió la herramienta (sin re-parsear)
+                if tool_name == "search_rutopia_experiences":
+                    experiences = getattr(event["data"].get("output"), "artifact", None)
+                    if experiences:
+                        # Detalles de los primeros mientras el modelo escribe
+                        detail_prefetcher.schedule(session_id, experiences)
+                        await channel.send(
+                            {"type": "experiences", "data": experiences}
+                        )
 
             # Capture final state from graph
             elif event_type == "on_chain_end" and event.get("name") == "LangGraph":
                 final_state = event["data"].get("output")
-                print("✅ Captured final state from graph")
+
+            # Salida de un nodo terminado (agent, tools, process_results)
+            elif event_type == "on_chain_end" and event.get("name") == event.get(
+                "metadata", {}
+            ).get("langgraph_node"):
+                output = event["data"].get("output")
+                if isinstance(output, dict):
+                    node_updates.append(output)
+                if event["name"] == "agent":
+                    current_tokens = []  # Ya quedaron en el AIMessage del nodo
 
         # If graph didn't emit on_chain_end, reconstruct manually
         if final_state is None:
@@ -122,16 +227,33 @@ async def handle_chat_message(websocket: WebSocket, session_id: str, user_messag
             if streamed_tokens:
                 ai_message = AIMessage(content="".join(streamed_tokens))
                 final_state = {
+                    **input_state,
                     "messages": input_state["messages"] + [ai_message],
-                    "last_search_results": input_state.get("last_search_results", []),
                 }
             else:
                 # No tokens streamed, use input state as fallback
                 final_state = input_state
 
-        # Update with FINAL state (output, not input)
+        # Update with FINAL state (output, not input): only the new messages
         if final_state:
-            manager.update_state(session_id, final_state)
+            # Desde acá el turno se guarda completo aunque llegue una cancelación
+            # (si no, el handler agregaría además el turno parcial)
+            committed = True
+            await asyncio.shield(
+                manager.update_state(
+                    session_id,
+                    final_state["messages"][len(state["messages"]) :],
+                    session_fields(final_state, state),
+                )
+            )
+
+            tokens_saved = final_state.get("context_tokens_saved", 0)
+            if tokens_saved:
+                print(f"📉 Contexto acotado: {tokens_saved} tokens ahorrados en el turno")
+
+            # Plegar turnos viejos en el resumen sin demorar la respuesta
+            if settings.context_summary_enabled:
+                manager.run_in_background(update_conversation_summary(session_id))
 
             # Send the complete message from the agent
             final_messages = final_state.get("messages", [])
@@ -149,32 +271,116 @@ async def handle_chat_message(websocket: WebSocket, session_id: str, user_messag
                         content = text_content
 
                     if content:
-                        await websocket.send_json({
-                            "type": "message",
-                            "content": content
-                        })
-                        print(f"📤 Sent complete message: {content[:100]}...")
-
-            # Send experiences if they exist in final state
-            if final_state.get("last_search_results"):
-                # Check if results are new (different from input state)
-                if final_state["last_search_results"] != state.get("last_search_results", []):
-                    await websocket.send_json(
-                        {"type": "experiences", "data": final_state["last_search_results"]}
-                    )
-                    print(f"✅ Sent {len(final_state['last_search_results'])} experiences to frontend")
+                        await channel.send({"type": "message", "content": content})
 
         # Mensaje completado
-        await websocket.send_json({"type": "done"})
+        elapsed = time.perf_counter() - turn_started
+        TURN_SECONDS.observe(elapsed)
+        TURN_MODEL_CALLS.observe(model_calls, resolved=str(bool(resolved)).lower())
+        done = {"type": "done"}
+        if settings.metrics_debug_trace:
+            done["trace"] = {
+                "total_ms": round(elapsed * 1000, 2),
+                "first_token_ms": round((first_token_at - turn_started) * 1000, 2)
+                if first_token_at
+                else None,
+                "spans": trace,
+            }
+        await channel.send(done)
+
+    except asyncio.CancelledError:
+        # Cliente desconectado, {"type": "cancel"} o mensaje nuevo que reemplaza a este
+        if not committed and input_state is not None:
+            messages, fields = partial_turn(input_state, node_updates, current_tokens)
+            await asyncio.shield(
+                manager.update_state(
+                    session_id,
+                    messages[len(state["messages"]) :],
+                    session_fields(fields, state),
+                )
+            )
+        try:
+            await channel.send({"type": "cancelled"})
+        except Exception:
+            pass  # El cliente ya no está
+        raise
+
+    except AdmissionRejected:
+        # Saturado: se avisa sin cerrar la conexión; el usuario puede reintentar
+        await channel.send(
+            {
+                "type": "error",
+                "message": "Hay mucha demanda en este momento, intenta de nuevo en unos segundos",
+            }
+        )
 
     except Exception as e:
         print(f"❌ Error en chat: {e}")
         import traceback
 
         traceback.print_exc()
-        await websocket.send_json({"type": "error", "message": str(e)})
+        await channel.send({"type": "error", "message": str(e)})
         # Close WebSocket on error
-        await websocket.close(code=1011)
+        await channel.close(code=1011)
+
+    finally:
+        finish_speculation(speculation)
+
+
+def partial_turn(
+    input_state: dict, node_updates: list[dict], current_tokens: list[str]
+) -> tuple[list, dict]:
+    """
+    Arma el estado de un turno cancelado de forma que el historial siga siendo
+    válido para el modelo: cada tool_call queda con su ToolMessage (las que no
+    terminaron se marcan como canceladas) y el texto ya enviado al cliente se
+    guarda como respuesta parcial.
+    """
+    messages = list(input_state["messages"])
+    fields = dict(input_state)
+    for update in node_updates:
+        messages.extend(update.get("messages", []))
+        fields.update({k: v for k, v in update.items() if k != "messages"})
+
+    last = messages[-1]
+    if last.type == "ai" and last.tool_calls:
+        for call in last.tool_calls:
+            messages.append(
+                ToolMessage(
+                    content="Cancelado por el usuario antes de terminar",
+                    tool_call_id=call["id"],
+                    name=call["name"],
+                    status="error",
+                )
+            )
+
+    partial_text = "".join(current_tokens)
+    if partial_text:
+        messages.append(AIMessage(content=partial_text))
+
+    return messages, fields
+
+
+def session_fields(final_state: dict, state: dict) -> dict:
+    """Campos a guardar además de los mensajes (last_search_* sólo si hubo búsqueda nueva)."""
+    version = final_state.get("last_search_version", 0)
+    if version == state.get("last_search_version", 0):
+        return {}
+    return {
+        "last_search_results": final_state.get("last_search_results", []),
+        "last_search_version": version,
+    }
+
+
+async def update_conversation_summary(session_id: str):
+    """Actualiza el resumen de la conversación (corre en background)."""
+    try:
+        state = await manager.get_state(session_id)
+        fields = await summarize_older_turns(state)
+        if fields:
+            await manager.update_state(session_id, [], fields)
+    except Exception as e:
+        print(f"⚠️  Error actualizando el resumen de {session_id}: {e}")
 
 
 def get_tool_message(tool_name: str) -> str:
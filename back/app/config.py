@@ -7,6 +7,96 @@ class Settings(BaseSettings):
     supabase_url: str
     supabase_key: str
 
+    # Cache de embeddings de queries
+    embedding_cache_size: int = 2048
+    embedding_cache_ttl_seconds: int = 7 * 24 * 3600
+    embedding_cache_path: str | None = None  # Archivo .npz para persistir la cache
+    embedding_cache_warmup_file: str | None = None  # Una query por línea
+
+    # Motor de búsqueda: "supabase" (RPC search_experiences_hybrid) o "local" (índice en memoria)
+    search_engine: str = "supabase"
+    local_index_refresh_seconds: int = 3600
+
+    # Paginación ("más opciones"): la primera página trae search_candidates resultados y
+    # las siguientes salen de ese conjunto, guardado por sesión
+    search_candidates: int = 40
+    search_candidates_max: int = 200
+    search_candidates_sessions: int = 2000
+    search_candidates_ttl_seconds: int = 1800
+
+    # Índice geográfico (mapa y filtro de cercanía): celdas de geo_cell_degrees grados
+    geo_index_enabled: bool = True
+    geo_index_refresh_seconds: int = 3600
+    geo_cell_degrees: float = 0.25
+    # Con la RPC (no filtra por distancia): filas de más a pedir para filtrar acá
+    geo_search_overfetch: int = 5
+    geo_search_max_rows: int = 200
+    geo_response_max_age: int = 300  # Cache-Control de /experiences/bbox y /experiences/near
+
+    # Cache de resultados de búsqueda (filtros normalizados + limit)
+    search_cache_size: int = 512
+    search_cache_ttl_seconds: int = 300
+
+    # Cache de detalles de experiencias
+    detail_cache_size: int = 1024
+    detail_cache_ttl_seconds: int = 3600
+    # Cada cuánto mira cada worker la versión compartida de las caches (en el store de
+    # sesiones) para enterarse de un /cache/invalidate que recibió otro worker
+    cache_version_check_seconds: float = 1.0
+    # Prefetch de detalles de los primeros resultados de cada búsqueda (0 = deshabilitado)
+    detail_prefetch_top_k: int = 3
+    detail_prefetch_max_concurrency: int = 8  # Lotes en curso por proceso; el resto se descarta
+
+    # Sesiones: "memory" (un solo worker), "sqlite" (compartido en la máquina) o "redis"
+    session_backend: str = "sqlite"
+    session_db_path: str = "sessions.db"
+    redis_url: str | None = None
+    session_snapshot_cache_size: int = 1000  # Sesiones con snapshot en memoria por worker
+    session_snapshot_cache_ttl_seconds: int = 3600
+
+    # Contexto del modelo: últimos N turnos completos + resumen opcional de lo anterior
+    context_window_turns: int = 6
+    context_summary_enabled: bool = False
+    context_summary_min_turns: int = 2  # Turnos fuera de la ventana para volver a resumir
+    context_summary_model: str = "claude-3-5-haiku-latest"
+
+    # Presupuestos de salida de herramientas en el contexto del modelo (caracteres)
+    tool_search_max_chars: int = 4000
+    tool_details_max_chars: int = 6000
+    tool_text_field_max_chars: int = 500
+
+    # Streaming por WebSocket: ventana para juntar tokens en un frame y cola máxima
+    stream_flush_interval: float = 0.03
+    stream_flush_chars: int = 256
+    stream_max_pending: int = 64
+
+    # Control de admisión: llamadas concurrentes por proceso (0 = sin límite) y cola máxima
+    llm_max_concurrency: int = 8
+    embedding_max_concurrency: int = 16
+    supabase_max_concurrency: int = 16
+    admission_max_queue: int = 200
+
+    # Embedding especulativo del mensaje del usuario mientras el modelo decide si buscar;
+    # la búsqueda lo reutiliza si la semantic_query se parece lo suficiente (Jaccard)
+    speculative_embedding_enabled: bool = False
+    speculative_embedding_min_overlap: float = 0.6
+
+    # "el primero", "the second one", por nombre: detalles antes del grafo (una llamada al modelo menos)
+    reference_resolver_enabled: bool = True
+
+    # Prompt caching de Anthropic: tools + SYSTEM_PROMPT como prefijo cacheable
+    prompt_cache_enabled: bool = True
+
+    # Métricas: adjuntar los spans del turno al evento done (sólo para depurar)
+    metrics_debug_trace: bool = False
+    # Con varios workers: directorio local donde cada uno deja sus métricas cada
+    # metrics_flush_seconds para que /metrics exporte el total (vaciarlo al desplegar)
+    metrics_multiproc_dir: str | None = None
+    metrics_flush_seconds: float = 5.0
+
+    # Token para endpoints administrativos (invalidación de caches); sin token quedan deshabilitados
+    admin_token: str | None = None
+
     class Config:
         env_file = ".env"
 
@@ -1,11 +1,46 @@
 import uuid
-import json
 import asyncio
+import hashlib
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+
+import orjson
+from fastapi import (
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from app.api.websocket import manager, handle_chat_message
+from app.api.websocket import manager, cancel_turn, start_turn
+from app.api.outbound import OutboundChannel
+from app.api.protocol import negotiate, receive_event
+from app.config import settings
+from app.services.embeddings import (
+    get_embedding_cache_stats,
+    load_embedding_cache,
+    read_warmup_queries,
+    save_embedding_cache,
+    warm_embedding_cache,
+)
+from app.services.vector_index import periodic_index_refresh
+from app.services.search import (
+    get_detail_cache_stats,
+    get_geo_index,
+    get_search_cache_stats,
+    ainvalidate_experience_details,
+    periodic_geo_refresh,
+    use_shared_cache_version,
+)
+from app.services.admission import get_admission_stats, record_admission_stats
+from app.services.prefetch import detail_prefetcher
+from app.services.metrics import record_cache_stats, render_metrics, write_worker_metrics
+from app.models.schemas import CacheInvalidation
 
 
 async def periodic_cleanup():
@@ -15,14 +50,72 @@ async def periodic_cleanup():
         await manager.cleanup_old_sessions(max_age_hours=24)
 
 
+def record_gauges():
+    """Publica las estadísticas de caches y admisión como gauges."""
+    record_cache_stats("embedding", get_embedding_cache_stats())
+    record_cache_stats("detail", get_detail_cache_stats())
+    record_cache_stats("search", get_search_cache_stats())
+    record_admission_stats()
+
+
+async def periodic_metrics_flush():
+    """Deja las métricas de este worker en metrics_multiproc_dir para /metrics."""
+    while True:
+        await asyncio.sleep(settings.metrics_flush_seconds)
+        record_gauges()
+        await asyncio.to_thread(write_worker_metrics)
+
+
+async def warm_up_embeddings():
+    """Carga la cache de embeddings persistida y la calienta con las queries top."""
+    loaded = await asyncio.to_thread(load_embedding_cache)
+    if loaded:
+        print(f"🧠 Cache de embeddings: {loaded} entradas cargadas")
+
+    if settings.embedding_cache_warmup_file:
+        try:
+            queries = read_warmup_queries(settings.embedding_cache_warmup_file)
+            generated = await asyncio.to_thread(warm_embedding_cache, queries)
+            print(f"🧠 Cache de embeddings: {generated} queries precalculadas")
+        except Exception as e:
+            print(f"⚠️  No se pudo calentar la cache de embeddings: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan context manager."""
     # Startup: launch cleanup task
     cleanup_task = asyncio.create_task(periodic_cleanup())
+    # Invalidaciones de cache entre workers vía el store de sesiones compartido
+    use_shared_cache_version(manager.store)
+    await warm_up_embeddings()
+
+    # Índice vectorial local (si está habilitado); mientras carga se usa la RPC
+    index_task = None
+    if settings.search_engine == "local":
+        index_task = asyncio.create_task(periodic_index_refresh())
+
+    # Índice geográfico para el mapa y el filtro de cercanía
+    geo_task = None
+    if settings.geo_index_enabled:
+        geo_task = asyncio.create_task(periodic_geo_refresh())
+
+    # Métricas agregadas entre workers
+    metrics_task = None
+    if settings.metrics_multiproc_dir:
+        metrics_task = asyncio.create_task(periodic_metrics_flush())
+
     yield
     # Shutdown: cancel cleanup task
     cleanup_task.cancel()
+    if index_task:
+        index_task.cancel()
+    if geo_task:
+        geo_task.cancel()
+    if metrics_task:
+        metrics_task.cancel()
+        write_worker_metrics()
+    save_embedding_cache()
 
 
 app = FastAPI(
@@ -56,7 +149,101 @@ async def root():
 @app.get("/health")
 async def health():
     """Health check detallado."""
-    return {"status": "healthy", "active_sessions": len(manager.sessions)}
+    return {
+        "status": "healthy",
+        "active_sessions": await manager.count_sessions(),
+        "embedding_cache": get_embedding_cache_stats(),
+        "detail_cache": get_detail_cache_stats(),
+        "search_cache": get_search_cache_stats(),
+        "admission": get_admission_stats(),
+        "geo_index": len(get_geo_index() or ()),
+        "detail_prefetch": detail_prefetcher.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Métricas en formato Prometheus (latencias de cada etapa, tokens, caches).
+    Sin metrics_multiproc_dir son las del worker que atiende el request.
+    """
+    record_gauges()
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def geo_response(request: Request, query: tuple, run_query) -> Response:
+    """
+    Respuesta cacheable de una consulta al índice geográfico: el ETag depende de
+    la consulta y de la versión del índice, así un If-None-Match que coincide
+    responde 304 sin consultar ni serializar.
+    """
+    index = get_geo_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Índice geográfico cargando")
+
+    digest = hashlib.sha1(repr((index.built_at, query)).encode()).hexdigest()[:20]
+    headers = {
+        "ETag": f'"{digest}"',
+        "Cache-Control": f"public, max-age={settings.geo_response_max_age}",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    experiences = run_query(index)
+    return Response(
+        content=orjson.dumps({"count": len(experiences), "experiences": experiences}),
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+@app.get("/experiences/bbox")
+async def experiences_in_bbox(
+    request: Request,
+    min_lat: float = Query(ge=-90, le=90),
+    min_lon: float = Query(ge=-180, le=180),
+    max_lat: float = Query(ge=-90, le=90),
+    max_lon: float = Query(ge=-180, le=180),
+    limit: int = Query(default=500, ge=1, le=5000),
+):
+    """Experiencias dentro del viewport del mapa."""
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="Bounding box inválido")
+    return geo_response(
+        request,
+        ("bbox", min_lat, min_lon, max_lat, max_lon, limit),
+        lambda index: index.within_bbox(min_lat, min_lon, max_lat, max_lon, limit),
+    )
+
+
+@app.get("/experiences/near")
+async def experiences_near(
+    request: Request,
+    lat: float = Query(ge=-90, le=90),
+    lon: float = Query(ge=-180, le=180),
+    radius_km: float = Query(default=10, gt=0, le=500),
+    limit: int = Query(default=100, ge=1, le=5000),
+):
+    """Experiencias a menos de radius_km del punto, de la más cercana a la más lejana."""
+    return geo_response(
+        request,
+        ("near", lat, lon, radius_km, limit),
+        lambda index: index.near(lat, lon, radius_km, limit),
+    )
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(
+    request: CacheInvalidation, x_admin_token: str | None = Header(default=None)
+):
+    """Invalida caches tras actualizar filas (lo llaman los scripts de carga y embeddings)."""
+    if not settings.admin_token or x_admin_token != settings.admin_token:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    await ainvalidate_experience_details(request.experience_ids)
+    return {"status": "ok", "invalidated": request.experience_ids or "all"}
 
 
 @app.websocket("/ws/chat/{session_id}")
@@ -64,50 +251,70 @@ async def websocket_chat(websocket: WebSocket, session_id: str):
     """
     WebSocket endpoint para el chat.
 
+    Formato (ver app/api/protocol.py):
+    - JSON en frames de texto por defecto
+    - MessagePack en frames binarios con el subprotocolo "rutopia.msgpack" o ?format=msgpack
+    - Con uvicorn + websockets se negocia permessage-deflate si el cliente lo ofrece
+
     Mensajes que envía el cliente:
-    - {"content": "mensaje del usuario"}
+    - {"content": "mensaje del usuario"} - Si hay un turno en curso, lo reemplaza
+    - {"type": "cancel"} - Cancela el turno en curso
 
     Mensajes que envía el servidor:
-    - {"type": "token", "content": "..."} - Token de texto (streaming)
+    - {"type": "token", "content": "..."} - Tokens de texto (streaming, agrupados por frame)
     - {"type": "tool_start", "tool": "...", "message": "..."} - Inicio de herramienta
     - {"type": "tool_end", "tool": "..."} - Fin de herramienta
     - {"type": "experiences", "data": [...]} - Experiencias para el mapa
+    - {"type": "queued", "stage": "llm", "position": 3} - Esperando cupo (servicio saturado)
     - {"type": "done"} - Mensaje completado
+    - {"type": "cancelled"} - Turno cancelado (lo ya generado queda en el historial)
     - {"type": "error", "message": "..."} - Error
     """
-    await manager.connect(websocket, session_id)
+    codec, subprotocol = negotiate(websocket)
+    await manager.connect(websocket, session_id, subprotocol)
+    channel = OutboundChannel(websocket, codec=codec)
+    # El turno corre en su propia tarea: el loop sigue recibiendo para poder
+    # cancelarlo (desconexión, cancel o mensaje nuevo)
+    turn = None
 
     try:
         while True:
             # Recibir mensaje del usuario
-            data = await websocket.receive_text()
-
-            # Validate JSON
             try:
-                message = json.loads(data)
-            except json.JSONDecodeError:
-                await websocket.send_json({
+                message = await receive_event(websocket, codec)
+            except ValueError:
+                await channel.send({
                     "type": "error",
-                    "message": "Invalid JSON format"
+                    "message": "Invalid message format"
                 })
                 continue
 
+            if message.get("type") == "cancel":
+                await cancel_turn(turn)
+                continue
+
             # Validate message structure
             user_content = message.get("content", "")
             if not user_content:
-                await websocket.send_json({
+                await channel.send({
                     "type": "error",
                     "message": "Missing 'content' field"
                 })
                 continue
 
-            await handle_chat_message(websocket, session_id, user_content)
+            # Un mensaje nuevo reemplaza al turno en curso
+            await cancel_turn(turn)
+            turn = start_turn(channel, session_id, user_content)
 
     except WebSocketDisconnect:
         manager.disconnect(session_id)
         print(f"Session {session_id} disconnected")
     except Exception as e:
         print(f"WebSocket error: {e}")
-        await websocket.close(code=1011)
+        await channel.close(code=1011)
     finally:
+        # Cortar el grafo (y las llamadas a Anthropic/OpenAI/Supabase) apenas se va el cliente
+        await cancel_turn(turn)
+        detail_prefetcher.cancel(session_id)
         manager.disconnect(session_id)
+        await channel.close()
@@ -34,6 +34,9 @@ class SearchFilters(BaseModel):
     environment_type: str | None = None
     includes_food: bool | None = None
     experience_type: str | None = None
+    near_lat: float | None = None
+    near_lon: float | None = None
+    radius_km: float | None = None
 
 
 class ChatMessage(BaseModel):
@@ -51,3 +54,9 @@ class WSMessage(BaseModel):
     tool: str | None = None
     data: list[Experience] | None = None
     message: str | None = None
+
+
+class CacheInvalidation(BaseModel):
+    """Petición de invalidación de caches (scripts de carga y embeddings)."""
+
+    experience_ids: list[str] | None = None  # None = invalidar todo
@@ -1,8 +1,42 @@
+"""
+Genera los embeddings de experiences de forma incremental.
+
+Cada embedding se guarda con el hash de su texto (build_embedding_text) en
+experiences.embedding_text_hash; una corrida sólo recalcula las filas sin
+embedding o cuyo texto cambió (tags, USPs, resumen...). Requiere la columna:
+    alter table experiences add column embedding_text_hash text;
+
+Cada batch se guarda en un solo request con la función (sin ella se cae a
+updates por fila en paralelo, mucho más lentos):
+    create or replace function update_experience_embeddings(
+        ids uuid[], embeddings text[], hashes text[]
+    ) returns void language sql as $$
+        update experiences e
+        set vector_embedding = coalesce(u.embedding::vector, e.vector_embedding),
+            embedding_text_hash = u.text_hash
+        from unnest(ids, embeddings, hashes) as u(id, embedding, text_hash)
+        where e.id = u.id;
+    $$;
+
+    uv run python -m app.scripts.embeddings --dry-run
+    uv run python -m app.scripts.embeddings --adopt-existing  # primera corrida
+"""
+
+import argparse
+import hashlib
+import json
 import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError, RateLimitError
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
 from supabase import create_client
+from app.scripts.invalidate import notify_cache_invalidation
 
 load_dotenv()
 
@@ -10,6 +44,18 @@ load_dotenv()
 openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+PAGE_SIZE = 1000  # Límite de filas por request de PostgREST
+
+# Límites de la cuenta de OpenAI para embeddings (ajustables por env)
+EMBEDDINGS_RPM = int(os.getenv("EMBEDDINGS_RPM", "3000"))
+EMBEDDINGS_TPM = int(os.getenv("EMBEDDINGS_TPM", "1000000"))
+MAX_RETRIES = 5
+ROW_UPDATE_CONCURRENCY = 8  # Updates por fila en paralelo si no está la función SQL
+
+# False si la base no tiene update_experience_embeddings (se avisa una vez)
+bulk_update_available = True
+
 
 def build_embedding_text(experience: dict, enhanced: dict) -> str:
     """
@@ -74,84 +120,353 @@ def build_embedding_text(experience: dict, enhanced: dict) -> str:
     return text[:8000]  # Límite de tokens aprox
 
 
-def generate_embedding(text: str) -> list[float]:
-    """Genera embedding usando OpenAI."""
-    response = openai_client.embeddings.create(
-        model="text-embedding-3-small", input=text
+class RateLimiter:
+    """
+    Token bucket thread-safe para requests por minuto (RPM) y tokens por minuto (TPM).
+    acquire() bloquea hasta que haya capacidad para el request.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_budget = float(rpm)
+        self.token_budget = float(tpm)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.request_budget = min(
+            self.rpm, self.request_budget + elapsed * self.rpm / 60
+        )
+        self.token_budget = min(self.tpm, self.token_budget + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens: int):
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.request_budget >= 1 and self.token_budget >= tokens:
+                    self.request_budget -= 1
+                    self.token_budget -= tokens
+                    return
+
+                # Tiempo hasta tener capacidad suficiente
+                wait = max(
+                    (1 - self.request_budget) * 60 / self.rpm,
+                    (tokens - self.token_budget) * 60 / self.tpm,
+                )
+            time.sleep(max(wait, 0.01))
+
+
+rate_limiter = RateLimiter(EMBEDDINGS_RPM, EMBEDDINGS_TPM)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida (~4 caracteres por token)."""
+    return len(text) // 4 + 1
+
+
+# Errores de Postgres que se arreglan reintentando: conexión, serialización,
+# deadlock, recursos, timeouts/shutdown; y PGRST000-003 (PostgREST sin conexión)
+TRANSIENT_PG_CODES = ("08", "40001", "40P01", "53", "57014", "57P", "PGRST00")
+
+
+def is_retryable(error: Exception) -> bool:
+    """429, 5xx, errores de red y errores transitorios de Postgres/PostgREST."""
+    if isinstance(error, (RateLimitError, APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, APIStatusError):
+        status = error.status_code
+    elif isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    elif isinstance(error, APIError):
+        if isinstance(error.code, int):  # Respuesta sin JSON: el código es el status HTTP
+            status = error.code
+        else:
+            return str(error.code or "").startswith(TRANSIENT_PG_CODES)
+    else:
+        return False
+    return status == 429 or status >= 500
+
+
+def with_retries(fn, *args, **kwargs):
+    """Ejecuta fn con reintentos y backoff exponencial con jitter (OpenAI y Supabase)."""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return fn(*args, **kwargs)
+        except (APIStatusError, APIConnectionError, APIError, httpx.HTTPError) as e:
+            # Errores 4xx distintos a 429 (o de datos en Postgres) no se arreglan reintentando
+            if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+                raise
+            delay = min(2**attempt, 30) + random.random()
+            print(f"  ⏳ Reintentando en {delay:.1f}s ({e.__class__.__name__})")
+            time.sleep(delay)
+
+
+def generate_embeddings(texts: list[str]) -> tuple[list[list[float]], int]:
+    """Genera embeddings para varios textos en un solo request. Devuelve (embeddings, tokens)."""
+    rate_limiter.acquire(sum(estimate_tokens(t) for t in texts))
+
+    response = with_retries(
+        openai_client.embeddings.create, model=EMBEDDING_MODEL, input=texts
     )
-    return response.data[0].embedding
 
+    ordered = sorted(response.data, key=lambda item: item.index)
+    embeddings = [item.embedding for item in ordered]
+    return embeddings, response.usage.total_tokens
 
-def main():
-    print("🚀 Generando embeddings...")
 
-    # Obtener experiencias sin embedding
-    print("  Obteniendo experiencias sin embedding...")
+def embedding_text_hash(text: str) -> str:
+    """Hash del texto (y del modelo) con el que se generó un embedding."""
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{text}".encode()).hexdigest()
 
-    # Traer experiencias que no tienen embedding
-    result = (
-        supabase.table("experiences")
-        .select("id, destination_name, city")
-        .is_("vector_embedding", "null")
-        .execute()
+
+def fetch_rows(
+    table: str, columns: str, order: str = "id", null_column: str | None = None
+) -> list[dict]:
+    """Trae todas las filas de una tabla paginando (opcional: sólo con null_column NULL)."""
+    rows = []
+    start = 0
+    while True:
+        query = supabase.table(table).select(columns)
+        if null_column:
+            query = query.is_(null_column, "null")
+        result = query.order(order).range(start, start + PAGE_SIZE - 1).execute()
+        rows.extend(result.data)
+        if len(result.data) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def plan_embeddings(adopt_existing: bool = False) -> dict:
+    """
+    Compara el hash del texto actual de cada experiencia con el guardado junto
+    a su embedding. Sólo hay que recalcular las filas sin embedding o cuyo
+    texto cambió; los textos idénticos se agrupan para pedirlos una sola vez.
+
+    Filas con embedding pero sin hash (anteriores a esta columna): se re-embeben,
+    o con adopt_existing se les guarda el hash actual sin llamar a OpenAI.
+    """
+    experiences = fetch_rows("experiences", "id, destination_name, city, embedding_text_hash")
+    missing = {
+        str(row["id"])
+        for row in fetch_rows("experiences", "id", null_column="vector_embedding")
+    }
+    enhanced = fetch_rows("experiences_enhanced", "*", order="experience_id")
+    enhanced_by_id = {str(row["experience_id"]): row for row in enhanced}
+
+    plan = {
+        "new": [],
+        "changed": [],
+        "unhashed": [],
+        "unchanged": 0,
+        "no_text": [],
+        "texts": {},  # hash -> (texto, [ids]) a embeber
+        "adopt": [],  # filas a las que sólo se les guarda el hash
+    }
+    for exp in experiences:
+        exp_id = str(exp["id"])
+        text = build_embedding_text(exp, enhanced_by_id.get(exp_id, {}))
+        if not text.strip():
+            plan["no_text"].append(exp_id)
+            continue
+
+        text_hash = embedding_text_hash(text)
+        if exp_id in missing:
+            plan["new"].append(exp_id)
+        elif exp.get("embedding_text_hash") == text_hash:
+            plan["unchanged"] += 1
+            continue
+        elif exp.get("embedding_text_hash") is None and adopt_existing:
+            plan["adopt"].append({"id": exp_id, "embedding_text_hash": text_hash})
+            continue
+        elif exp.get("embedding_text_hash") is None:
+            plan["unhashed"].append(exp_id)
+        else:
+            plan["changed"].append(exp_id)
+
+        plan["texts"].setdefault(text_hash, (text, []))[1].append(exp_id)
+
+    return plan
+
+
+def print_plan(plan: dict):
+    texts = plan["texts"]
+    rows = sum(len(ids) for _, ids in texts.values())
+    tokens = sum(estimate_tokens(text) for text, _ in texts.values())
+    print(f"  Sin embedding:      {len(plan['new'])}")
+    print(f"  Texto cambiado:     {len(plan['changed'])}")
+    print(f"  Sin hash guardado:  {len(plan['unhashed'])}")
+    print(f"  Hash adoptado:      {len(plan['adopt'])}")
+    print(f"  Sin cambios:        {plan['unchanged']}")
+    print(f"  Sin texto:          {len(plan['no_text'])}")
+    print(
+        f"  A embeber: {rows} filas, {len(texts)} textos únicos "
+        f"(~{tokens} tokens)"
     )
 
-    experiences = result.data
-    print(f"  Experiencias sin embedding: {len(experiences)}")
 
-    if not experiences:
-        print("✅ Todas las experiencias ya tienen embedding!")
-        return
+def update_row(row: dict):
+    """Update de una fila (sin la función SQL)."""
+    values = {key: value for key, value in row.items() if key != "id"}
+    with_retries(
+        lambda: supabase.table("experiences")
+        .update(values, returning=ReturnMethod.minimal)
+        .eq("id", row["id"])
+        .execute()
+    )
 
-    # Procesar en batches
-    batch_size = 50  # Para no saturar la API
-    total = len(experiences)
-    processed = 0
-    errors = 0
 
-    for i in range(0, total, batch_size):
-        batch = experiences[i : i + batch_size]
+def save_rows(rows: list[dict]):
+    """
+    Guarda embedding (opcional) y hash de filas existentes de experiences en un
+    solo request: UPDATE ... FROM unnest(...) vía update_experience_embeddings.
+    Es un update, no un upsert: no hace falta mandar las columnas NOT NULL.
+    Sin la función, updates por fila en paralelo.
+    """
+    global bulk_update_available
+    if bulk_update_available:
+        params = {
+            "ids": [row["id"] for row in rows],
+            "embeddings": [
+                json.dumps(row["vector_embedding"]) if row.get("vector_embedding") else None
+                for row in rows
+            ],
+            "hashes": [row["embedding_text_hash"] for row in rows],
+        }
+        try:
+            with_retries(
+                lambda: supabase.rpc("update_experience_embeddings", params).execute()
+            )
+            return
+        except APIError as e:
+            if e.code != "PGRST202":  # Función inexistente
+                raise
+            bulk_update_available = False
+            print(
+                "  ⚠️  Falta la función update_experience_embeddings (ver docstring): "
+                "se guarda fila por fila"
+            )
+
+    with ThreadPoolExecutor(max_workers=ROW_UPDATE_CONCURRENCY) as executor:
+        list(executor.map(update_row, rows))
+
+
+def process_batch(batch: list[tuple[str, tuple[str, list[str]]]]) -> dict:
+    """
+    Procesa un batch de textos únicos: un request de embeddings y un update
+    masivo con el embedding y el hash de su texto en cada fila que lo usa.
+    """
+    embeddings, tokens = generate_embeddings([text for _, (text, _) in batch])
 
-        for exp in batch:
-            try:
-                # Obtener datos enhanced
-                enhanced_result = (
-                    supabase.table("experiences_enhanced")
-                    .select("*")
-                    .eq("experience_id", exp["id"])
-                    .execute()
-                )
+    rows = [
+        {"id": exp_id, "vector_embedding": embedding, "embedding_text_hash": text_hash}
+        for (text_hash, (_, ids)), embedding in zip(batch, embeddings)
+        for exp_id in ids
+    ]
+    save_rows(rows)
 
-                enhanced = enhanced_result.data[0] if enhanced_result.data else {}
+    return {"ids": [row["id"] for row in rows], "texts": len(batch), "tokens": tokens}
 
-                # Construir texto para embedding
-                text = build_embedding_text(exp, enhanced)
 
-                if not text.strip():
-                    print(f"  ⚠️ Sin texto para {exp['id']}")
-                    continue
+def main(
+    batch_size: int = 100,
+    concurrency: int = 4,
+    dry_run: bool = False,
+    adopt_existing: bool = False,
+):
+    print("🚀 Generando embeddings...")
 
-                # Generar embedding
-                embedding = generate_embedding(text)
+    # Qué filas cambiaron desde el último embedding (por hash del texto)
+    print("  Comparando textos con los hashes guardados...")
+    plan = plan_embeddings(adopt_existing)
+    print_plan(plan)
+
+    if dry_run:
+        for label in ("new", "changed", "unhashed"):
+            if plan[label]:
+                sample = ", ".join(plan[label][:10])
+                print(f"  {label}: {sample}{' ...' if len(plan[label]) > 10 else ''}")
+        print("🔍 Dry run: no se generó ni guardó nada")
+        return
 
-                # Guardar en Supabase
-                supabase.table("experiences").update(
-                    {"vector_embedding": embedding}
-                ).eq("id", exp["id"]).execute()
+    if plan["adopt"]:
+        adopt = plan["adopt"]
+        chunks = [adopt[i : i + batch_size] for i in range(0, len(adopt), batch_size)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(save_rows, chunks))
+        print(f"  Hashes guardados para {len(plan['adopt'])} embeddings existentes")
 
-                processed += 1
+    texts = list(plan["texts"].items())
+    if not texts:
+        print("✅ Todos los embeddings están al día!")
+        return
 
-            except Exception as e:
-                print(f"  ❌ Error en {exp['id']}: {e}")
-                errors += 1
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    total = sum(len(ids) for _, (_, ids) in texts)
+    updated_ids = []
+    embedded_texts = 0
+    errors = 0
+    tokens = 0
+    started_at = time.perf_counter()
 
-        print(f"  Procesados: {processed}/{total} (errores: {errors})")
+    # Batches concurrentes; el rate limiter respeta RPM/TPM de OpenAI
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(process_batch, batch): batch for batch in batches}
 
-        # Rate limiting - OpenAI permite ~3000 RPM para embeddings
-        time.sleep(1)
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                result = future.result()
+                updated_ids.extend(result["ids"])
+                embedded_texts += result["texts"]
+                tokens += result["tokens"]
+            except Exception as e:
+                print(f"  ❌ Error en batch de {len(batch)} textos: {e}")
+                errors += sum(len(ids) for _, (_, ids) in batch)
+
+            done = len(updated_ids) + errors
+            elapsed = time.perf_counter() - started_at
+            print(
+                f"  Procesados: {done}/{total} "
+                f"(errores: {errors}, {done / elapsed:.1f} filas/s)"
+            )
+
+    elapsed = time.perf_counter() - started_at
+    processed = len(updated_ids)
+    print(
+        f"\n✅ Completado: {processed} filas actualizadas con {embedded_texts} embeddings, "
+        f"{errors} errores, {len(plan['no_text'])} sin texto"
+    )
+    print(
+        f"   Tiempo: {elapsed:.1f}s | {processed / elapsed:.1f} filas/s | "
+        f"{tokens} tokens ({tokens / elapsed * 60:.0f} tokens/min)"
+    )
 
-    print(f"\n✅ Completado: {processed} embeddings generados, {errors} errores")
+    if updated_ids:
+        notify_cache_invalidation(updated_ids)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Genera embeddings de experiencias")
+    parser.add_argument("--batch-size", type=int, default=100, help="Textos por request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Batches en paralelo")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Sólo reportar qué filas cambiarían"
+    )
+    parser.add_argument(
+        "--adopt-existing",
+        action="store_true",
+        help="Guardar el hash actual en embeddings existentes sin hash (sin re-embeber)",
+    )
+    args = parser.parse_args()
+
+    main(
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        dry_run=args.dry_run,
+        adopt_existing=args.adopt_existing,
+    )
@@ -0,0 +1,34 @@
+"""
+Avisa al backend que hay filas actualizadas para que invalide sus caches.
+
+Requiere RUTOPIA_API_URL y ADMIN_TOKEN en el entorno; si faltan no hace nada.
+Los scripts que lo usan se ejecutan como módulo desde back/:
+    uv run python -m app.scripts.embeddings
+"""
+
+import os
+
+import httpx
+
+
+def notify_cache_invalidation(experience_ids: list[str] | None = None):
+    """POST /cache/invalidate con los IDs actualizados (None = todo el catálogo)."""
+    api_url = os.getenv("RUTOPIA_API_URL")
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not api_url or not admin_token:
+        return
+
+    try:
+        response = httpx.post(
+            f"{api_url.rstrip('/')}/cache/invalidate",
+            json={"experience_ids": experience_ids},
+            headers={"X-Admin-Token": admin_token},
+            timeout=10,
+        )
+        response.raise_for_status()
+        scope = (
+            f"{len(experience_ids)} experiencias" if experience_ids else "todo el catálogo"
+        )
+        print(f"🧹 Caches del backend invalidadas ({scope})")
+    except httpx.HTTPError as e:
+        print(f"⚠️  No se pudieron invalidar las caches del backend: {e}")
@@ -4,6 +4,7 @@ import os
 from dotenv import load_dotenv
 import json
 import math
+from app.scripts.invalidate import notify_cache_invalidation
 
 load_dotenv()
 
@@ -169,4 +170,5 @@ if __name__ == "__main__":
     print("\n🎉 Cargando experiencias...")
     # load_experiences("./experiences_rows_clean_2.csv")
     load_experiences_enhanced("./experiences_enhanced_rows.csv")
+    notify_cache_invalidation()
     print("\n🎉 Datos cargados exitosamente!")
@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable
+
+from app.config import settings
+from app.services.metrics import Counter, Gauge, Histogram, registry
+
+QUEUE_WAIT_SECONDS = registry.register(
+    Histogram("rutopia_admission_wait_seconds", "Espera en cola antes de obtener un cupo")
+)
+QUEUE_REJECTED = registry.register(
+    Counter("rutopia_admission_rejected_total", "Pedidos rechazados por cola llena")
+)
+QUEUE_STATE = registry.register(
+    Gauge("rutopia_admission", "Cupos en uso y pedidos en cola por limitador")
+)
+
+# Sesión dueña de la tarea actual y callback para avisarle su posición en cola
+QueueNotifier = Callable[[str, int], Awaitable[None]]
+_session: ContextVar[tuple[str, QueueNotifier | None]] = ContextVar(
+    "rutopia_admission_session", default=("", None)
+)
+
+
+class AdmissionRejected(Exception):
+    """La cola del limitador está llena: el servicio está saturado."""
+
+
+def bind_session(session_id: str, notify: QueueNotifier | None = None):
+    """Asocia las llamadas de la tarea actual (y sus hijas) a una sesión."""
+    _session.set((session_id, notify))
+
+
+def current_session() -> str:
+    """Sesión asociada a la tarea actual ("" fuera de un turno)."""
+    return _session.get()[0]
+
+
+class Waiter:
+    __slots__ = ("session_id", "granted")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.granted = False
+
+
+class FairLimiter:
+    """
+    Limita la concurrencia global de un recurso (modelo, OpenAI, Supabase).
+
+    Cuando no hay cupo, los pedidos esperan en una cola por sesión y los cupos
+    se reparten round-robin entre sesiones: una sesión con muchos pedidos no
+    deja sin turno a las demás. La cola total está acotada (max_queue); al
+    llenarse se rechaza con AdmissionRejected en lugar de acumular latencia.
+    limit <= 0 deshabilita el limitador.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._queues: OrderedDict[str, deque[Waiter]] = OrderedDict()
+        self._waiting = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def position(self, waiter: Waiter) -> int:
+        """Posición (1 = el próximo) según el orden round-robin actual."""
+        sessions = list(self._queues.items())
+        for index, (session_id, queue) in enumerate(sessions):
+            if session_id == waiter.session_id:
+                rank = queue.index(waiter)
+                break
+        else:
+            return 0
+
+        ahead = sum(min(len(queue), rank) for _, queue in sessions)
+        ahead += sum(1 for _, queue in sessions[:index] if len(queue) > rank)
+        return ahead + 1
+
+    def _grant_next(self) -> bool:
+        """Pasa el cupo liberado a la próxima sesión en la rotación."""
+        if not self._queues:
+            return False
+        session_id, queue = next(iter(self._queues.items()))
+        waiter = queue.popleft()
+        self._queues.pop(session_id)
+        if queue:
+            self._queues[session_id] = queue  # Vuelve al final de la rotación
+        self._waiting -= 1
+        waiter.granted = True
+        return True
+
+    def _notify_all(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _remove(self, waiter: Waiter):
+        queue = self._queues.get(waiter.session_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            self._waiting -= 1
+            if not queue:
+                self._queues.pop(waiter.session_id)
+            self._notify_all()
+
+    async def acquire(self):
+        if self.limit <= 0:
+            return
+        if self.active < self.limit and not self._waiting:
+            self.active += 1
+            return
+        if self._waiting >= self.max_queue:
+            QUEUE_REJECTED.inc(limiter=self.name)
+            raise AdmissionRejected(f"Cola de {self.name} llena")
+
+        session_id, notify = _session.get()
+        waiter = Waiter(session_id)
+        self._queues.setdefault(session_id, deque()).append(waiter)
+        self._waiting += 1
+        started = time.perf_counter()
+
+        try:
+            last_position = None
+            while not waiter.granted:
+                changed = self._changed
+                position = self.position(waiter)
+                if notify and position != last_position:
+                    await notify(self.name, position)
+                    last_position = position
+                if not waiter.granted:
+                    await changed.wait()
+        except BaseException:
+            if waiter.granted:
+                self.release()  # Ya tenía cupo: pasarlo al siguiente
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started, limiter=self.name)
+
+    def release(self):
+        if self.limit <= 0:
+            return
+        # El cupo pasa directo al siguiente (active no cambia) o se libera
+        if not self._grant_next():
+            self.active -= 1
+        self._notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self._waiting,
+            "sessions_waiting": len(self._queues),
+        }
+
+
+llm_limiter = FairLimiter("llm", settings.llm_max_concurrency, settings.admission_max_queue)
+embedding_limiter = FairLimiter(
+    "embedding", settings.embedding_max_concurrency, settings.admission_max_queue
+)
+supabase_limiter = FairLimiter(
+    "supabase", settings.supabase_max_concurrency, settings.admission_max_queue
+)
+LIMITERS = (llm_limiter, embedding_limiter, supabase_limiter)
+
+
+def get_admission_stats() -> dict:
+    return {limiter.name: limiter.stats() for limiter in LIMITERS}
+
+
+def record_admission_stats():
+    """Publica cupos en uso y cola como gauges."""
+    for limiter in LIMITERS:
+        QUEUE_STATE.set(limiter.active, limiter=limiter.name, stat="active")
+        QUEUE_STATE.set(limiter.waiting, limiter=limiter.name, stat="waiting")
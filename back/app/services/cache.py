@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """Cache LRU acotada por tamaño con expiración (TTL) por entrada."""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        """Devuelve el valor si existe y no expiró; si no, None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            # Marcar como usado recientemente
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: float | None = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+
+            # Eviction por tamaño (el menos usado primero)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] >= time.time()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Contadores de uso de la cache."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def entries(self) -> list[tuple[Hashable, float, Any]]:
+        """Entradas vigentes como (llave, expira_en, valor), de la menos a la más usada."""
+        now = time.time()
+        with self._lock:
+            return [
+                (key, expires_at, value)
+                for key, (expires_at, value) in self._data.items()
+                if expires_at >= now
+            ]
+
+    def restore(self, entries) -> int:
+        """Agrega entradas (llave, expira_en, valor) descartando las expiradas. Devuelve cuántas cargó."""
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, expires_at, value in entries:
+                if expires_at < now:
+                    continue
+                self._data[key] = (expires_at, value)
+                loaded += 1
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+        return loaded
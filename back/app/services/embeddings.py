@@ -1,7 +1,23 @@
-from openai import OpenAI
+import os
+import re
+
+import numpy as np
+from openai import OpenAI, AsyncOpenAI
 from app.config import settings
+from app.services.admission import embedding_limiter
+from app.services.cache import TTLCache
+from app.services.metrics import span
+
+EMBEDDING_MODEL = "text-embedding-3-small"
 
 _client: OpenAI | None = None
+_async_client: AsyncOpenAI | None = None
+
+# Cache de embeddings por query normalizada (la llave; se embebe el texto original)
+_embedding_cache = TTLCache(
+    max_size=settings.embedding_cache_size,
+    ttl_seconds=settings.embedding_cache_ttl_seconds,
+)
 
 
 def get_openai_client() -> OpenAI:
@@ -12,10 +28,116 @@ def get_openai_client() -> OpenAI:
     return _client
 
 
-def generate_embedding(text: str) -> list[float]:
-    """Genera embedding usando OpenAI text-embedding-3-small."""
+def get_async_openai_client() -> AsyncOpenAI:
+    """Obtiene o crea el cliente asíncrono de OpenAI (singleton)."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenAI(api_key=settings.openai_api_key)
+    return _async_client
+
+
+def normalize_query(text: str) -> str:
+    """Normaliza el texto para usarlo como llave de cache ("Cenotes  en Tulum " -> "cenotes en tulum")."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+async def agenerate_embedding(text: str) -> list[float]:
+    """Genera embedding usando OpenAI text-embedding-3-small (con cache)."""
+    key = normalize_query(text)
+
+    cached = _embedding_cache.get(key)
+    if cached is not None:
+        return cached
+
+    client = get_async_openai_client()
+
+    async with embedding_limiter.slot():
+        with span("embedding"):
+            response = await client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+
+    embedding = response.data[0].embedding
+    _embedding_cache.set(key, embedding)
+    return embedding
+
+
+def get_embedding_cache_stats() -> dict:
+    """Contadores de hits/misses de la cache de embeddings."""
+    return _embedding_cache.stats()
+
+
+def load_embedding_cache() -> int:
+    """Carga la cache persistida en disco (si está configurada)."""
+    path = settings.embedding_cache_path
+    if not path or not os.path.exists(path):
+        return 0
+
+    # Un archivo corrupto o de otro formato no impide arrancar: cache vacía
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            keys, expires_at, vectors = data["keys"], data["expires_at"], data["embeddings"]
+    except Exception as e:
+        print(f"⚠️  No se pudo leer la cache {path}: {e!r}")
+        return 0
+
+    return _embedding_cache.restore(
+        (str(key), float(expires), vector.tolist())
+        for key, expires, vector in zip(keys, expires_at, vectors)
+    )
+
+
+def save_embedding_cache():
+    """
+    Persiste la cache en disco (si está configurada) como .npz: los embeddings
+    en una matriz float32 (lo que devuelve la API) en lugar de listas JSON.
+
+    Con varios workers todos guardan al apagarse: cada uno escribe su propio
+    temporal y os.replace (atómico) deja el archivo completo del último.
+    """
+    path = settings.embedding_cache_path
+    if not path:
+        return
+
+    entries = _embedding_cache.entries()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            keys=np.array([key for key, _, _ in entries], dtype=str),
+            expires_at=np.array([expires for _, expires, _ in entries], dtype=np.float64),
+            embeddings=np.array([value for _, _, value in entries], dtype=np.float32),
+        )
+    try:
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def warm_embedding_cache(queries: list[str]) -> int:
+    """Precalcula embeddings de las queries más frecuentes. Devuelve cuántas generó."""
+    pending = {}  # llave normalizada -> query original
+    for query in queries:
+        key = normalize_query(query)
+        if key and key not in _embedding_cache and key not in pending:
+            pending[key] = query
+
+    if not pending:
+        return 0
+
+    # Una sola llamada con todas las queries pendientes
     client = get_openai_client()
+    response = client.embeddings.create(model=EMBEDDING_MODEL, input=list(pending.values()))
+
+    ordered = sorted(response.data, key=lambda item: item.index)
+    for key, item in zip(pending, ordered):
+        _embedding_cache.set(key, item.embedding)
+
+    return len(pending)
 
-    response = client.embeddings.create(model="text-embedding-3-small", input=text)
 
-    return response.data[0].embedding
+def read_warmup_queries(path: str) -> list[str]:
+    """Lee las queries de calentamiento (una por línea, ignora vacías y comentarios)."""
+    with open(path, encoding="utf-8") as f:
+        return [
+            line.strip() for line in f if line.strip() and not line.startswith("#")
+        ]
@@ -0,0 +1,136 @@
+import math
+import time
+
+import numpy as np
+
+from app.models.schemas import SearchFilters
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Distancia en km desde (lat, lon) a cada punto (vectorizado; NaN si falta el punto)."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def radius_filter(filters: SearchFilters) -> tuple[float, float, float] | None:
+    """(lat, lon, radio_km) si la búsqueda trae filtro de cercanía completo."""
+    if filters.near_lat is None or filters.near_lon is None or not filters.radius_km:
+        return None
+    return filters.near_lat, filters.near_lon, filters.radius_km
+
+
+def coordinates(rows: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    """lat/lon de las filas como arrays (NaN si faltan o son 0,0)."""
+    lats = np.full(len(rows), np.nan)
+    lons = np.full(len(rows), np.nan)
+    for i, row in enumerate(rows):
+        if row.get("lat") and row.get("lon"):
+            lats[i] = float(row["lat"])
+            lons[i] = float(row["lon"])
+    return lats, lons
+
+
+def filter_rows_near(rows: list[dict], lat: float, lon: float, radius_km: float) -> list[dict]:
+    """Filas a menos de radius_km, en el mismo orden (el ranking de la búsqueda)."""
+    if not rows:
+        return []
+    lats, lons = coordinates(rows)
+    inside = haversine_km(lat, lon, lats, lons) <= radius_km
+    return [row for row, keep in zip(rows, inside) if keep]
+
+
+class GeoIndex:
+    """
+    Índice espacial en memoria: grilla de celdas de cell_degrees x cell_degrees
+    con los índices de los elementos de cada celda.
+
+    Una consulta sólo mira las celdas que toca el bbox (o, si el bbox cubre más
+    celdas que las ocupadas, recorre las ocupadas) y después filtra exacto con
+    numpy. Los elementos son dicts con lat/lon; sin coordenadas no se indexan.
+    """
+
+    def __init__(self, items: list[dict], cell_degrees: float):
+        lats, lons = coordinates(items)
+        valid = ~np.isnan(lats)
+        self.items = [item for item, keep in zip(items, valid) if keep]
+        self.lat = lats[valid]
+        self.lon = lons[valid]
+        self.cell_degrees = cell_degrees
+        self.built_at = time.time()
+
+        cells: dict[tuple[int, int], list[int]] = {}
+        for i, key in enumerate(zip(self._cell(self.lat), self._cell(self.lon))):
+            cells.setdefault((int(key[0]), int(key[1])), []).append(i)
+        self.cells = {key: np.array(indices, dtype=np.int64) for key, indices in cells.items()}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _cell(self, value):
+        return np.floor(np.asarray(value) / self.cell_degrees).astype(np.int64)
+
+    def _candidates(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> np.ndarray:
+        lat0, lat1 = int(self._cell(min_lat)), int(self._cell(max_lat))
+        lon0, lon1 = int(self._cell(min_lon)), int(self._cell(max_lon))
+
+        if (lat1 - lat0 + 1) * (lon1 - lon0 + 1) > len(self.cells):
+            keys = [
+                key
+                for key in self.cells
+                if lat0 <= key[0] <= lat1 and lon0 <= key[1] <= lon1
+            ]
+        else:
+            keys = [
+                (i, j)
+                for i in range(lat0, lat1 + 1)
+                for j in range(lon0, lon1 + 1)
+                if (i, j) in self.cells
+            ]
+
+        if not keys:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.cells[key] for key in keys])
+
+    def within_bbox(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        limit: int | None = None,
+    ) -> list[dict]:
+        """Elementos dentro del rectángulo (orden del catálogo, estable entre llamadas)."""
+        candidates = self._candidates(min_lat, min_lon, max_lat, max_lon)
+        lats, lons = self.lat[candidates], self.lon[candidates]
+        inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        selected = np.sort(candidates[inside])[:limit]
+        return [self.items[i] for i in selected]
+
+    def near(
+        self, lat: float, lon: float, radius_km: float, limit: int | None = None
+    ) -> list[dict]:
+        """Elementos a menos de radius_km, del más cercano al más lejano, con distance_km."""
+        delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        delta_lon = min(delta_lat / max(math.cos(math.radians(lat)), 1e-6), 180.0)
+        candidates = self._candidates(
+            lat - delta_lat, lon - delta_lon, lat + delta_lat, lon + delta_lon
+        )
+
+        distances = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")[:limit]
+
+        return [
+            {**self.items[candidates[i]], "distance_km": round(float(distances[i]), 2)}
+            for i in order
+        ]
@@ -0,0 +1,312 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.config import settings
+
+# Buckets en segundos (de cache hits a llamadas lentas al modelo)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Counter:
+    """Contador monótono con labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def values(self) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self, values: dict | None = None) -> list[str]:
+        values = self.values() if values is None else values
+        return [f"{self.name}{format_labels(key)} {value}" for key, value in values.items()]
+
+
+class Gauge(Counter):
+    """Valor que sube y baja (se fija al momento de exportar)."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[label_key(labels)] = value
+
+
+class Histogram:
+    """Histograma acumulado por labels (formato Prometheus)."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [conteos por bucket..., sum, count]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def values(self) -> dict[tuple, list]:
+        with self._lock:
+            return {key: list(data) for key, data in self._values.items()}
+
+    def samples(self, values: dict | None = None) -> list[str]:
+        values = self.values() if values is None else values
+        lines = []
+        for key, data in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = format_labels(key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {data[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {data[-2]}")
+            lines.append(f"{self.name}_count{format_labels(key)} {data[-1]}")
+        return lines
+
+
+def merge_values(metric, snapshots: list[dict]) -> dict:
+    """
+    Junta los valores de una métrica de varios workers: counters e histogramas
+    se suman; los gauges (tamaño de caches, cupos) llevan un label worker.
+    """
+    merged: dict[tuple, float | list] = {}
+    for snapshot in snapshots:
+        for key, value in snapshot["metrics"].get(metric.name, []):
+            key = tuple(tuple(pair) for pair in key)
+            if metric.type == "gauge":
+                merged[key + (("worker", str(snapshot["pid"])),)] = value
+            elif metric.type == "histogram":
+                current = merged.get(key)
+                merged[key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas del proceso. Con varios workers de uvicorn cada uno
+    tiene el suyo; con metrics_multiproc_dir cada worker deja su snapshot en
+    ese directorio y /metrics exporta la suma de todos (ver render_metrics).
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        """Valores de todas las métricas del proceso (serializable a JSON)."""
+        return {
+            name: [[list(key), value] for key, value in metric.values().items()]
+            for name, metric in self.metrics.items()
+        }
+
+    def render(self, snapshots: list[dict] | None = None) -> str:
+        """
+        Exporta todas las métricas en formato de texto de Prometheus: las del
+        proceso o, si se pasan, las de los snapshots de todos los workers.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            if snapshots is None:
+                lines.extend(metric.samples())
+            else:
+                lines.extend(metric.samples(merge_values(metric, snapshots)))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+SPAN_SECONDS = registry.register(
+    Histogram("rutopia_span_seconds", "Duración de cada etapa de un turno")
+)
+SPAN_ERRORS = registry.register(
+    Counter("rutopia_span_errors_total", "Etapas que terminaron con excepción")
+)
+MODEL_TTFT_SECONDS = registry.register(
+    Histogram("rutopia_model_ttft_seconds", "Tiempo hasta el primer token del modelo")
+)
+MODEL_TOKENS = registry.register(
+    Counter("rutopia_model_tokens_total", "Tokens de entrada/salida del modelo")
+)
+SEARCH_COALESCED = registry.register(
+    Counter(
+        "rutopia_search_coalesced_total",
+        "Búsquedas que esperaron a otra idéntica en curso en lugar de repetirla",
+    )
+)
+SEARCH_PAGES = registry.register(
+    Counter(
+        "rutopia_search_pages_total",
+        "Páginas de búsqueda según de dónde salieron (candidates = sin embedding ni RPC)",
+    )
+)
+TURN_SECONDS = registry.register(
+    Histogram("rutopia_turn_seconds", "Duración total de un turno (hasta done)")
+)
+TURN_FIRST_TOKEN_SECONDS = registry.register(
+    Histogram(
+        "rutopia_turn_first_token_seconds",
+        "Desde que llega el mensaje hasta el primer token enviado al cliente",
+    )
+)
+TURN_MODEL_CALLS = registry.register(
+    Histogram(
+        "rutopia_turn_model_calls",
+        "Llamadas al modelo por turno (resolved=true si las referencias se resolvieron antes del grafo)",
+        buckets=(1, 2, 3, 4, 6, 8),
+    )
+)
+WS_SEND_SECONDS = registry.register(
+    Histogram(
+        "rutopia_ws_send_seconds",
+        "Duración de cada envío de frame por WebSocket",
+        buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1),
+    )
+)
+CACHE_STATS = registry.register(
+    Gauge("rutopia_cache", "Estadísticas de las caches en memoria")
+)
+
+# Spans del turno en curso (para adjuntarlos al evento done en modo debug)
+_trace: ContextVar[list | None] = ContextVar("rutopia_trace", default=None)
+
+
+def start_trace() -> list[dict]:
+    """Empieza a registrar los spans del turno actual (contexto async actual)."""
+    trace: list[dict] = []
+    _trace.set(trace)
+    return trace
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Mide una etapa: la agrega al histograma rutopia_span_seconds{span=name}
+    y, si hay un turno en curso, a su traza. Devuelve el registro para que
+    el llamador agregue atributos (tokens, resultados, etc.).
+    """
+    record = {"span": name, **attrs}
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        SPAN_ERRORS.inc(span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_SECONDS.observe(elapsed, span=name)
+        record["ms"] = round(elapsed * 1000, 2)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append(record)
+
+
+def record_cache_stats(name: str, stats: dict):
+    """Publica las estadísticas de una TTLCache como gauges."""
+    for field in ("size", "hits", "misses", "evictions", "hit_rate"):
+        if field in stats:
+            CACHE_STATS.set(stats[field], cache=name, stat=field)
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_worker_metrics():
+    """Deja el snapshot de este worker en metrics_multiproc_dir (si está configurado)."""
+    directory = settings.metrics_multiproc_dir
+    if not directory:
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"worker-{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "metrics": registry.snapshot()}, f)
+    os.replace(tmp_path, path)
+
+
+def read_worker_metrics(directory: str) -> list[dict]:
+    """
+    Snapshots de todos los workers del directorio. Los de workers que ya no
+    existen conservan sus counters e histogramas (los totales no retroceden)
+    pero no sus gauges.
+    """
+    snapshots = []
+    for name in os.listdir(directory):
+        if not (name.startswith("worker-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if not pid_alive(snapshot["pid"]):
+            snapshot["metrics"] = {
+                metric_name: values
+                for metric_name, values in snapshot["metrics"].items()
+                if metric_name in registry.metrics
+                and registry.metrics[metric_name].type != "gauge"
+            }
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def render_metrics() -> str:
+    """Métricas del proceso o, con metrics_multiproc_dir, de todos los workers."""
+    if not settings.metrics_multiproc_dir:
+        return registry.render()
+    write_worker_metrics()
+    return registry.render(read_worker_metrics(settings.metrics_multiproc_dir))
@@ -0,0 +1,92 @@
+import asyncio
+
+from app.config import settings
+from app.services.metrics import Counter, registry
+from app.services.search import aprefetch_experience_details
+
+PREFETCH_BATCHES = registry.register(
+    Counter(
+        "rutopia_detail_prefetch_total",
+        "Lotes de prefetch de detalles por resultado (done/skipped/cancelled/error)",
+    )
+)
+PREFETCH_ROWS = registry.register(
+    Counter(
+        "rutopia_detail_prefetch_rows_total",
+        "Detalles de experiencias cargados en cache por prefetch",
+    )
+)
+
+
+class DetailPrefetcher:
+    """
+    Precarga los detalles de los primeros resultados de una búsqueda mientras
+    el modelo escribe la respuesta: el "cuéntame más del primero" siguiente
+    sale de la cache de detalles sin ir a Supabase.
+
+    Es best-effort: con max_concurrency lotes en curso, los nuevos se descartan
+    en lugar de encolarse. Los lotes de una sesión se cancelan al desconectarse.
+    """
+
+    def __init__(self, top_k: int, max_concurrency: int):
+        self.top_k = top_k
+        self.max_concurrency = max_concurrency
+        self.tasks: dict[str, set[asyncio.Task]] = {}
+
+    @property
+    def active(self) -> int:
+        return sum(len(tasks) for tasks in self.tasks.values())
+
+    def schedule(self, session_id: str, experiences: list[dict]) -> asyncio.Task | None:
+        """Lanza el prefetch de los top_k resultados (sin esperar)."""
+        if self.top_k <= 0:
+            return None
+        ids = [exp["id"] for exp in experiences[: self.top_k] if exp.get("id")]
+        if not ids:
+            return None
+        if self.active >= self.max_concurrency:
+            PREFETCH_BATCHES.inc(result="skipped")
+            return None
+
+        task = asyncio.create_task(self._prefetch(ids))
+        self.tasks.setdefault(session_id, set()).add(task)
+        task.add_done_callback(lambda done: self._finished(session_id, done))
+        return task
+
+    async def _prefetch(self, ids: list[str]):
+        try:
+            fetched = await aprefetch_experience_details(ids)
+        except asyncio.CancelledError:
+            PREFETCH_BATCHES.inc(result="cancelled")
+            raise
+        except Exception as e:
+            PREFETCH_BATCHES.inc(result="error")
+            print(f"⚠️  Prefetch de detalles falló: {e}")
+            return
+        PREFETCH_BATCHES.inc(result="done")
+        PREFETCH_ROWS.inc(fetched)
+
+    def _finished(self, session_id: str, task: asyncio.Task):
+        tasks = self.tasks.get(session_id)
+        if tasks is None:
+            return
+        tasks.discard(task)
+        if not tasks:
+            del self.tasks[session_id]
+
+    def cancel(self, session_id: str):
+        """Cancela los prefetch en curso de la sesión (se fue el cliente)."""
+        for task in list(self.tasks.get(session_id, ())):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "top_k": self.top_k,
+            "active": self.active,
+            "sessions": len(self.tasks),
+        }
+
+
+detail_prefetcher = DetailPrefetcher(
+    settings.detail_prefetch_top_k, settings.detail_prefetch_max_concurrency
+)
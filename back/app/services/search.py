@@ -1,7 +1,70 @@
-from app.services.supabase import get_client
-from app.services.embeddings import generate_embedding
+import asyncio
+import math
+import time
+
+from app.config import settings
+from app.services.cache import TTLCache
+from app.services.supabase import get_async_client
+from app.services.embeddings import normalize_query
+from app.services.admission import current_session, supabase_limiter
+from app.services.metrics import SEARCH_COALESCED, SEARCH_PAGES, span
+from app.services.speculation import aquery_embedding, speculative_source
+from app.services.geo_index import GeoIndex, filter_rows_near, radius_filter
+from app.services.vector_index import ENHANCED_COLUMNS, fetch_table, get_index, join_catalog
 from app.models.schemas import Experience, SearchFilters
 
+# Columnas para aget_experience_by_id: experiences + experiences_enhanced en un
+# solo request (join embebido de PostgREST vía la FK experience_id). De full_json
+# sólo viajan las tarifas: PostgREST extrae la llave en el servidor (->). El
+# docstring de get_experience_details y el prompt describen sólo estos campos
+DETAIL_COLUMNS = (
+    "id, narrative_text, supplier_name, city, destination_name, duration, lat, lon, "
+    "rates:full_json->rates, experiences_enhanced(one_line_summary, environment_type, "
+    "primary_experience_type, physical_intensity, family_friendly, includes_food, "
+    "includes_transport, semantic_tags, unique_selling_points)"
+)
+
+# Cache de detalles por ID. La llave incluye la versión del catálogo, así
+# invalidar todo es O(1): las entradas viejas expiran solas por LRU/TTL.
+_details_cache = TTLCache(
+    max_size=settings.detail_cache_size,
+    ttl_seconds=settings.detail_cache_ttl_seconds,
+)
+_catalog_version = 0
+
+# Cache de resultados de búsqueda. Cualquier invalidación sube la generación,
+# así una búsqueda que estaba en curso no deja resultados viejos en la cache.
+_search_cache = TTLCache(
+    max_size=settings.search_cache_size,
+    ttl_seconds=settings.search_cache_ttl_seconds,
+)
+_search_generation = 0
+
+# Búsquedas en curso por llave: las idénticas esperan a la misma (singleflight)
+_inflight_searches: dict[tuple, asyncio.Task] = {}
+
+# Último conjunto de candidatos por sesión, para paginar sin repetir la búsqueda
+_candidate_sets = TTLCache(
+    max_size=settings.search_candidates_sessions,
+    ttl_seconds=settings.search_candidates_ttl_seconds,
+)
+
+# Índice geográfico del catálogo (mapa: bbox del viewport y "cerca de")
+GEO_EXPERIENCE_COLUMNS = "id, narrative_text, destination_name, city, duration, lat, lon"
+_geo_index: GeoIndex | None = None
+
+# Versión de las caches compartida entre workers (la guarda el store de sesiones).
+# /cache/invalidate llega a un solo worker: ése la sube y los demás, al verla
+# cambiada, descartan sus caches. Se consulta antes de servir desde cache, a lo
+# sumo cada cache_version_check_seconds (lo que puede durar un dato viejo).
+_shared_versions = None
+_shared_version_seen = 0
+_shared_version_checked_at = 0.0
+
+# Detalles que está trayendo un prefetch: quien los pide mientras tanto espera
+# ese lote en lugar de repetir la query
+_inflight_details: dict[str, asyncio.Future] = {}
+
 
 def extract_title_from_narrative(narrative_text: str) -> str:
     """Extrae el título del narrative_text."""
@@ -20,95 +83,233 @@ def extract_title_from_narrative(narrative_text: str) -> str:
     return narrative_text[:100].strip()
 
 
-def search_experiences(filters: SearchFilters, limit: int = 10) -> list[Experience]:
+def build_search_params(
+    filters: SearchFilters, query_embedding: list[float], limit: int
+) -> dict:
+    """Parámetros para la función search_experiences_hybrid de Supabase."""
+    return {
+        "query_embedding": query_embedding,
+        "filter_destination": filters.destination,
+        "filter_city": filters.city,
+        "filter_family_friendly": filters.family_friendly,
+        "filter_intensity": filters.physical_intensity,
+        "filter_max_duration": filters.max_duration_hours,
+        "filter_environment": filters.environment_type,
+        "filter_includes_food": filters.includes_food,
+        "filter_experience_type": filters.experience_type,
+        "match_count": limit,
+    }
+
+
+def rpc_match_count(filters: SearchFilters, limit: int) -> int:
     """
-    Búsqueda híbrida: genera embedding del query y llama a la función de Supabase.
+    Filas a pedir a la RPC, que no filtra por distancia. Con filtro de cercanía
+    se piden de más (según qué fracción del catálogo cae en el radio, si el
+    índice geográfico está cargado) y rpc_rows filtra. 0 = nada en el radio.
     """
-    supabase = get_client()
-
-    # 1. Generar embedding del query semántico
-    query_embedding = generate_embedding(filters.semantic_query)
-
-    # 2. Llamar a la función de búsqueda híbrida en Supabase
-    result = supabase.rpc(
-        "search_experiences_hybrid",
-        {
-            "query_embedding": query_embedding,
-            "filter_destination": filters.destination,
-            "filter_city": filters.city,
-            "filter_family_friendly": filters.family_friendly,
-            "filter_intensity": filters.physical_intensity,
-            "filter_max_duration": filters.max_duration_hours,
-            "filter_environment": filters.environment_type,
-            "filter_includes_food": filters.includes_food,
-            "filter_experience_type": filters.experience_type,
-            "match_count": limit,
-        },
-    ).execute()
-
-    # 3. Transformar resultados a modelo Experience
-    experiences = []
-    for row in result.data:
-        # Extraer highlights de unique_selling_points
-        highlights = []
-        if row.get("unique_selling_points"):
-            usp = row["unique_selling_points"]
-            if isinstance(usp, list):
-                highlights = usp[:3]  # Máximo 3 highlights
-
-        # Construir nombre
-        name = row.get("one_line_summary") or extract_title_from_narrative(
-            row.get("narrative_text", "")
-        )
+    near = radius_filter(filters)
+    if near is None:
+        return limit
 
-        # Construir ubicación
-        location = row.get("city") or row.get("destination_name") or "México"
-
-        experience = Experience(
-            id=str(row["id"]),
-            name=name,
-            summary=row.get("one_line_summary") or row.get("narrative_text", "")[:200],
-            lat=float(row["lat"]) if row.get("lat") else 0.0,
-            lon=float(row["lon"]) if row.get("lon") else 0.0,
-            duration=row.get("duration"),
-            location=location,
-            destination=row.get("destination_name"),
-            highlights=highlights,
-            type=row.get("primary_experience_type"),
-            intensity=row.get("physical_intensity"),
-            family_friendly=row.get("family_friendly"),
-            includes_food=row.get("includes_food"),
-            includes_transport=row.get("includes_transport"),
-            similarity=row.get("similarity"),
-        )
-        experiences.append(experience)
+    match_count = limit * settings.geo_search_overfetch
+    index = get_geo_index()
+    if index is not None and len(index):
+        inside = len(index.near(*near))
+        if inside == 0:
+            return 0
+        match_count = math.ceil(match_count * len(index) / inside)
+    return min(match_count, settings.geo_search_max_rows)
 
-    return experiences
 
+def rpc_rows(filters: SearchFilters, rows: list[dict], limit: int) -> list[dict]:
+    """Filas de la RPC con el filtro de cercanía aplicado (si hay)."""
+    near = radius_filter(filters)
+    if near is None:
+        return rows
+    return filter_rows_near(rows, *near)[:limit]
 
-def get_experience_by_id(experience_id: str) -> dict | None:
-    """Obtiene los detalles completos de una experiencia por ID."""
-    supabase = get_client()
 
-    # Traer de experiences
-    result = supabase.table("experiences").select("*").eq("id", experience_id).execute()
+def row_to_experience(row: dict) -> Experience:
+    """Transforma una fila de search_experiences_hybrid en un Experience."""
+    # Extraer highlights de unique_selling_points
+    highlights = []
+    if row.get("unique_selling_points"):
+        usp = row["unique_selling_points"]
+        if isinstance(usp, list):
+            highlights = usp[:3]  # Máximo 3 highlights
 
-    if not result.data:
+    # Construir nombre
+    name = row.get("one_line_summary") or extract_title_from_narrative(
+        row.get("narrative_text", "")
+    )
+
+    # Construir ubicación
+    location = row.get("city") or row.get("destination_name") or "México"
+
+    return Experience(
+        id=str(row["id"]),
+        name=name,
+        summary=row.get("one_line_summary") or (row.get("narrative_text") or "")[:200],
+        lat=float(row["lat"]) if row.get("lat") else 0.0,
+        lon=float(row["lon"]) if row.get("lon") else 0.0,
+        duration=row.get("duration"),
+        location=location,
+        destination=row.get("destination_name"),
+        highlights=highlights,
+        type=row.get("primary_experience_type"),
+        intensity=row.get("physical_intensity"),
+        family_friendly=row.get("family_friendly"),
+        includes_food=row.get("includes_food"),
+        includes_transport=row.get("includes_transport"),
+        similarity=row.get("similarity"),
+    )
+
+
+def get_local_index():
+    """Índice local si está habilitado y cargado; si no, None (se usa la RPC)."""
+    if settings.search_engine != "local":
         return None
+    return get_index()
 
-    experience = result.data[0]
 
-    # Traer datos enhanced
-    enhanced_result = (
-        supabase.table("experiences_enhanced")
-        .select("*")
-        .eq("experience_id", experience_id)
-        .execute()
+def search_cache_key(filters: SearchFilters, limit: int) -> tuple:
+    """Llave de cache: filtros normalizados, limit y versión del catálogo/índice."""
+    values = filters.model_dump()
+    values["semantic_query"] = normalize_query(filters.semantic_query)
+    normalized = tuple(
+        (field, value.strip() if isinstance(value, str) else value)
+        for field, value in sorted(values.items())
+    )
+    index = get_local_index()
+    return (
+        _search_generation,
+        index.built_at if index is not None else None,
+        normalized,
+        limit,
     )
 
-    enhanced = enhanced_result.data[0] if enhanced_result.data else {}
 
-    # Combinar datos
+async def asearch_experiences(
+    filters: SearchFilters, limit: int = 10
+) -> list[Experience]:
+    """
+    Búsqueda híbrida con cache de resultados (ver asearch_experiences_uncached).
+    N búsquedas idénticas concurrentes hacen un solo embedding y una sola RPC.
+    """
+    await sync_shared_cache_version()
+    key = search_cache_key(filters, limit)
+    # Con el embedding especulativo (del mensaje, no de la semantic_query) el
+    # resultado es otro: va en otra llave, sólo la comparte el mismo mensaje
+    source = speculative_source(filters.semantic_query)
+    if source is not None:
+        key += (("embedding", normalize_query(source)),)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    task = _inflight_searches.get(key)
+    if task is None:
+        task = asyncio.create_task(asearch_experiences_uncached(filters, limit))
+        _inflight_searches[key] = task
+        task.add_done_callback(lambda done: finish_search(key, done))
+    else:
+        SEARCH_COALESCED.inc()
+
+    # shield: si se cancela quien espera, la búsqueda sigue para los demás
+    return list(await asyncio.shield(task))
+
+
+class CandidateSet:
+    """Resultados rankeados de una búsqueda, pedidos de más para servir varias páginas."""
+
+    __slots__ = ("key", "experiences", "complete")
+
+    def __init__(self, key: tuple, experiences: list[Experience], complete: bool):
+        self.key = key
+        self.experiences = experiences
+        self.complete = complete  # No hay más resultados que los que ya tiene
+
+
+async def asearch_experiences_page(
+    filters: SearchFilters, page: int = 1, page_size: int = 8
+) -> list[Experience]:
+    """
+    Página `page` de una búsqueda. La primera pide search_candidates resultados
+    y los guarda para la sesión; las siguientes páginas de la misma búsqueda
+    salen de ahí, sin embedding ni RPC, y nunca repiten experiencias de otra
+    página. Si el conjunto no alcanza se vuelve a pedir uno más grande.
+    """
+    await sync_shared_cache_version()
+    page = max(page, 1)
+    needed = page * page_size
+    session_id = current_session()
+    key = search_cache_key(filters, 0)
+
+    candidates = _candidate_sets.get(session_id)
+    if candidates is not None and candidates.key != key:
+        candidates = None
+
+    if candidates is None or (
+        needed > len(candidates.experiences) and not candidates.complete
+    ):
+        fetch = max(settings.search_candidates, needed)
+        if candidates is not None:
+            fetch = max(fetch, 2 * len(candidates.experiences))
+        fetch = min(fetch, settings.search_candidates_max)
+
+        experiences = await asearch_experiences(filters, limit=fetch)
+        complete = len(experiences) < fetch or fetch >= settings.search_candidates_max
+        candidates = CandidateSet(key, experiences, complete)
+        _candidate_sets.set(session_id, candidates)
+        SEARCH_PAGES.inc(source="search")
+    else:
+        SEARCH_PAGES.inc(source="candidates")
+
+    start = (page - 1) * page_size
+    return candidates.experiences[start : start + page_size]
+
+
+def finish_search(key: tuple, task: asyncio.Task):
+    """Saca la búsqueda de las en curso y guarda el resultado si terminó bien."""
+    _inflight_searches.pop(key, None)
+    if not task.cancelled() and task.exception() is None:
+        _search_cache.set(key, task.result())
+
+
+async def asearch_experiences_uncached(
+    filters: SearchFilters, limit: int = 10
+) -> list[Experience]:
+    """
+    Búsqueda híbrida: obtiene el embedding del query y llama a la función de
+    Supabase. Con search_engine="local" usa el índice en memoria en lugar de la RPC.
+    """
+    match_count = rpc_match_count(filters, limit)
+    if match_count == 0:
+        return []
+
+    # Puede reutilizar el embedding especulativo del mensaje del usuario
+    query_embedding = await aquery_embedding(filters.semantic_query)
+
+    index = get_local_index()
+    if index is not None:
+        with span("local_search"):
+            rows = index.search(query_embedding, filters, limit)
+        return [row_to_experience(row) for row in rows]
+
+    supabase = await get_async_client()
+
+    async with supabase_limiter.slot():
+        with span("search_rpc"):
+            result = await supabase.rpc(
+                "search_experiences_hybrid",
+                build_search_params(filters, query_embedding, match_count),
+            ).execute()
+
+    return [row_to_experience(row) for row in rpc_rows(filters, result.data, limit)]
+
+
+def combine_experience_details(experience: dict, enhanced: dict) -> dict:
+    """Combina una fila de experiences con su fila de experiences_enhanced."""
     return {
         "id": experience["id"],
         "name": enhanced.get("one_line_summary")
@@ -120,7 +321,7 @@ def get_experience_by_id(experience_id: str) -> dict | None:
         "duration": experience.get("duration"),
         "lat": experience.get("lat"),
         "lon": experience.get("lon"),
-        "full_json": experience.get("full_json"),
+        "rates": experience.get("rates"),
         "environment_type": enhanced.get("environment_type"),
         "primary_experience_type": enhanced.get("primary_experience_type"),
         "physical_intensity": enhanced.get("physical_intensity"),
@@ -131,3 +332,204 @@ def get_experience_by_id(experience_id: str) -> dict | None:
         "unique_selling_points": enhanced.get("unique_selling_points"),
         "one_line_summary": enhanced.get("one_line_summary"),
     }
+
+
+def split_detail_row(row: dict) -> tuple[dict, dict]:
+    """Separa la fila con join embebido en (experience, enhanced)."""
+    experience = dict(row)
+    enhanced = experience.pop("experiences_enhanced", None) or {}
+    # Relación uno-a-muchos: PostgREST devuelve una lista
+    if isinstance(enhanced, list):
+        enhanced = enhanced[0] if enhanced else {}
+    return experience, enhanced
+
+
+def get_cached_details(experience_id: str) -> dict | None:
+    """Detalles en cache (None si no están)."""
+    return _details_cache.get((_catalog_version, str(experience_id)))
+
+
+def cache_details(experience_id: str, details: dict):
+    _details_cache.set((_catalog_version, str(experience_id)), details)
+
+
+def invalidate_experience_details(experience_ids: list[str] | None = None):
+    """Invalida los detalles de las experiencias dadas, o de todas si no se pasan IDs."""
+    global _catalog_version
+    invalidate_search_results()
+    if experience_ids is None:
+        _catalog_version += 1
+        return
+
+    for experience_id in experience_ids:
+        _details_cache.pop((_catalog_version, str(experience_id)))
+
+
+def use_shared_cache_version(store):
+    """Usa la versión de caches del store (SessionStore) para invalidar entre workers."""
+    global _shared_versions
+    _shared_versions = store
+
+
+async def sync_shared_cache_version():
+    """Descarta las caches de este proceso si otro worker las invalidó."""
+    global _shared_version_seen, _shared_version_checked_at
+    now = time.monotonic()
+    if (
+        _shared_versions is None
+        or now - _shared_version_checked_at < settings.cache_version_check_seconds
+    ):
+        return
+    _shared_version_checked_at = now
+
+    version = await _shared_versions.get_cache_version()
+    if version != _shared_version_seen:
+        _shared_version_seen = version
+        invalidate_experience_details()
+
+
+async def ainvalidate_experience_details(experience_ids: list[str] | None = None):
+    """Invalida en este proceso y sube la versión compartida para los demás workers."""
+    global _shared_version_seen
+    invalidate_experience_details(experience_ids)
+    if _shared_versions is None:
+        return
+
+    version = await _shared_versions.bump_cache_version()
+    if version != _shared_version_seen + 1:
+        # Otro worker invalidó entre medio y todavía no lo vimos
+        invalidate_experience_details()
+    _shared_version_seen = version
+
+
+def get_detail_cache_stats() -> dict:
+    return {**_details_cache.stats(), "version": _catalog_version}
+
+
+def invalidate_search_results():
+    """Descarta los resultados de búsqueda en cache (cualquier fila pudo cambiar de ranking)."""
+    global _search_generation
+    _search_generation += 1
+    _search_cache.clear()
+    _candidate_sets.clear()
+
+
+def get_search_cache_stats() -> dict:
+    return {
+        **_search_cache.stats(),
+        "generation": _search_generation,
+        "in_flight": len(_inflight_searches),
+    }
+
+
+async def aget_experience_by_id(experience_id: str) -> dict | None:
+    """Obtiene los detalles completos de una experiencia por ID."""
+    await sync_shared_cache_version()
+    cached = get_cached_details(experience_id)
+    if cached is not None:
+        return cached
+
+    pending = _inflight_details.get(str(experience_id))
+    if pending is not None:
+        await asyncio.wait({pending})
+        cached = get_cached_details(experience_id)
+        if cached is not None:
+            return cached
+
+    supabase = await get_async_client()
+
+    async with supabase_limiter.slot():
+        with span("experience_details"):
+            result = (
+                await supabase.table("experiences")
+                .select(DETAIL_COLUMNS)
+                .eq("id", experience_id)
+                .execute()
+            )
+
+    if not result.data:
+        return None
+
+    details = combine_experience_details(*split_detail_row(result.data[0]))
+    cache_details(experience_id, details)
+    return details
+
+
+async def aprefetch_experience_details(experience_ids: list[str]) -> int:
+    """
+    Trae en una sola query los detalles que no estén en cache ni en camino y
+    los deja en la cache de detalles. Devuelve cuántos cargó.
+    """
+    missing = list(
+        dict.fromkeys(
+            str(experience_id)
+            for experience_id in experience_ids
+            if get_cached_details(experience_id) is None
+            and str(experience_id) not in _inflight_details
+        )
+    )
+    if not missing:
+        return 0
+
+    done = asyncio.get_running_loop().create_future()
+    for experience_id in missing:
+        _inflight_details[experience_id] = done
+
+    try:
+        supabase = await get_async_client()
+        async with supabase_limiter.slot():
+            with span("experience_details_prefetch", count=len(missing)):
+                result = (
+                    await supabase.table("experiences")
+                    .select(DETAIL_COLUMNS)
+                    .in_("id", missing)
+                    .execute()
+                )
+
+        for row in result.data:
+            details = combine_experience_details(*split_detail_row(row))
+            cache_details(details["id"], details)
+        return len(result.data)
+    finally:
+        for experience_id in missing:
+            if _inflight_details.get(experience_id) is done:
+                del _inflight_details[experience_id]
+        done.set_result(None)
+
+
+def get_geo_index() -> GeoIndex | None:
+    """Índice geográfico actual (None si todavía no se cargó)."""
+    return _geo_index
+
+
+def build_geo_index(experiences: list[dict], enhanced: list[dict]) -> GeoIndex:
+    """Índice geográfico con las experiencias ya en el formato del mapa."""
+    items = [
+        row_to_experience(row).model_dump()
+        for row in join_catalog(experiences, enhanced)
+    ]
+    return GeoIndex(items, settings.geo_cell_degrees)
+
+
+async def refresh_geo_index() -> GeoIndex:
+    """Recarga coordenadas y metadata del catálogo (sin embeddings) y reemplaza el índice."""
+    global _geo_index
+
+    experiences, enhanced = await asyncio.gather(
+        fetch_table("experiences", GEO_EXPERIENCE_COLUMNS),
+        fetch_table("experiences_enhanced", ENHANCED_COLUMNS),
+    )
+    index = await asyncio.to_thread(build_geo_index, experiences, enhanced)
+    _geo_index = index
+    print(f"🗺️  Índice geográfico cargado: {len(index)} experiencias")
+    return index
+
+
+async def periodic_geo_refresh():
+    """Refresca el índice geográfico cada geo_index_refresh_seconds."""
+    while True:
+        try:
+            await refresh_geo_index()
+        except Exception as e:
+            print(f"⚠️  Error refrescando el índice geográfico: {e}")
+        await asyncio.sleep(settings.geo_index_refresh_seconds)
@@ -0,0 +1,425 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+from app.agent.state import AgentState
+from app.config import settings
+from app.services.cache import TTLCache
+
+
+def empty_state() -> AgentState:
+    return {"messages": [], "last_search_results": [], "last_search_version": 0}
+
+
+def freeze_messages(messages: list) -> tuple:
+    """
+    Prepara mensajes para compartirlos entre turnos sin copiarlos: les asigna
+    ID para que add_messages de LangGraph no tenga que mutarlos después.
+    """
+    for message in messages:
+        if message.id is None:
+            message.id = str(uuid.uuid4())
+    return tuple(messages)
+
+
+def dump_messages(messages: list) -> list[str]:
+    """Serializa mensajes de LangChain a JSON (uno por mensaje)."""
+    return [json.dumps(data) for data in messages_to_dict(freeze_messages(messages))]
+
+
+def load_messages(rows: list[str]) -> list:
+    return messages_from_dict([json.loads(row) for row in rows])
+
+
+class SessionStore(ABC):
+    """
+    Almacén de sesiones. Los mensajes son append-only: cada turno guarda sólo
+    los mensajes nuevos; el resto del estado (last_search_results, etc.) se
+    guarda como un dict de campos que se reemplaza completo.
+    """
+
+    @abstractmethod
+    async def load(self, session_id: str) -> AgentState:
+        """Estado completo de la sesión (vacío si no existe)."""
+
+    @abstractmethod
+    async def append(self, session_id: str, messages: list, fields: dict):
+        """Agrega mensajes nuevos y actualiza los demás campos del estado."""
+
+    @abstractmethod
+    async def touch(self, session_id: str):
+        """Crea la sesión si no existe y marca actividad."""
+
+    @abstractmethod
+    async def count(self) -> int:
+        """Número de sesiones guardadas."""
+
+    @abstractmethod
+    async def cleanup(self, max_age_seconds: float, keep: set[str]) -> int:
+        """Borra sesiones inactivas (excepto las de keep). Devuelve cuántas borró."""
+
+    @abstractmethod
+    async def get_cache_version(self) -> int:
+        """Versión de las caches del catálogo compartida entre workers (0 si no hay)."""
+
+    @abstractmethod
+    async def bump_cache_version(self) -> int:
+        """Sube la versión compartida de las caches y devuelve la nueva."""
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Sesiones en un dict del proceso (sólo sirve con un worker).
+
+    El historial es una tupla inmutable: leer es tomar un snapshot sin copiar
+    mensajes y cada turno crea una tupla nueva con el delta al final, así el
+    costo por turno no crece con la longitud de la conversación.
+    """
+
+    def __init__(self):
+        self.messages: dict[str, tuple] = {}
+        self.fields: dict[str, dict] = {}
+        self.last_active: dict[str, float] = {}
+        self.cache_version = 0
+
+    async def load(self, session_id: str) -> AgentState:
+        state = empty_state()
+        state.update(self.fields.get(session_id, {}))
+        state["messages"] = list(self.messages.get(session_id, ()))
+        return state
+
+    async def append(self, session_id: str, messages: list, fields: dict):
+        history = self.messages.get(session_id, ())
+        self.messages[session_id] = history + freeze_messages(messages)
+        self.fields[session_id] = {**self.fields.get(session_id, {}), **fields}
+        self.last_active[session_id] = time.time()
+
+    async def touch(self, session_id: str):
+        self.messages.setdefault(session_id, ())
+        self.last_active[session_id] = time.time()
+
+    async def count(self) -> int:
+        return len(self.last_active)
+
+    async def cleanup(self, max_age_seconds: float, keep: set[str]) -> int:
+        cutoff = time.time() - max_age_seconds
+        to_remove = [
+            sid
+            for sid, last_active in self.last_active.items()
+            if last_active < cutoff and sid not in keep
+        ]
+        for sid in to_remove:
+            self.messages.pop(sid, None)
+            self.fields.pop(sid, None)
+            self.last_active.pop(sid, None)
+        return len(to_remove)
+
+    async def get_cache_version(self) -> int:
+        return self.cache_version
+
+    async def bump_cache_version(self) -> int:
+        self.cache_version += 1
+        return self.cache_version
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sesiones en SQLite (modo WAL) compartidas entre workers de la misma máquina.
+    Las operaciones corren en un thread para no bloquear el event loop.
+
+    Cada worker guarda un snapshot (último seq, mensajes) por sesión y en cada
+    load sólo lee y deserializa los mensajes con seq mayor.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshots = TTLCache(
+            max_size=settings.session_snapshot_cache_size,
+            ttl_seconds=settings.session_snapshot_cache_ttl_seconds,
+        )
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                fields TEXT NOT NULL,
+                last_active REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS session_messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_active
+                ON sessions (last_active);
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+            """
+        )
+
+    def _load(self, session_id: str) -> AgentState:
+        last_seq, messages = self._snapshots.get(session_id) or (0, ())
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fields FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            (max_seq,) = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM session_messages WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if max_seq < last_seq:
+                # La sesión se borró y se recreó en otro worker: leer todo
+                last_seq, messages = 0, ()
+            rows = self._conn.execute(
+                "SELECT seq, data FROM session_messages "
+                "WHERE session_id = ? AND seq > ? ORDER BY seq",
+                (session_id, last_seq),
+            ).fetchall()
+
+        if rows:
+            messages += freeze_messages(load_messages([data for _, data in rows]))
+            last_seq = rows[-1][0]
+        self._snapshots.set(session_id, (last_seq, messages))
+
+        state = empty_state()
+        if row:
+            state.update(json.loads(row[0]))
+        state["messages"] = list(messages)
+        return state
+
+    def _append(self, session_id: str, rows: list[str], fields: dict):
+        with self._lock:
+            # BEGIN IMMEDIATE: otro worker no puede intercalar mensajes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (last_seq,) = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM session_messages WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                self._conn.executemany(
+                    "INSERT INTO session_messages (session_id, seq, data) VALUES (?, ?, ?)",
+                    [(session_id, last_seq + i, data) for i, data in enumerate(rows, 1)],
+                )
+                self._conn.execute(
+                    """
+                    INSERT INTO sessions (id, fields, last_active) VALUES (?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        fields = json_patch(sessions.fields, excluded.fields),
+                        last_active = excluded.last_active
+                    """,
+                    (session_id, json.dumps(fields), time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _touch(self, session_id: str):
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO sessions (id, fields, last_active) VALUES (?, '{}', ?)
+                ON CONFLICT (id) DO UPDATE SET last_active = excluded.last_active
+                """,
+                (session_id, time.time()),
+            )
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _cleanup(self, max_age_seconds: float, keep: set[str]) -> int:
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            stale = [
+                sid
+                for (sid,) in self._conn.execute(
+                    "SELECT id FROM sessions WHERE last_active < ?", (cutoff,)
+                )
+                if sid not in keep
+            ]
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sid in stale:
+                    self._conn.execute(
+                        "DELETE FROM session_messages WHERE session_id = ?", (sid,)
+                    )
+                    self._conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+                    self._snapshots.pop(sid)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(stale)
+
+    def _get_cache_version(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM cache_versions WHERE name = 'catalog'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _bump_cache_version(self) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    """
+                    INSERT INTO cache_versions (name, version) VALUES ('catalog', 1)
+                    ON CONFLICT (name) DO UPDATE SET version = version + 1
+                    """
+                )
+                (version,) = self._conn.execute(
+                    "SELECT version FROM cache_versions WHERE name = 'catalog'"
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return version
+
+    async def load(self, session_id: str) -> AgentState:
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def append(self, session_id: str, messages: list, fields: dict):
+        rows = dump_messages(messages)
+        await asyncio.to_thread(self._append, session_id, rows, fields)
+
+    async def touch(self, session_id: str):
+        await asyncio.to_thread(self._touch, session_id)
+
+    async def count(self) -> int:
+        return await asyncio.to_thread(self._count)
+
+    async def cleanup(self, max_age_seconds: float, keep: set[str]) -> int:
+        return await asyncio.to_thread(self._cleanup, max_age_seconds, keep)
+
+    async def get_cache_version(self) -> int:
+        return await asyncio.to_thread(self._get_cache_version)
+
+    async def bump_cache_version(self) -> int:
+        return await asyncio.to_thread(self._bump_cache_version)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sesiones en Redis (o cualquier servidor compatible). Recibe un cliente
+    async con la interfaz de redis.asyncio, así se puede probar con un sustituto local.
+
+    Llaves:
+      {prefix}:{id}:messages  lista de mensajes (RPUSH)
+      {prefix}:{id}:fields    hash con el resto del estado (JSON por campo)
+      {prefix}:index          sorted set id -> última actividad
+      {prefix}:cache_version  versión de las caches del catálogo (INCR)
+    """
+
+    def __init__(self, client, prefix: str = "rutopia:session"):
+        self.client = client
+        self.prefix = prefix
+        # Snapshot por sesión: sólo se leen los mensajes nuevos de la lista
+        self._snapshots = TTLCache(
+            max_size=settings.session_snapshot_cache_size,
+            ttl_seconds=settings.session_snapshot_cache_ttl_seconds,
+        )
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisSessionStore":
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError(
+                "SESSION_BACKEND=redis requiere el paquete 'redis' (uv add redis)"
+            ) from e
+        return cls(redis.from_url(url, decode_responses=True))
+
+    def _key(self, session_id: str, kind: str) -> str:
+        return f"{self.prefix}:{session_id}:{kind}"
+
+    @property
+    def _index(self) -> str:
+        return f"{self.prefix}:index"
+
+    async def load(self, session_id: str) -> AgentState:
+        messages_key = self._key(session_id, "messages")
+        messages = self._snapshots.get(session_id) or ()
+
+        if await self.client.llen(messages_key) < len(messages):
+            # La sesión se borró y se recreó en otro worker: leer todo
+            messages = ()
+        rows = await self.client.lrange(messages_key, len(messages), -1)
+        fields = await self.client.hgetall(self._key(session_id, "fields"))
+
+        if rows:
+            messages += freeze_messages(load_messages(rows))
+        self._snapshots.set(session_id, messages)
+
+        state = empty_state()
+        state.update({key: json.loads(value) for key, value in fields.items()})
+        state["messages"] = list(messages)
+        return state
+
+    async def append(self, session_id: str, messages: list, fields: dict):
+        rows = dump_messages(messages)
+        if rows:
+            await self.client.rpush(self._key(session_id, "messages"), *rows)
+        if fields:
+            await self.client.hset(
+                self._key(session_id, "fields"),
+                mapping={key: json.dumps(value) for key, value in fields.items()},
+            )
+        await self.touch(session_id)
+
+    async def touch(self, session_id: str):
+        await self.client.zadd(self._index, {session_id: time.time()})
+
+    async def count(self) -> int:
+        return await self.client.zcard(self._index)
+
+    async def cleanup(self, max_age_seconds: float, keep: set[str]) -> int:
+        cutoff = time.time() - max_age_seconds
+        stale = [
+            sid
+            for sid in await self.client.zrangebyscore(self._index, "-inf", cutoff)
+            if sid not in keep
+        ]
+        for sid in stale:
+            await self.client.delete(
+                self._key(sid, "messages"), self._key(sid, "fields")
+            )
+            await self.client.zrem(self._index, sid)
+            self._snapshots.pop(sid)
+        return len(stale)
+
+    async def get_cache_version(self) -> int:
+        return int(await self.client.get(f"{self.prefix}:cache_version") or 0)
+
+    async def bump_cache_version(self) -> int:
+        return await self.client.incr(f"{self.prefix}:cache_version")
+
+
+def create_session_store() -> SessionStore:
+    """Crea el store configurado en SESSION_BACKEND (memory, sqlite o redis)."""
+    backend = settings.session_backend
+    if backend == "memory":
+        return InMemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(settings.session_db_path)
+    if backend == "redis":
+        if not settings.redis_url:
+            raise RuntimeError("SESSION_BACKEND=redis requiere REDIS_URL")
+        return RedisSessionStore.from_url(settings.redis_url)
+    raise ValueError(f"SESSION_BACKEND desconocido: {backend}")
@@ -0,0 +1,139 @@
+import asyncio
+import re
+import time
+from contextvars import ContextVar
+
+from app.config import settings
+from app.services.embeddings import agenerate_embedding
+from app.services.metrics import Counter, registry
+from app.services.vector_index import normalize_value
+
+SPECULATION_RESULTS = registry.register(
+    Counter(
+        "rutopia_speculative_embedding_total",
+        "Embeddings especulativos del mensaje del usuario por resultado (hit/miss/unused)",
+    )
+)
+SPECULATION_SAVED_SECONDS = registry.register(
+    Counter(
+        "rutopia_speculative_embedding_saved_seconds_total",
+        "Tiempo de embedding ahorrado en búsquedas que reutilizaron la especulación",
+    )
+)
+
+# Palabras que no aportan al comparar el mensaje con la semantic_query
+STOPWORDS = {
+    "a", "al", "busca", "buscar", "busco", "con", "de", "del", "el", "en", "la",
+    "las", "los", "me", "mi", "mis", "muestrame", "para", "por", "que", "quiero",
+    "un", "una", "unos", "unas", "y", "an", "and", "find", "for", "i", "in",
+    "my", "of", "search", "show", "some", "the", "to", "want", "with",
+}
+
+_speculation: ContextVar["Speculation | None"] = ContextVar(
+    "rutopia_speculation", default=None
+)
+
+
+def content_tokens(text: str) -> set[str]:
+    """Palabras significativas normalizadas (minúsculas, sin acentos ni stopwords)."""
+    return {
+        word for word in re.findall(r"\w+", normalize_value(text)) if word not in STOPWORDS
+    }
+
+
+def overlap(a: set[str], b: set[str]) -> float:
+    """Similitud de Jaccard entre dos conjuntos de palabras."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class Speculation:
+    """Embedding del mensaje crudo del usuario, calculado mientras el modelo piensa."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = content_tokens(text)
+        self.started_at = time.perf_counter()
+        self.finished_at: float | None = None
+        self.used = False
+        self.task = asyncio.create_task(agenerate_embedding(text))
+        self.task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self.finished_at = time.perf_counter()
+        if not task.cancelled():
+            task.exception()  # Un error sólo cuenta como miss
+
+    def matches(self, semantic_query: str) -> bool:
+        return (
+            overlap(self.tokens, content_tokens(semantic_query))
+            >= settings.speculative_embedding_min_overlap
+        )
+
+
+def start_speculation(user_message: str) -> Speculation | None:
+    """Empieza a calcular el embedding del mensaje en paralelo con el primer agent_node."""
+    if not settings.speculative_embedding_enabled:
+        _speculation.set(None)
+        return None
+    if len(content_tokens(user_message)) < 2:
+        _speculation.set(None)  # Saludos y mensajes cortos no terminan en búsqueda
+        return None
+
+    speculation = Speculation(user_message)
+    _speculation.set(speculation)
+    return speculation
+
+
+def speculative_source(semantic_query: str) -> str | None:
+    """
+    Texto del embedding especulativo que usaría aquery_embedding para esta
+    semantic_query (None si va a calcular el de la query). La búsqueda lo
+    agrega a su llave de cache: el resultado depende del embedding usado.
+    """
+    speculation = _speculation.get()
+    if speculation is None or speculation.used or not speculation.matches(semantic_query):
+        return None
+    return speculation.text
+
+
+async def aquery_embedding(semantic_query: str) -> list[float]:
+    """
+    Embedding para la búsqueda: reutiliza el especulativo si la semantic_query
+    es lo bastante parecida al mensaje del usuario; si no, lo calcula.
+    """
+    speculation = _speculation.get()
+    if speculation is None or speculation.used:
+        return await agenerate_embedding(semantic_query)
+
+    if not speculation.matches(semantic_query):
+        SPECULATION_RESULTS.inc(result="miss")
+        speculation.used = True
+        return await agenerate_embedding(semantic_query)
+
+    waited_from = time.perf_counter()
+    try:
+        embedding = await asyncio.shield(speculation.task)
+    except Exception:
+        SPECULATION_RESULTS.inc(result="miss")
+        speculation.used = True
+        return await agenerate_embedding(semantic_query)
+
+    # Ahorro: lo que tardó el embedding menos lo que hubo que esperarlo acá
+    waited = time.perf_counter() - waited_from
+    duration = (speculation.finished_at or time.perf_counter()) - speculation.started_at
+    SPECULATION_RESULTS.inc(result="hit")
+    SPECULATION_SAVED_SECONDS.inc(max(duration - waited, 0.0))
+    speculation.used = True
+    return embedding
+
+
+def finish_speculation(speculation: Speculation | None):
+    """Al terminar el turno: cancela la especulación si nadie la usó."""
+    if speculation is None:
+        return
+    if not speculation.used:
+        SPECULATION_RESULTS.inc(result="unused")
+        if not speculation.task.done():
+            speculation.task.cancel()
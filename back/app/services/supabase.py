@@ -1,7 +1,10 @@
-from supabase import create_client, Client
+import asyncio
+from supabase import create_client, acreate_client, Client, AsyncClient
 from app.config import settings
 
 _client: Client | None = None
+_async_client: AsyncClient | None = None
+_async_lock = asyncio.Lock()
 
 
 def get_client() -> Client:
@@ -10,3 +13,15 @@ def get_client() -> Client:
     if _client is None:
         _client = create_client(settings.supabase_url, settings.supabase_key)
     return _client
+
+
+async def get_async_client() -> AsyncClient:
+    """Obtiene o crea el cliente asíncrono de Supabase (singleton)."""
+    global _async_client
+    if _async_client is None:
+        async with _async_lock:
+            if _async_client is None:
+                _async_client = await acreate_client(
+                    settings.supabase_url, settings.supabase_key
+                )
+    return _async_client
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import time
+import unicodedata
+
+import numpy as np
+
+from app.config import settings
+from app.models.schemas import SearchFilters
+from app.services.geo_index import coordinates, haversine_km, radius_filter
+from app.services.supabase import get_async_client
+
+# Columnas que se traen de Supabase para construir el índice
+EXPERIENCE_COLUMNS = (
+    "id, narrative_text, destination_name, city, duration, lat, lon, vector_embedding"
+)
+ENHANCED_COLUMNS = (
+    "experience_id, one_line_summary, unique_selling_points, environment_type, "
+    "primary_experience_type, physical_intensity, family_friendly, includes_food, "
+    "includes_transport, estimated_duration_hours"
+)
+PAGE_SIZE = 1000  # Límite de filas por request de PostgREST
+
+
+def normalize_value(value) -> str:
+    """Normaliza texto para comparar filtros (minúsculas y sin acentos)."""
+    if value is None:
+        return ""
+    text = unicodedata.normalize("NFKD", str(value))
+    return "".join(c for c in text if not unicodedata.combining(c)).strip().lower()
+
+
+def parse_embedding(value) -> list[float] | None:
+    """pgvector llega como string '[0.1,0.2,...]' por PostgREST."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def join_catalog(experiences: list[dict], enhanced: list[dict]) -> list[dict]:
+    """Junta experiences con experiences_enhanced en filas con el formato de la RPC."""
+    enhanced_by_id = {str(row["experience_id"]): row for row in enhanced}
+
+    rows = []
+    for experience in experiences:
+        row = dict(experience)
+        if row.get("duration") is not None:
+            # La RPC devuelve duration como texto
+            row["duration"] = str(row["duration"])
+        extra = enhanced_by_id.get(str(experience["id"]), {})
+        row.update({k: v for k, v in extra.items() if k != "experience_id"})
+        rows.append(row)
+    return rows
+
+
+def to_tristate(values: list) -> np.ndarray:
+    """Booleanos con NULL: 1 = True, 0 = False, -1 = NULL."""
+    return np.array(
+        [-1 if v is None else int(bool(v)) for v in values], dtype=np.int8
+    )
+
+
+class VectorIndex:
+    """
+    Índice vectorial en memoria: matriz de embeddings normalizados más
+    columnas de metadata con máscaras booleanas precalculadas.
+    Hace top-k exacto filtrado con un solo producto matriz-vector.
+    """
+
+    def __init__(self, rows: list[dict], embeddings: np.ndarray):
+        self.rows = rows
+        self.built_at = time.time()
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = (embeddings / norms).astype(np.float32)
+
+        # Columnas categóricas -> {valor normalizado: máscara}
+        self.text_masks = {
+            column: self._build_masks([row.get(column) for row in rows])
+            for column in (
+                "destination_name",
+                "city",
+                "physical_intensity",
+                "environment_type",
+                "primary_experience_type",
+            )
+        }
+
+        # Columnas booleanas y numéricas
+        self.family_friendly = to_tristate([r.get("family_friendly") for r in rows])
+        self.includes_food = to_tristate([r.get("includes_food") for r in rows])
+        self.duration_hours = np.array(
+            [
+                np.nan if r.get("estimated_duration_hours") is None
+                else float(r["estimated_duration_hours"])
+                for r in rows
+            ],
+            dtype=np.float32,
+        )
+        self.lat, self.lon = coordinates(rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @staticmethod
+    def _build_masks(values: list) -> dict[str, np.ndarray]:
+        normalized = np.array([normalize_value(v) for v in values], dtype=object)
+        return {value: normalized == value for value in set(normalized) if value}
+
+    def _text_mask(self, column: str, value: str) -> np.ndarray:
+        """Máscara tipo ILIKE '%valor%': une las máscaras de los valores que contienen el filtro."""
+        wanted = normalize_value(value)
+        masks = self.text_masks[column]
+
+        if wanted in masks:
+            return masks[wanted]
+
+        mask = np.zeros(len(self.rows), dtype=bool)
+        for candidate, candidate_mask in masks.items():
+            if wanted in candidate:
+                mask |= candidate_mask
+        return mask
+
+    def build_mask(self, filters: SearchFilters) -> np.ndarray:
+        """Combina las máscaras de todos los filtros activos."""
+        mask = np.ones(len(self.rows), dtype=bool)
+
+        text_filters = {
+            "destination_name": filters.destination,
+            "city": filters.city,
+            "physical_intensity": filters.physical_intensity,
+            "environment_type": filters.environment_type,
+            "primary_experience_type": filters.experience_type,
+        }
+        for column, value in text_filters.items():
+            if value:
+                mask &= self._text_mask(column, value)
+
+        if filters.family_friendly is not None:
+            mask &= self.family_friendly == int(filters.family_friendly)
+
+        if filters.includes_food is not None:
+            mask &= self.includes_food == int(filters.includes_food)
+
+        if filters.max_duration_hours is not None:
+            # NaN <= x es False: igual que NULL en SQL
+            mask &= self.duration_hours <= filters.max_duration_hours
+
+        near = radius_filter(filters)
+        if near is not None:
+            lat, lon, radius_km = near
+            mask &= haversine_km(lat, lon, self.lat, self.lon) <= radius_km
+
+        return mask
+
+    def search(
+        self, query_embedding: list[float], filters: SearchFilters, limit: int
+    ) -> list[dict]:
+        """Top-k por similitud coseno. Devuelve filas con el mismo formato que la RPC."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = self.matrix @ query
+        mask = self.build_mask(filters)
+
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+
+        candidate_scores = scores[candidates]
+        k = min(limit, candidates.size)
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        top = top[np.argsort(-candidate_scores[top])]
+
+        return [
+            {**self.rows[candidates[i]], "similarity": float(candidate_scores[i])}
+            for i in top
+        ]
+
+    @classmethod
+    def build(cls, experiences: list[dict], enhanced: list[dict]) -> "VectorIndex":
+        """Construye el índice juntando experiences con experiences_enhanced."""
+        rows = []
+        vectors = []
+        for row in join_catalog(experiences, enhanced):
+            embedding = parse_embedding(row.pop("vector_embedding", None))
+            if not embedding:
+                continue
+            rows.append(row)
+            vectors.append(embedding)
+
+        embeddings = np.array(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        return cls(rows, embeddings)
+
+
+_index: VectorIndex | None = None
+
+
+def get_index() -> VectorIndex | None:
+    """Índice local actual (None si todavía no se cargó)."""
+    return _index
+
+
+async def fetch_table(table: str, columns: str) -> list[dict]:
+    """Trae una tabla completa paginando de PAGE_SIZE en PAGE_SIZE."""
+    supabase = await get_async_client()
+    rows = []
+    start = 0
+    while True:
+        result = (
+            await supabase.table(table)
+            .select(columns)
+            .range(start, start + PAGE_SIZE - 1)
+            .execute()
+        )
+        rows.extend(result.data)
+        if len(result.data) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+async def refresh_index() -> VectorIndex:
+    """Recarga el catálogo desde Supabase y reemplaza el índice de forma atómica."""
+    global _index
+
+    experiences, enhanced = await asyncio.gather(
+        fetch_table("experiences", EXPERIENCE_COLUMNS),
+        fetch_table("experiences_enhanced", ENHANCED_COLUMNS),
+    )
+
+    # Parsear embeddings y armar la matriz fuera del event loop
+    index = await asyncio.to_thread(VectorIndex.build, experiences, enhanced)
+    _index = index
+    print(f"📚 Índice local cargado: {len(index)} experiencias")
+    return index
+
+
+async def periodic_index_refresh():
+    """Refresca el índice local cada local_index_refresh_seconds."""
+    while True:
+        try:
+            await refresh_index()
+        except Exception as e:
+            print(f"⚠️  Error refrescando el índice local: {e}")
+        await asyncio.sleep(settings.local_index_refresh_seconds)
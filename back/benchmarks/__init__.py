@@ -0,0 +1 @@
+"""Benchmarks del backend con servicios externos simulados (ver benchmarks/fakes.py)."""
@@ -0,0 +1,90 @@
+"""
+Micro-benchmark del costo por turno de leer y guardar el estado de una sesión.
+
+Compara el enfoque anterior (deepcopy de todo el AgentState en get/update)
+con los stores append-only, para historiales de hasta cientos de mensajes:
+    uv run python -m benchmarks.bench_sessions
+"""
+
+import asyncio
+import copy
+import json
+import os
+import tempfile
+import time
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage  # noqa: E402
+
+from app.services.sessions import InMemorySessionStore, SQLiteSessionStore  # noqa: E402
+
+HISTORY_SIZES = [12, 48, 96, 192, 384, 768]
+TURNS = 20
+# Resultado de herramienta parecido a get_experience_details con full_json
+TOOL_PAYLOAD = json.dumps({"full_json": {"rates": ["x" * 200] * 100}})
+
+
+def make_turn(i: int) -> list:
+    """Un turno típico: usuario, llamada a herramienta, resultado y respuesta."""
+    call_id = f"call-{i}"
+    return [
+        HumanMessage(content=f"cuéntame del número {i}"),
+        AIMessage(
+            content="",
+            tool_calls=[{"name": "get_experience_details", "args": {}, "id": call_id}],
+        ),
+        ToolMessage(content=TOOL_PAYLOAD, tool_call_id=call_id),
+        AIMessage(content="Claro, esta experiencia incluye... " * 10),
+    ]
+
+
+class DeepcopyStore:
+    """Reproduce el ConnectionManager anterior: deepcopy del estado completo."""
+
+    def __init__(self):
+        self.sessions = {}
+
+    async def load(self, session_id):
+        state = self.sessions.get(session_id, {"messages": [], "last_search_results": []})
+        return copy.deepcopy(state)
+
+    async def append(self, session_id, messages, fields):
+        state = self.sessions.get(session_id, {"messages": [], "last_search_results": []})
+        self.sessions[session_id] = copy.deepcopy(
+            {**state, **fields, "messages": state["messages"] + list(messages)}
+        )
+
+
+async def per_turn_ms(store, history_size: int) -> float:
+    session_id = f"bench-{history_size}"
+    for i in range(history_size // 4):
+        await store.append(session_id, make_turn(i), {"last_search_results": []})
+    await store.load(session_id)
+
+    started = time.perf_counter()
+    for i in range(TURNS):
+        state = await store.load(session_id)
+        assert len(state["messages"]) >= history_size
+        await store.append(session_id, make_turn(i), {"last_search_results": []})
+    return (time.perf_counter() - started) / TURNS * 1000
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            "deepcopy (anterior)": DeepcopyStore(),
+            "memory append-only": InMemorySessionStore(),
+            "sqlite append-only": SQLiteSessionStore(os.path.join(tmp, "bench.db")),
+        }
+
+        print(f"{'mensajes':>10} " + " ".join(f"{name:>22}" for name in stores))
+        for size in HISTORY_SIZES:
+            row = [await per_turn_ms(store, size) for store in stores.values()]
+            print(f"{size:>10} " + " ".join(f"{ms:>19.3f} ms" for ms in row))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+"""
+Micro-benchmark del costo de mandar un turno en streaming por el WebSocket.
+
+Compara el envío anterior (un send_json y un print por cada token, más el
+mensaje completo al final) con OutboundChannel, que agrupa los tokens en frames,
+y el tamaño del evento "experiences" en JSON y MessagePack (con y sin deflate):
+    uv run python -m benchmarks.bench_streaming
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import time
+import zlib
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+
+from app.api.outbound import OutboundChannel  # noqa: E402
+from app.api.protocol import JSON_CODEC, MSGPACK_CODEC  # noqa: E402
+
+TURN_TOKENS = [100, 400, 1600]
+TOKEN_DELAY = 0  # Sin pausa entre tokens: mide sólo el costo de envío
+TURNS = 5
+
+
+class FakeWebSocket:
+    """Serializa como Starlette (json.dumps) y cede el loop en cada frame."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def send_json(self, data: dict):
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, data: str):
+        self.frames += 1
+        self.bytes += len(data)
+        await asyncio.sleep(0)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def naive_turn(websocket: FakeWebSocket, tokens: int):
+    """Reproduce handle_chat_message anterior: print por evento y un frame por token."""
+    parts = []
+    for i in range(tokens):
+        await asyncio.sleep(TOKEN_DELAY)
+        print(f"📥 Event: on_chat_model_stream, Name: ChatAnthropic")
+        await websocket.send_json({"type": "token", "content": f"tok{i} "})
+        parts.append(f"tok{i} ")
+    await websocket.send_json({"type": "message", "content": "".join(parts)})
+    await websocket.send_json({"type": "done"})
+
+
+async def channel_turn(websocket: FakeWebSocket, tokens: int):
+    channel = OutboundChannel(websocket)
+    parts = []
+    for i in range(tokens):
+        await asyncio.sleep(TOKEN_DELAY)
+        channel.send_token(f"tok{i} ")
+        parts.append(f"tok{i} ")
+    await channel.send({"type": "message", "content": "".join(parts)})
+    await channel.send({"type": "done"})
+    await channel.close()
+
+
+async def measure(turn, tokens: int) -> dict:
+    websocket = FakeWebSocket()
+    # Los print van a un buffer para medir su CPU sin ensuciar la salida
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        for _ in range(TURNS):
+            await turn(websocket, tokens)
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+    return {
+        "frames": websocket.frames / TURNS,
+        "events_s": tokens * TURNS / wall,
+        "cpu_ms": cpu / TURNS * 1000,
+    }
+
+
+def experiences_event(count: int = 10) -> dict:
+    """Evento experiences típico: resúmenes y highlights completos para el mapa."""
+    return {
+        "type": "experiences",
+        "data": [
+            {
+                "id": f"5f0c8a4e-0000-4000-8000-{i:012d}",
+                "name": f"Nado en cenotes sagrados de Yucatán {i}",
+                "summary": "Recorrido por tres cenotes con guía local, " * 6,
+                "lat": 20.6843 + i / 1000,
+                "lon": -88.5678 - i / 1000,
+                "duration": "4",
+                "location": "Valladolid, Yucatán",
+                "destination": "Yucatán",
+                "highlights": [f"Highlight número {j} de la experiencia" for j in range(5)],
+                "type": "Naturaleza",
+                "intensity": "Moderada",
+                "family_friendly": True,
+                "includes_food": False,
+                "includes_transport": True,
+                "similarity": 0.8123456789,
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def deflate_size(payload: str | bytes) -> int:
+    """Tamaño aproximado con permessage-deflate (deflate crudo, sin contexto previo)."""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    compressor = zlib.compressobj(wbits=-15)
+    return len(compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def payload_sizes():
+    event = experiences_event()
+    baseline = json.dumps(event)  # Lo que mandaba send_json de Starlette
+    payloads = {
+        "json (anterior)": baseline,
+        "json orjson": JSON_CODEC.encode(event),
+        "msgpack": MSGPACK_CODEC.encode(event),
+    }
+    print(f"\n{'experiences (10)':>16} {'bytes':>8} {'deflate':>8}")
+    for name, payload in payloads.items():
+        size = len(payload.encode()) if isinstance(payload, str) else len(payload)
+        print(f"{name:>16} {size:>8} {deflate_size(payload):>8}")
+
+
+async def main():
+    variants = {"anterior": naive_turn, "OutboundChannel": channel_turn}
+    print(f"{'tokens':>7} {'variante':>16} {'frames/turno':>13} {'tokens/s':>10} {'CPU/turno':>12}")
+    for tokens in TURN_TOKENS:
+        for name, turn in variants.items():
+            result = await measure(turn, tokens)
+            print(
+                f"{tokens:>7} {name:>16} {result['frames']:>13.0f} "
+                f"{result['events_s']:>10.0f} {result['cpu_ms']:>9.2f} ms"
+            )
+    payload_sizes()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
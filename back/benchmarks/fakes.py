@@ -0,0 +1,436 @@
+"""
+Dobles locales de los servicios externos para correr el backend sin red:
+- ScriptedChatModel: busca, pide detalles o responde en streaming según el mensaje
+- FakeOpenAI / FakeAsyncOpenAI: embeddings deterministas (hashing de palabras)
+- FakeSupabase: tablas en memoria con select/eq/in_/range y la RPC
+  search_experiences_hybrid (implementada con el VectorIndex local)
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.models.schemas import SearchFilters
+from app.services.vector_index import VectorIndex
+
+EMBEDDING_DIMS = 64
+
+SEARCH_WORDS = ("busca", "buscar", "muéstrame", "search", "find", "show me")
+DETAIL_WORDS = ("detalle", "detalles", "más sobre", "details", "more about", "precio")
+
+DESTINATIONS = {
+    "Quintana Roo": ["Tulum", "Playa del Carmen", "Cancún", "Bacalar"],
+    "Yucatan": ["Mérida", "Valladolid", "Izamal"],
+    "Chiapas": ["San Cristóbal", "Palenque"],
+    "Oaxaca": ["Oaxaca", "Puerto Escondido"],
+}
+ENVIRONMENTS = ["cenote", "jungle", "beach", "city", "lake"]
+EXPERIENCE_TYPES = ["culture", "nature", "adventure", "wellness", "gastronomy"]
+INTENSITIES = ["low", "moderate", "high"]
+
+
+# ---------------------------------------------------------------------------
+# Embeddings
+# ---------------------------------------------------------------------------
+
+
+def deterministic_embedding(text: str, dims: int = EMBEDDING_DIMS) -> list[float]:
+    """Bolsa de palabras con hashing: textos con palabras en común quedan cerca."""
+    vector = np.zeros(dims, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dims
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector.tolist()
+
+
+class FakeEmbeddingsAPI:
+    def __init__(self, delay: float = 0.0, is_async: bool = True):
+        self.delay = delay
+        self.is_async = is_async
+        self.calls = 0
+
+    def _response(self, input):
+        self.calls += 1
+        texts = [input] if isinstance(input, str) else input
+        return SimpleNamespace(
+            data=[
+                SimpleNamespace(index=i, embedding=deterministic_embedding(text))
+                for i, text in enumerate(texts)
+            ],
+            usage=SimpleNamespace(total_tokens=sum(len(t.split()) for t in texts)),
+        )
+
+    def create(self, model, input, **kwargs):
+        if not self.is_async:
+            time.sleep(self.delay)
+            return self._response(input)
+
+        async def create_async():
+            await asyncio.sleep(self.delay)
+            return self._response(input)
+
+        return create_async()
+
+
+def fake_openai(delay: float = 0.0, is_async: bool = True) -> SimpleNamespace:
+    """Cliente con la misma forma que OpenAI/AsyncOpenAI para client.embeddings.create."""
+    return SimpleNamespace(embeddings=FakeEmbeddingsAPI(delay, is_async))
+
+
+# ---------------------------------------------------------------------------
+# Supabase
+# ---------------------------------------------------------------------------
+
+
+def split_columns(columns: str) -> list[str]:
+    """Separa un select de PostgREST respetando paréntesis de joins embebidos."""
+    parts, depth, current = [], 0, ""
+    for char in columns:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+class FakeQuery:
+    """Builder de consultas de PostgREST sobre listas de dicts."""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.columns: list[str] = ["*"]
+        self.filters: list = []
+        self.bounds: tuple[int, int] | None = None
+
+    def select(self, columns: str = "*"):
+        self.columns = split_columns(columns)
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column: str, values: list):
+        allowed = {str(v) for v in values}
+        self.filters.append(lambda row: str(row.get(column)) in allowed)
+        return self
+
+    def range(self, start: int, end: int):
+        self.bounds = (start, end)
+        return self
+
+    def limit(self, count: int):
+        self.bounds = (0, count - 1)
+        return self
+
+    def _project(self, row: dict) -> dict:
+        if self.columns == ["*"]:
+            return dict(row)
+        projected = {}
+        for column in self.columns:
+            match = re.match(r"(\w+)\((.*)\)$", column, re.S)
+            if match:
+                # Join embebido: filas de la otra tabla que apuntan a esta
+                table, inner = match.group(1), split_columns(match.group(2))
+                projected[table] = [
+                    {key: related.get(key) for key in inner}
+                    for related in self.db.related(table, row["id"])
+                ]
+                continue
+            # alias:columna->llave (extracción de JSON en el servidor)
+            match = re.match(r"(?:(\w+):)?(\w+)(?:->(\w+))?$", column)
+            alias, name, key = match.groups()
+            value = row.get(name)
+            if key:
+                value = value.get(key) if isinstance(value, dict) else None
+            projected[alias or key or name] = value
+        return projected
+
+    def _run(self):
+        rows = [row for row in self.db.tables.get(self.table, []) if all(f(row) for f in self.filters)]
+        if self.bounds:
+            rows = rows[self.bounds[0] : self.bounds[1] + 1]
+        return SimpleNamespace(data=[self._project(row) for row in rows])
+
+    def execute(self):
+        return self.db.respond(self._run, self.db.query_delay)
+
+
+class FakeRPC:
+    def __init__(self, db: "FakeSupabase", name: str, params: dict):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def _run(self):
+        if self.name != "search_experiences_hybrid":
+            raise ValueError(f"RPC no soportada: {self.name}")
+        params = self.params
+        filters = SearchFilters(
+            semantic_query="",
+            destination=params.get("filter_destination"),
+            city=params.get("filter_city"),
+            family_friendly=params.get("filter_family_friendly"),
+            physical_intensity=params.get("filter_intensity"),
+            max_duration_hours=params.get("filter_max_duration"),
+            environment_type=params.get("filter_environment"),
+            includes_food=params.get("filter_includes_food"),
+            experience_type=params.get("filter_experience_type"),
+        )
+        rows = self.db.index.search(
+            params["query_embedding"], filters, params.get("match_count", 10)
+        )
+        return SimpleNamespace(data=rows)
+
+    def execute(self):
+        return self.db.respond(self._run, self.db.rpc_delay)
+
+
+class FakeSupabase:
+    """
+    Cliente de Supabase en memoria (sync o async según is_async).
+    Las demoras simulan la latencia de red de PostgREST.
+    """
+
+    def __init__(
+        self,
+        experiences: list[dict],
+        enhanced: list[dict],
+        rpc_delay: float = 0.0,
+        query_delay: float = 0.0,
+        is_async: bool = True,
+    ):
+        self.tables = {"experiences": experiences, "experiences_enhanced": enhanced}
+        self.index = VectorIndex.build(experiences, enhanced)
+        self.rpc_delay = rpc_delay
+        self.query_delay = query_delay
+        self.is_async = is_async
+        self.calls = 0
+        self._enhanced_by_id: dict[str, list[dict]] = {}
+        for row in enhanced:
+            self._enhanced_by_id.setdefault(str(row["experience_id"]), []).append(row)
+
+    def related(self, table: str, experience_id) -> list[dict]:
+        if table != "experiences_enhanced":
+            return []
+        return self._enhanced_by_id.get(str(experience_id), [])
+
+    def respond(self, run, delay: float):
+        self.calls += 1
+        if not self.is_async:
+            time.sleep(delay)
+            return run()
+
+        async def execute_async():
+            await asyncio.sleep(delay)
+            return run()
+
+        return execute_async()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict) -> FakeRPC:
+        return FakeRPC(self, name, params)
+
+
+def make_catalog(size: int = 300, seed: int = 7) -> tuple[list[dict], list[dict]]:
+    """Catálogo sintético con la forma de las tablas experiences y experiences_enhanced."""
+    rng = random.Random(seed)
+    experiences, enhanced = [], []
+    for i in range(size):
+        destination = rng.choice(list(DESTINATIONS))
+        city = rng.choice(DESTINATIONS[destination])
+        environment = rng.choice(ENVIRONMENTS)
+        experience_type = rng.choice(EXPERIENCE_TYPES)
+        title = f"{experience_type.title()} {environment} experience in {city} #{i}"
+        tags = [environment, experience_type, city.lower(), destination.lower()]
+        experience_id = f"00000000-0000-4000-8000-{i:012d}"
+        duration = rng.choice([2, 3, 4, 6, 8])
+
+        experiences.append(
+            {
+                "id": experience_id,
+                "narrative_text": f"General Description: Title: {title}\n" + "Lorem ipsum. " * 40,
+                "supplier_name": f"Proveedor {i % 25}",
+                "city": city,
+                "destination_name": destination,
+                "duration": duration,
+                "lat": 17 + rng.random() * 4,
+                "lon": -92 + rng.random() * 5,
+                "full_json": {"rates": [{"pax": n, "price": 50 * n} for n in range(1, 6)]},
+                "vector_embedding": json.dumps(deterministic_embedding(" ".join([title] + tags))),
+            }
+        )
+        enhanced.append(
+            {
+                "experience_id": experience_id,
+                "one_line_summary": title,
+                "unique_selling_points": [f"Punto fuerte {j} de {title}" for j in range(3)],
+                "environment_type": environment,
+                "primary_experience_type": experience_type,
+                "physical_intensity": rng.choice(INTENSITIES),
+                "family_friendly": rng.random() < 0.6,
+                "includes_food": rng.random() < 0.4,
+                "includes_transport": rng.random() < 0.5,
+                "estimated_duration_hours": duration,
+                "semantic_tags": tags,
+            }
+        )
+    return experiences, enhanced
+
+
+# ---------------------------------------------------------------------------
+# Modelo
+# ---------------------------------------------------------------------------
+
+
+def last_search_ids(messages: list) -> list[str]:
+    """IDs del último resultado de búsqueda visible para el modelo."""
+    for message in reversed(messages):
+        if message.type == "tool" and message.name == "search_rutopia_experiences":
+            try:
+                return [item["id"] for item in json.loads(message.content)]
+            except (json.JSONDecodeError, TypeError, KeyError):
+                return re.findall(r"[0-9a-f-]{36}", str(message.content))
+    return []
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Modelo de chat guionado:
+    - mensaje con SEARCH_WORDS -> llama a search_rutopia_experiences
+    - mensaje con DETAIL_WORDS -> llama a get_experience_details con el primer resultado
+    - resultado de herramienta o charla -> responde answer_tokens palabras en streaming
+    """
+
+    first_token_delay: float = 0.05
+    token_delay: float = 0.01
+    answer_tokens: int = 30
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages) -> AIMessage:
+        last = messages[-1]
+        call_id = f"call-{time.monotonic_ns()}"
+        if last.type == "human":
+            text = last.content.lower() if isinstance(last.content, str) else ""
+            if any(word in text for word in SEARCH_WORDS):
+                return AIMessage(
+                    content="",
+                    tool_calls=[
+                        {
+                            "name": "search_rutopia_experiences",
+                            "args": {"semantic_query": last.content},
+                            "id": call_id,
+                        }
+                    ],
+                )
+            ids = last_search_ids(messages)
+            if ids and any(word in text for word in DETAIL_WORDS):
+                return AIMessage(
+                    content="",
+                    tool_calls=[
+                        {
+                            "name": "get_experience_details",
+                            "args": {"experience_id": ids[0]},
+                            "id": call_id,
+                        }
+                    ],
+                )
+        words = [f"palabra{i}" for i in range(self.answer_tokens)]
+        return AIMessage(content=" ".join(words))
+
+    def _usage(self, messages, output_tokens: int) -> dict:
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        await asyncio.sleep(self.first_token_delay)
+
+        if reply.tool_calls:
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": call["name"],
+                            "args": json.dumps(call["args"]),
+                            "id": call["id"],
+                            "index": 0,
+                        }
+                        for call in reply.tool_calls
+                    ],
+                    usage_metadata=self._usage(messages, 20),
+                )
+            )
+            return
+
+        words = reply.content.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(content=word if i == 0 else " " + word)
+            )
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(content="", usage_metadata=self._usage(messages, len(words)))
+        )
+
+
+def install_fakes(
+    model: BaseChatModel | None = None,
+    catalog_size: int = 300,
+    rpc_delay: float = 0.0,
+    query_delay: float = 0.0,
+    embedding_delay: float = 0.0,
+) -> FakeSupabase:
+    """Reemplaza los singletons del backend por los dobles locales."""
+    import app.agent.graph as graph
+    import app.services.embeddings as embeddings
+    import app.services.supabase as supabase_service
+
+    experiences, enhanced = make_catalog(catalog_size)
+    async_db = FakeSupabase(experiences, enhanced, rpc_delay, query_delay)
+    sync_db = FakeSupabase(experiences, enhanced, rpc_delay, query_delay, is_async=False)
+
+    graph.model = model or ScriptedChatModel()
+    supabase_service._async_client = async_db
+    supabase_service._client = sync_db
+    embeddings._async_client = fake_openai(embedding_delay)
+    embeddings._client = fake_openai(embedding_delay, is_async=False)
+    return async_db
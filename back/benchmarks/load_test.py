@@ -0,0 +1,179 @@
+"""
+Benchmark de carga end-to-end sin red: levanta la app de FastAPI con uvicorn en
+el mismo proceso, reemplaza modelo, OpenAI y Supabase por los dobles de
+benchmarks/fakes.py y conduce N sesiones WebSocket concurrentes.
+
+Reporta turnos/s, p50/p95/p99 del tiempo al primer token y al done, y memoria
+por sesión (delta de RSS):
+    uv run python -m benchmarks.load_test --sessions 100 --turns 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import uvicorn  # noqa: E402
+import websockets  # noqa: E402
+
+from app.main import app  # noqa: E402
+from benchmarks.fakes import ScriptedChatModel, install_fakes  # noqa: E402
+
+# Guion de cada sesión (se repite si hay más turnos)
+CONVERSATION = [
+    "Hola, estoy planeando un viaje a Yucatán con mi familia",
+    "busca cenotes en Tulum para familia",
+    "dame más detalles del primero",
+    "¿qué otras cosas me recomiendas para ese día?",
+    "busca experiencias de gastronomía en Mérida",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes() -> int:
+    """RSS actual del proceso (Linux); 0 si no está disponible."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Percentil por rango más cercano."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_session(url: str, turns: int, results: dict):
+    """Una sesión: manda los turnos del guion y mide primer token y done."""
+    async with websockets.connect(url, max_size=None) as ws:
+        for turn in range(turns):
+            message = CONVERSATION[turn % len(CONVERSATION)]
+            started = time.perf_counter()
+            first_token = None
+            await ws.send(json.dumps({"content": message}))
+
+            while True:
+                event = json.loads(await ws.recv())
+                if event["type"] == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event["type"] == "queued":
+                    results["queued"] += 1
+                elif event["type"] == "error":
+                    results["errors"] += 1
+                    break
+                elif event["type"] == "done":
+                    results["done"].append(time.perf_counter() - started)
+                    if first_token is not None:
+                        results["ttft"].append(first_token)
+                    break
+
+
+async def run(args) -> dict:
+    install_fakes(
+        model=ScriptedChatModel(
+            first_token_delay=args.first_token_delay,
+            token_delay=args.token_delay,
+            answer_tokens=args.answer_tokens,
+        ),
+        catalog_size=args.catalog,
+        rpc_delay=args.rpc_delay,
+        query_delay=args.query_delay,
+        embedding_delay=args.embedding_delay,
+    )
+
+    port = free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    results = {"ttft": [], "done": [], "errors": 0, "queued": 0}
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+
+    await asyncio.gather(
+        *(
+            run_session(f"ws://127.0.0.1:{port}/ws/chat/bench-{i}", args.turns, results)
+            for i in range(args.sessions)
+        )
+    )
+
+    elapsed = time.perf_counter() - started
+    rss_after = rss_bytes()
+
+    server.should_exit = True
+    await serve_task
+
+    return {
+        "sessions": args.sessions,
+        "turns": len(results["done"]),
+        "errors": results["errors"],
+        "queued_events": results["queued"],
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(len(results["done"]) / elapsed, 2),
+        "ttft_ms": {
+            f"p{p}": round(percentile(results["ttft"], p) * 1000, 1) for p in (50, 95, 99)
+        },
+        "done_ms": {
+            f"p{p}": round(percentile(results["done"], p) * 1000, 1) for p in (50, 95, 99)
+        },
+        "memory_per_session_kb": round((rss_after - rss_before) / args.sessions / 1024, 1),
+    }
+
+
+def print_report(report: dict):
+    print(
+        f"Sesiones: {report['sessions']}  Turnos: {report['turns']}  "
+        f"Errores: {report['errors']}  Eventos queued: {report['queued_events']}"
+    )
+    print(f"Duración: {report['elapsed_s']} s  ->  {report['turns_per_s']} turnos/s")
+    for name, label in (("ttft_ms", "Primer token"), ("done_ms", "Done")):
+        values = report[name]
+        print(
+            f"{label:>13}: p50 {values['p50']:>8.1f} ms  "
+            f"p95 {values['p95']:>8.1f} ms  p99 {values['p99']:>8.1f} ms"
+        )
+    print(f"Memoria por sesión: {report['memory_per_session_kb']} KB (delta de RSS)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--catalog", type=int, default=300, help="Experiencias en el catálogo falso")
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--answer-tokens", type=int, default=30)
+    parser.add_argument("--rpc-delay", type=float, default=0.05)
+    parser.add_argument("--query-delay", type=float, default=0.02)
+    parser.add_argument("--embedding-delay", type=float, default=0.03)
+    parser.add_argument("--json", help="Guardar el reporte en este archivo (para comparar corridas)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,176 @@
+"""
+Verifica el control de admisión: FairLimiter reparte los cupos round-robin
+entre sesiones, rechaza con la cola llena y limpia los pedidos cancelados; un
+rechazo dentro de una herramienta llega al modelo como error de la
+herramienta (el turno sigue).
+    uv run python test_admission.py
+"""
+
+import asyncio
+import json
+import os
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+from langchain_core.language_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult  # noqa: E402
+
+import app.agent.graph as graph  # noqa: E402
+import app.agent.tools as tools  # noqa: E402
+from app.services.admission import AdmissionRejected, FairLimiter, bind_session  # noqa: E402
+
+
+class SearchOnceModel(BaseChatModel):
+    """Busca en la primera llamada; después responde con el resultado de la herramienta."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _reply(self, messages) -> AIMessage:
+        last = messages[-1]
+        if last.type == "tool":
+            return AIMessage(content=f"[{last.status}] {last.content}")
+        return AIMessage(
+            content="",
+            tool_calls=[
+                {
+                    "name": "search_rutopia_experiences",
+                    "args": {"semantic_query": "cenotes en Tulum"},
+                    "id": "call-1",
+                }
+            ],
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(
+                content=reply.content,
+                tool_call_chunks=[
+                    {
+                        "name": call["name"],
+                        "args": json.dumps(call["args"]),
+                        "id": call["id"],
+                        "index": 0,
+                    }
+                    for call in reply.tool_calls
+                ],
+            )
+        )
+
+
+async def queue(limiter: FairLimiter, session_id: str, granted: list, positions: list | None = None):
+    """Pide un cupo como una tarea de la sesión y anota cuándo lo obtiene."""
+
+    async def notify(stage: str, position: int):
+        positions.append((session_id, position))
+
+    async def wait():
+        bind_session(session_id, notify if positions is not None else None)
+        await limiter.acquire()
+        granted.append(session_id)
+
+    task = asyncio.create_task(wait())
+    await asyncio.sleep(0)  # Entra a la cola antes de seguir
+    return task
+
+
+def test_slots_rotate_between_sessions():
+    async def check():
+        limiter = FairLimiter("test", limit=1, max_queue=10)
+        await limiter.acquire()  # Ocupa el único cupo
+
+        granted, positions = [], []
+        for session_id in ("a", "a", "a", "b", "c"):
+            await queue(limiter, session_id, granted, positions)
+        assert limiter.stats()["waiting"] == 5
+        # "b" y "c" se adelantan a los pedidos de "a" que llegaron antes
+        assert positions[-2:] == [("b", 2), ("c", 3)]
+
+        for _ in range(5):
+            limiter.release()
+            await asyncio.sleep(0)
+        assert granted == ["a", "b", "c", "a", "a"]
+        assert limiter.stats() == {"limit": 1, "active": 1, "waiting": 0, "sessions_waiting": 0}
+
+    asyncio.run(check())
+
+
+def test_full_queue_rejects():
+    async def check():
+        limiter = FairLimiter("test", limit=1, max_queue=2)
+        await limiter.acquire()
+        granted = []
+        for session_id in ("a", "b"):
+            await queue(limiter, session_id, granted)
+
+        try:
+            await limiter.acquire()
+        except AdmissionRejected:
+            pass
+        else:
+            raise AssertionError("con la cola llena debió rechazar")
+        assert limiter.stats()["waiting"] == 2
+
+    asyncio.run(check())
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def check():
+        limiter = FairLimiter("test", limit=1, max_queue=10)
+        await limiter.acquire()
+        granted = []
+        first = await queue(limiter, "a", granted)
+        second = await queue(limiter, "b", granted)
+
+        # Cancelado mientras espera: sale de la cola sin tomar cupo
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert limiter.stats()["waiting"] == 1 and limiter.stats()["sessions_waiting"] == 1
+
+        # Cancelado con el cupo ya asignado: lo devuelve
+        limiter.release()
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        assert granted == []
+        assert limiter.stats() == {"limit": 1, "active": 0, "waiting": 0, "sessions_waiting": 0}
+
+        # El limitador sigue funcionando
+        await asyncio.wait_for(limiter.acquire(), timeout=1)
+
+    asyncio.run(check())
+
+
+def test_rejected_tool_call_reaches_the_model():
+    async def rejected(*args, **kwargs):
+        raise AdmissionRejected("Cola de embedding llena")
+
+    originals = (graph.model, tools.asearch_experiences_page)
+    graph.model, tools.asearch_experiences_page = SearchOnceModel(), rejected
+    try:
+        state = asyncio.run(
+            graph.agent.ainvoke({"messages": [HumanMessage(content="busca cenotes")]})
+        )
+    finally:
+        graph.model, tools.asearch_experiences_page = originals
+
+    tool_message, answer = state["messages"][-2:]
+    assert tool_message.type == "tool" and tool_message.status == "error"
+    assert "saturado" in tool_message.content
+    # El modelo recibió el error y el turno terminó con su respuesta
+    assert answer.content.startswith("[error] Servicio saturado")
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
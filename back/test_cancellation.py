@@ -0,0 +1,145 @@
+"""
+Verifica la cancelación de turnos: cancelar durante una herramienta o en medio
+del streaming guarda un historial válido para el modelo (cada tool_call con su
+ToolMessage, el texto ya enviado como respuesta parcial) y la sesión sigue.
+    uv run python test_cancellation.py
+"""
+
+import asyncio
+import json
+import os
+import time
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from app.api.outbound import OutboundChannel  # noqa: E402
+from app.api.websocket import cancel_turn, manager, partial_turn, start_turn  # noqa: E402
+from benchmarks.fakes import ScriptedChatModel, install_fakes  # noqa: E402
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.events: list[dict] = []
+
+    async def send_text(self, data: str):
+        self.events.append(json.loads(data))
+
+    async def close(self, code: int = 1000):
+        pass
+
+    def types(self) -> list[str]:
+        return [event["type"] for event in self.events]
+
+
+def assert_valid_history(messages: list):
+    """Cada tool_call tiene su ToolMessage justo después y no hay ToolMessages sueltos."""
+    pending: list[str] = []
+    for message in messages:
+        if message.type == "tool":
+            assert message.tool_call_id in pending, f"ToolMessage suelto: {message}"
+            pending.remove(message.tool_call_id)
+            continue
+        assert not pending, f"tool_calls sin respuesta: {pending}"
+        if message.type == "ai":
+            pending = [call["id"] for call in message.tool_calls]
+    assert not pending, f"tool_calls sin respuesta: {pending}"
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timeout esperando el evento"
+        await asyncio.sleep(0.01)
+
+
+async def cancel_when(session_id: str, message: str, condition) -> FakeWebSocket:
+    """Corre un turno y lo cancela cuando los eventos enviados cumplen condition."""
+    websocket = FakeWebSocket()
+    channel = OutboundChannel(websocket)
+    task = start_turn(channel, session_id, message)
+    await wait_for(lambda: condition(websocket))
+    await cancel_turn(task)
+    await channel.flush()
+    return websocket
+
+
+async def run_turn(session_id: str, message: str) -> FakeWebSocket:
+    websocket = FakeWebSocket()
+    channel = OutboundChannel(websocket)
+    await start_turn(channel, session_id, message)
+    await channel.flush()
+    return websocket
+
+
+def test_partial_turn_answers_pending_tool_calls():
+    call = {"name": "search_rutopia_experiences", "args": {"semantic_query": "x"}, "id": "c1"}
+    input_state = {"messages": [HumanMessage(content="busca cenotes")]}
+    node_updates = [{"messages": [AIMessage(content="", tool_calls=[call])]}]
+
+    messages, _ = partial_turn(input_state, node_updates, [])
+
+    assert_valid_history(messages)
+    assert messages[-1].type == "tool" and messages[-1].status == "error"
+
+
+def test_partial_turn_keeps_streamed_text():
+    input_state = {"messages": [HumanMessage(content="hola")], "last_search_version": 3}
+    messages, fields = partial_turn(input_state, [], ["Hola, ", "te cuento"])
+
+    assert_valid_history(messages)
+    assert messages[-1].type == "ai" and messages[-1].content == "Hola, te cuento"
+    assert fields["last_search_version"] == 3
+
+
+def test_cancel_during_a_tool():
+    async def check():
+        install_fakes(rpc_delay=1.0)
+        websocket = await cancel_when(
+            "cancel-tool", "busca cenotes en Tulum", lambda ws: "tool_start" in ws.types()
+        )
+        assert "cancelled" in websocket.types() and "done" not in websocket.types()
+
+        messages = (await manager.get_state("cancel-tool"))["messages"]
+        assert_valid_history(messages)
+        assert [m.type for m in messages] == ["human", "ai", "tool"]
+        assert messages[-1].status == "error"
+
+        # La sesión sigue: el próximo turno parte de ese historial
+        websocket = await run_turn("cancel-tool", "gracias")
+        assert websocket.types()[-1] == "done"
+        messages = (await manager.get_state("cancel-tool"))["messages"]
+        assert_valid_history(messages)
+        assert [m.type for m in messages[3:]] == ["human", "ai"]
+
+    asyncio.run(check())
+
+
+def test_cancel_during_streaming():
+    async def check():
+        install_fakes(model=ScriptedChatModel(token_delay=0.05, answer_tokens=60))
+        websocket = await cancel_when(
+            "cancel-stream", "cuéntame de Yucatán", lambda ws: "token" in ws.types()
+        )
+        assert "cancelled" in websocket.types() and "done" not in websocket.types()
+        sent = "".join(e["content"] for e in websocket.events if e["type"] == "token")
+
+        messages = (await manager.get_state("cancel-stream"))["messages"]
+        assert_valid_history(messages)
+        assert [m.type for m in messages] == ["human", "ai"]
+        # Se guarda el texto que el cliente ya vio (y quizá algún token más)
+        partial = messages[-1].content
+        assert partial.startswith(sent) and len(partial.split()) < 60
+
+    asyncio.run(check())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,165 @@
+"""
+Verifica que una búsqueda lenta en Supabase no detiene el streaming de otras sesiones.
+
+Usa backends falsos (modelo, OpenAI y Supabase) para no depender de la red:
+    uv run python test_concurrency.py
+"""
+
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+from langchain_core.language_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage, AIMessageChunk  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult  # noqa: E402
+
+import app.agent.graph as graph  # noqa: E402
+import app.services.embeddings as embeddings  # noqa: E402
+import app.services.supabase as supabase_service  # noqa: E402
+from app.api.outbound import OutboundChannel  # noqa: E402
+from app.api.websocket import handle_chat_message  # noqa: E402
+
+RPC_DELAY = 1.0  # Segundos que tarda la RPC falsa
+TOKEN_DELAY = 0.02  # Segundos entre tokens del modelo falso
+TOKENS = 40
+
+
+class FakeChatModel(BaseChatModel):
+    """Modelo que busca si el usuario dice 'busca' y si no responde en streaming."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _reply(self, messages) -> AIMessage:
+        last = messages[-1]
+        if last.type == "human" and "busca" in last.content:
+            return AIMessage(
+                content="",
+                tool_calls=[
+                    {
+                        "name": "search_rutopia_experiences",
+                        "args": {"semantic_query": last.content},
+                        "id": f"call-{time.monotonic_ns()}",
+                    }
+                ],
+            )
+        return AIMessage(content=" ".join(["token"] * TOKENS))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        if reply.tool_calls:
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": call["name"],
+                            "args": '{"semantic_query": "%s"}'
+                            % call["args"]["semantic_query"],
+                            "id": call["id"],
+                            "index": 0,
+                        }
+                        for call in reply.tool_calls
+                    ],
+                )
+            )
+            return
+
+        for word in reply.content.split(" "):
+            await asyncio.sleep(TOKEN_DELAY)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(word + " ", chunk=chunk)
+            yield chunk
+
+
+class FakeQuery:
+    """Query de Supabase cuyo execute() tarda RPC_DELAY segundos."""
+
+    async def execute(self):
+        await asyncio.sleep(RPC_DELAY)
+        return SimpleNamespace(data=[])
+
+
+class FakeSupabase:
+    def rpc(self, name, params):
+        return FakeQuery()
+
+
+class FakeEmbeddings:
+    async def create(self, model, input):
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[0.0] * 8)])
+
+
+class FakeWebSocket:
+    """Registra cada evento enviado junto con el instante en que se envió."""
+
+    def __init__(self):
+        self.events: list[tuple[float, dict]] = []
+
+    async def send_text(self, data: str):
+        self.events.append((time.perf_counter(), json.loads(data)))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def install_fakes():
+    graph.model = FakeChatModel()
+    supabase_service._async_client = FakeSupabase()
+    embeddings._async_client = SimpleNamespace(embeddings=FakeEmbeddings())
+
+
+async def run_sessions() -> tuple[FakeWebSocket, FakeWebSocket]:
+    install_fakes()
+    searcher, talker = FakeWebSocket(), FakeWebSocket()
+    searcher_channel, talker_channel = OutboundChannel(searcher), OutboundChannel(talker)
+
+    async def run(channel, session_id, message):
+        await handle_chat_message(channel, session_id, message)
+        await channel.flush()
+
+    await asyncio.gather(
+        run(searcher_channel, "session-search", "busca cenotes en Tulum"),
+        run(talker_channel, "session-stream", "cuéntame de Yucatán"),
+    )
+    return searcher, talker
+
+
+def test_concurrent_sessions_keep_streaming():
+    searcher, talker = asyncio.run(run_sessions())
+
+    # Los tokens llegan agrupados en frames; medir la pausa entre frames
+    frames = [(t, event) for t, event in talker.events if event["type"] == "token"]
+    frame_times = [t for t, _ in frames]
+    gaps = [b - a for a, b in zip(frame_times, frame_times[1:])]
+    max_gap = max(gaps)
+    tokens = "".join(event["content"] for _, event in frames).split()
+    talker_done = talker.events[-1][0]
+    searcher_done = searcher.events[-1][0]
+
+    print(f"Tokens recibidos: {len(tokens)} en {len(frames)} frames")
+    print(f"Mayor pausa entre frames: {max_gap * 1000:.1f} ms")
+
+    assert len(tokens) == TOKENS
+    # Con la ruta síncrona la RPC bloqueaba el loop ~RPC_DELAY segundos
+    assert max_gap < RPC_DELAY / 4
+    # La sesión que sólo conversa termina antes que la búsqueda lenta
+    assert talker_done < searcher_done
+    assert any(event["type"] == "tool_end" for _, event in searcher.events)
+
+
+if __name__ == "__main__":
+    test_concurrent_sessions_keep_streaming()
+    print("✅ Las sesiones concurrentes siguen recibiendo tokens")
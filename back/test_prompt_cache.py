@@ -0,0 +1,110 @@
+"""
+Verifica la estructura del system message para el prompt caching de Anthropic:
+bloque fijo con cache_control primero y contexto dinámico después.
+    uv run python test_prompt_cache.py
+"""
+
+import asyncio
+import os
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+from langchain_anthropic.chat_models import _format_messages  # noqa: E402
+from langchain_core.messages import AIMessageChunk, HumanMessage  # noqa: E402
+
+import app.agent.graph as graph  # noqa: E402
+from app.agent.prompts import SYSTEM_PROMPT  # noqa: E402
+from app.services.metrics import MODEL_TOKENS  # noqa: E402
+
+SEARCH_RESULTS = [
+    {"id": "exp-1", "name": "Cenote Dos Ojos", "location": "Tulum"},
+    {"id": "exp-2", "name": "Ruinas de Cobá", "location": "Cobá"},
+]
+
+
+def test_static_prefix_is_cacheable():
+    message = graph.build_system_message({"messages": []})
+
+    assert message.content == [
+        {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+    ]
+
+
+def test_dynamic_context_goes_after_the_cached_block():
+    state = {
+        "messages": [],
+        "last_search_results": SEARCH_RESULTS,
+        "conversation_summary": "El usuario viaja con dos niños.",
+    }
+    first, second = graph.build_system_message(state).content
+
+    # El bloque cacheable no depende de la sesión
+    assert first["text"] == SYSTEM_PROMPT
+    assert first["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in second
+    assert "Cenote Dos Ojos (ID: exp-1)" in second["text"]
+    assert "El usuario viaja con dos niños." in second["text"]
+
+
+def test_static_block_is_identical_across_sessions():
+    one = graph.build_system_message({"messages": [], "last_search_results": SEARCH_RESULTS})
+    other = graph.build_system_message({"messages": [], "conversation_summary": "Otro"})
+    assert one.content[0] == other.content[0]
+
+
+def test_cache_control_reaches_the_anthropic_payload():
+    system, _ = _format_messages(
+        [graph.build_system_message({"messages": []}), HumanMessage(content="hola")],
+        model="claude-sonnet-4-20250514",
+    )
+    assert system[0]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_tool_schemas_are_stable():
+    first = [tool.tool_call_schema.model_json_schema() for tool in graph.tools]
+    second = [tool.tool_call_schema.model_json_schema() for tool in graph.tools]
+    assert first == second
+    assert [tool.name for tool in graph.tools] == [
+        "search_rutopia_experiences",
+        "get_experience_details",
+    ]
+
+
+def test_cache_read_tokens_are_recorded():
+    class CachedModel:
+        async def astream(self, messages, config):
+            yield AIMessageChunk(content="hola")
+            yield AIMessageChunk(
+                content="",
+                usage_metadata={
+                    "input_tokens": 1500,
+                    "output_tokens": 1,
+                    "total_tokens": 1501,
+                    "input_token_details": {"cache_read": 1200, "cache_creation": 0},
+                },
+            )
+
+    def cache_read_total():
+        return MODEL_TOKENS._values.get((("direction", "cache_read"),), 0)
+
+    before = cache_read_total()
+    original, graph.model = graph.model, CachedModel()
+    try:
+        record = {}
+        asyncio.run(graph.stream_model([], {}, record))
+    finally:
+        graph.model = original
+
+    assert record["tokens_cache_read"] == 1200
+    assert "tokens_cache_creation" not in record
+    assert cache_read_total() - before == 1200
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
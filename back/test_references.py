@@ -0,0 +1,99 @@
+"""
+Verifica el resolver de referencias a resultados ya mostrados ("el primero",
+"the second one", por nombre) y el par tool_call/ToolMessage que inyecta.
+    uv run python test_references.py
+"""
+
+import asyncio
+import os
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import app.agent.tools as tools  # noqa: E402
+from app.agent.references import find_references, resolve_references  # noqa: E402
+
+RESULTS = [
+    {"id": "exp-1", "name": "Nado en el Cenote Dos Ojos", "location": "Tulum"},
+    {"id": "exp-2", "name": "Bicicleta en las ruinas de Cobá", "location": "Cobá"},
+    {"id": "exp-3", "name": "Kayak en la laguna de Bacalar", "location": "Bacalar"},
+]
+
+
+def ids(message: str) -> tuple[str, list[str]]:
+    kind, experiences = find_references(message, RESULTS)
+    return kind, [exp["id"] for exp in experiences]
+
+
+def test_ordinals_in_spanish_and_english():
+    assert ids("dame más detalles del primero") == ("ordinal", ["exp-1"])
+    assert ids("¿Cuánto cuesta la segunda?") == ("ordinal", ["exp-2"])
+    assert ids("tell me more about the third one") == ("ordinal", ["exp-3"])
+    assert ids("y el último?") == ("ordinal", ["exp-3"])
+    assert ids("me interesa la opción 2") == ("ordinal", ["exp-2"])
+    assert ids("compara el primero y el tercero") == ("ordinal", ["exp-1", "exp-3"])
+
+
+def test_ignores_non_references():
+    # "primero" como adverbio, posición fuera de la lista, pedido de búsqueda
+    assert ids("primero quiero saber el clima") == ("none", [])
+    assert ids("dame detalles del quinto") == ("none", [])
+    assert ids("busca algo parecido al primero") == ("none", [])
+
+
+def test_ignores_ordinals_followed_by_other_nouns():
+    for message in (
+        "¿Qué me recomiendas hacer el primer día?",
+        "Es la primera vez que voy a México",
+        "Llegamos el último día de diciembre",
+        "y para el segundo día?",
+        "the first day we arrive",
+        "opción 2 de hotel",
+        # Fechas y expresiones con ordinal
+        "Llegamos el primero de mayo",
+        "Lo primero que quiero saber es el clima",
+        "el segundo fin de semana de julio",
+        "en la segunda quincena de agosto",
+        "we arrive on the first of May",
+    ):
+        assert ids(message) == ("none", []), message
+
+    # Con un sustantivo de resultado sí es referencia
+    assert ids("me gusta la primera opción") == ("ordinal", ["exp-1"])
+    assert ids("the last one and the first") == ("ordinal", ["exp-3", "exp-1"])
+    assert ids("el segundo por favor") == ("ordinal", ["exp-2"])
+    assert ids("la tercera suena bien") == ("ordinal", ["exp-3"])
+
+
+def test_by_name_needs_distinctive_words():
+    assert ids("¿qué incluye lo de la laguna de Bacalar?") == ("name", ["exp-3"])
+    assert ids("háblame de las ruinas de cobá") == ("name", ["exp-2"])
+    # "Tulum" sólo está en la ubicación y una palabra no alcanza
+    assert ids("algo en el cenote") == ("none", [])
+
+
+def test_injects_a_tool_call_pair():
+    async def fake_details(experience_id: str):
+        return {"id": experience_id, "name": "Kayak en la laguna de Bacalar"}
+
+    original, tools.aget_experience_by_id = tools.aget_experience_by_id, fake_details
+    try:
+        messages = asyncio.run(resolve_references("detalles del tercero", RESULTS))
+    finally:
+        tools.aget_experience_by_id = original
+
+    ai_message, tool_message = messages
+    assert ai_message.tool_calls[0]["name"] == "get_experience_details"
+    assert ai_message.tool_calls[0]["args"] == {"experience_id": "exp-3"}
+    assert tool_message.tool_call_id == ai_message.tool_calls[0]["id"]
+    assert tool_message.artifact["id"] == "exp-3"
+    assert asyncio.run(resolve_references("hola", [])) == []
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
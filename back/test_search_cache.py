@@ -0,0 +1,119 @@
+"""
+Verifica la cache de búsquedas: N búsquedas idénticas concurrentes hacen un
+solo embedding y una sola RPC, y una invalidación (local, durante una búsqueda
+en curso, o de otro worker vía la versión compartida) no deja servir
+resultados viejos.
+    uv run python test_search_cache.py
+"""
+
+import asyncio
+import os
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import app.services.embeddings as embeddings  # noqa: E402
+import app.services.search as search  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.models.schemas import SearchFilters  # noqa: E402
+from app.services.sessions import InMemorySessionStore  # noqa: E402
+from benchmarks.fakes import install_fakes  # noqa: E402
+
+RPC_DELAY = 0.05
+
+
+def fresh_backend():
+    """Backend falso sin caches de una prueba anterior."""
+    db = install_fakes(rpc_delay=RPC_DELAY)
+    search.invalidate_experience_details()
+    embeddings._embedding_cache.clear()
+    return db
+
+
+def test_identical_searches_share_one_rpc():
+    async def check():
+        db = fresh_backend()
+        filters = SearchFilters(semantic_query="Cenotes en  Tulum", city="Tulum")
+        same = SearchFilters(semantic_query=" cenotes en tulum", city="Tulum ")
+
+        results = await asyncio.gather(
+            *(search.asearch_experiences(f, limit=5) for f in [filters, same] * 4)
+        )
+
+        assert db.calls == 1
+        assert embeddings._async_client.embeddings.calls == 1
+        assert all(r == results[0] for r in results) and results[0]
+        assert search.get_search_cache_stats()["in_flight"] == 0
+
+        # Ya en cache: no vuelve a llamar a Supabase
+        assert await search.asearch_experiences(filters, limit=5) == results[0]
+        assert db.calls == 1
+
+    asyncio.run(check())
+
+
+def test_cancelled_waiter_does_not_cancel_the_search():
+    async def check():
+        db = fresh_backend()
+        filters = SearchFilters(semantic_query="ruinas mayas")
+
+        first = asyncio.create_task(search.asearch_experiences(filters, limit=5))
+        second = asyncio.create_task(search.asearch_experiences(filters, limit=5))
+        await asyncio.sleep(RPC_DELAY / 2)
+        first.cancel()
+
+        assert await second
+        assert first.cancelled()
+        assert db.calls == 1
+
+    asyncio.run(check())
+
+
+def test_invalidation_during_a_search_drops_its_result():
+    async def check():
+        db = fresh_backend()
+        filters = SearchFilters(semantic_query="clase de cocina en Oaxaca")
+
+        task = asyncio.create_task(search.asearch_experiences(filters, limit=5))
+        await asyncio.sleep(RPC_DELAY / 2)
+        search.invalidate_experience_details()
+        await task
+
+        # El resultado se calculó antes de invalidar: no sirve para la nueva generación
+        await search.asearch_experiences(filters, limit=5)
+        assert db.calls == 2
+
+    asyncio.run(check())
+
+
+def test_shared_cache_version_invalidates_other_workers():
+    async def check():
+        db = fresh_backend()
+        store = InMemorySessionStore()
+        check_seconds = settings.cache_version_check_seconds
+        settings.cache_version_check_seconds = 0
+        search.use_shared_cache_version(store)
+        try:
+            filters = SearchFilters(semantic_query="nadar con tortugas")
+            await search.asearch_experiences(filters, limit=5)
+            await search.asearch_experiences(filters, limit=5)
+            assert db.calls == 1
+
+            # Otro worker invalida: este lo ve en la próxima búsqueda
+            await store.bump_cache_version()
+            await search.asearch_experiences(filters, limit=5)
+            assert db.calls == 2
+        finally:
+            search.use_shared_cache_version(None)
+            settings.cache_version_check_seconds = check_seconds
+
+    asyncio.run(check())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
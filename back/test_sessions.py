@@ -0,0 +1,184 @@
+"""
+Verifica los stores de sesiones compartidos (SQLite y Redis) como los usan
+varios workers: load/append incremental, cleanup, snapshot viejo de una sesión
+borrada y recreada en otro worker, y la versión compartida de las caches.
+Redis se prueba con un sustituto en memoria de los comandos de redis.asyncio.
+    uv run python test_sessions.py
+"""
+
+import asyncio
+import fnmatch
+import os
+import tempfile
+
+for key in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "SUPABASE_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from app.services.sessions import RedisSessionStore, SQLiteSessionStore  # noqa: E402
+
+
+class FakeRedis:
+    """Los comandos de redis.asyncio (decode_responses=True) que usa RedisSessionStore."""
+
+    def __init__(self):
+        self.data: dict = {}
+
+    async def llen(self, key):
+        return len(self.data.get(key, []))
+
+    async def lrange(self, key, start, end):
+        items = self.data.get(key, [])
+        return items[start:] if end == -1 else items[start : end + 1]
+
+    async def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+        return len(self.data[key])
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    async def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    async def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    async def zrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        scores = self.data.get(key, {})
+        return [m for m, s in sorted(scores.items(), key=lambda i: i[1]) if low <= s <= high]
+
+    async def zrem(self, key, *members):
+        for member in members:
+            self.data.get(key, {}).pop(member, None)
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def get(self, key):
+        value = self.data.get(key)
+        return None if value is None else str(value)
+
+    async def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def keys(self, pattern="*"):
+        return [key for key in self.data if fnmatch.fnmatch(key, pattern)]
+
+
+def sqlite_workers():
+    """Dos stores sobre el mismo archivo, como dos workers de uvicorn."""
+    path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+    return SQLiteSessionStore(path), SQLiteSessionStore(path)
+
+
+def redis_workers():
+    client = FakeRedis()
+    return RedisSessionStore(client), RedisSessionStore(client)
+
+
+WORKERS = {"sqlite": sqlite_workers, "redis": redis_workers}
+
+
+def turn(text: str) -> list:
+    return [HumanMessage(content=text), AIMessage(content=f"respuesta a {text}")]
+
+
+def contents(state) -> list[str]:
+    return [message.content for message in state["messages"]]
+
+
+def test_load_and_append():
+    async def check(make_workers):
+        store, _ = make_workers()
+        assert contents(await store.load("s1")) == []
+
+        await store.append("s1", turn("hola"), {"last_search_results": [{"id": "exp-1"}]})
+        await store.append("s1", turn("detalles"), {"last_search_version": 2})
+        state = await store.load("s1")
+
+        assert contents(state) == ["hola", "respuesta a hola", "detalles", "respuesta a detalles"]
+        assert state["last_search_results"] == [{"id": "exp-1"}]
+        assert state["last_search_version"] == 2
+        assert await store.count() == 1
+
+    for make_workers in WORKERS.values():
+        asyncio.run(check(make_workers))
+
+
+def test_reads_messages_appended_by_another_worker():
+    async def check(make_workers):
+        worker_a, worker_b = make_workers()
+        await worker_a.append("s1", turn("uno"), {})
+        assert len((await worker_a.load("s1"))["messages"]) == 2
+
+        # El snapshot de A tiene 2 mensajes; B agrega un turno
+        await worker_b.append("s1", turn("dos"), {})
+        assert contents(await worker_a.load("s1"))[2:] == ["dos", "respuesta a dos"]
+
+    for make_workers in WORKERS.values():
+        asyncio.run(check(make_workers))
+
+
+def test_stale_snapshot_of_a_recreated_session():
+    async def check(make_workers):
+        worker_a, worker_b = make_workers()
+        await worker_a.append("s1", turn("uno") + turn("dos"), {})
+        assert len((await worker_a.load("s1"))["messages"]) == 4
+
+        # B borra la sesión y se recrea con menos mensajes que el snapshot de A
+        # (max_seq < last_seq en SQLite, llen < len en Redis)
+        assert await worker_b.cleanup(max_age_seconds=-1, keep=set()) == 1
+        await worker_b.append("s1", turn("nueva"), {})
+
+        assert contents(await worker_a.load("s1")) == ["nueva", "respuesta a nueva"]
+
+    for make_workers in WORKERS.values():
+        asyncio.run(check(make_workers))
+
+
+def test_cleanup_keeps_active_sessions():
+    async def check(make_workers):
+        store, _ = make_workers()
+        for session_id in ("s1", "s2", "s3"):
+            await store.append(session_id, turn(session_id), {"last_search_version": 1})
+
+        assert await store.cleanup(max_age_seconds=3600, keep=set()) == 0
+        assert await store.cleanup(max_age_seconds=-1, keep={"s2"}) == 2
+        assert await store.count() == 1
+        assert contents(await store.load("s1")) == []
+        assert contents(await store.load("s2")) == ["s2", "respuesta a s2"]
+        return store
+
+    for name, make_workers in WORKERS.items():
+        store = asyncio.run(check(make_workers))
+        if name == "redis":
+            # No quedan llaves de las sesiones borradas
+            assert store.client.keys("rutopia:session:s1:*") == []
+
+
+def test_cache_version_is_shared():
+    async def check(make_workers):
+        worker_a, worker_b = make_workers()
+        assert await worker_a.get_cache_version() == 0
+        assert await worker_b.bump_cache_version() == 1
+        assert await worker_a.bump_cache_version() == 2
+        assert await worker_b.get_cache_version() == 2
+
+    for make_workers in WORKERS.values():
+        asyncio.run(check(make_workers))
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
@@ -15,6 +15,8 @@ export function useChat() {
     const wsRef = useRef<WebSocket | null>(null);
     const sessionIdRef = useRef<string>(`session-${Date.now()}`);
     const experiencesRef = useRef<Experience[]>([]);
+    // Mensaje del asistente que se está armando con los eventos 'token'
+    const streamingIdRef = useRef<string | null>(null);
 
     useEffect(() => {
         const connectWebSocket = () => {
@@ -30,21 +32,53 @@ export function useChat() {
                 console.log('Mensaje recibido:', data);
 
                 switch (data.type) {
-                    case 'message':
-                        // Guardar mensaje completo directamente
-                        setMessages(prev => [...prev, {
-                            id: `msg-${Date.now()}`,
+                    case 'token': {
+                        // Texto en streaming: se va agregando al mensaje en curso
+                        const content = data.content;
+                        const streamingId = streamingIdRef.current;
+                        if (streamingId === null) {
+                            const id = `msg-${Date.now()}`;
+                            streamingIdRef.current = id;
+                            setMessages(prev => [...prev, { id, role: 'assistant', content }]);
+                        } else {
+                            setMessages(prev => prev.map(m =>
+                                m.id === streamingId ? { ...m, content: m.content + content } : m
+                            ));
+                        }
+                        break;
+                    }
+
+                    case 'message': {
+                        // Respuesta final: reemplaza al mensaje armado con tokens (si lo hay)
+                        const finalMessage: Message = {
+                            id: streamingIdRef.current ?? `msg-${Date.now()}`,
                             role: 'assistant',
                             content: data.content,
                             experiences: [...experiencesRef.current]
-                        }]);
+                        };
+                        if (streamingIdRef.current === null) {
+                            setMessages(prev => [...prev, finalMessage]);
+                        } else {
+                            setMessages(prev => prev.map(m => m.id === finalMessage.id ? finalMessage : m));
+                        }
+                        streamingIdRef.current = null;
                         // Limpiar experiencesRef para el siguiente mensaje
                         // (setExperiences NO se limpia para mantener el mapa con las últimas experiencias)
                         experiencesRef.current = [];
                         break;
+                    }
 
                     case 'thinking_start':
-                        // Opcional: podrías mostrar un indicador de "pensando..."
+                        // Ya hay cupo para el modelo: se quita el aviso de cola
+                        setToolStatus(null);
+                        break;
+
+                    case 'thinking_end':
+                        break;
+
+                    case 'queued':
+                        // Servicio saturado: el turno espera cupo
+                        setToolStatus(`Mucha demanda, estás en la posición ${data.position} de la fila...`);
                         break;
 
                     case 'tool_start':
@@ -62,11 +96,22 @@ export function useChat() {
 
                     case 'done':
                         // Solo limpiar estados, NO guardar mensaje (ya se guardó en 'message')
+                        streamingIdRef.current = null;
                         setIsLoading(false);
+                        setToolStatus(null);
+                        break;
+
+                    case 'cancelled':
+                        // Lo que ya se recibió en streaming queda como respuesta parcial
+                        streamingIdRef.current = null;
+                        experiencesRef.current = [];
+                        setIsLoading(false);
+                        setToolStatus(null);
                         break;
 
                     case 'error':
                         console.error('Error del servidor:', data.message);
+                        streamingIdRef.current = null;
                         setIsLoading(false);
                         setToolStatus(null);
                         break;
@@ -84,6 +129,10 @@ export function useChat() {
             ws.onclose = () => {
                 console.log('WebSocket desconectado');
                 setIsConnected(false);
+                // El turno en curso se corta con la conexión
+                streamingIdRef.current = null;
+                setIsLoading(false);
+                setToolStatus(null);
                 // Reconectar después de 3 segundos
                 setTimeout(connectWebSocket, 3000);
             };
@@ -114,6 +163,7 @@ export function useChat() {
         };
 
         setMessages(prev => [...prev, userMessage]);
+        streamingIdRef.current = null;
         setIsLoading(true);
         // ✅ NO limpiar experiencias aquí
         // Las experiencias se actualizarán cuando llegue el mensaje 'experiences' del WebSocket
@@ -24,10 +24,14 @@ export interface Message {
 }
 
 export type WSMessageType =
+    | { type: 'token'; content: string }
     | { type: 'message'; content: string }
     | { type: 'thinking_start' }
-    | { type: 'tool_start'; message: string }
-    | { type: 'tool_end' }
+    | { type: 'thinking_end' }
+    | { type: 'tool_start'; tool: string; message: string }
+    | { type: 'tool_end'; tool: string }
     | { type: 'experiences'; data: Experience[] }
+    | { type: 'queued'; stage: string; position: number }
     | { type: 'done' }
+    | { type: 'cancelled' }
     | { type: 'error'; message: string };
\ No newline at end of file